@@ -2,12 +2,19 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from app.api.deps import get_db, verify_internal_key
-from app.models import InteractionEventIn, IngestResponse
-from app.services.ingest import ingest_event
+from app.models import (
+    BatchIngestResponse,
+    IngestItemResult,
+    IngestResponse,
+    InteractionEventBatchIn,
+    InteractionEventIn,
+)
+from app.services.ingest import ingest_event, ingest_events_batch
+from app.utils.config import settings
 
 router = APIRouter(prefix="/api", tags=["interactions"], dependencies=[Depends(verify_internal_key)])
 
@@ -15,7 +22,7 @@ router = APIRouter(prefix="/api", tags=["interactions"], dependencies=[Depends(v
 @router.post("/events", response_model=IngestResponse)
 def post_event(evt: InteractionEventIn, db: Session = Depends(get_db)) -> IngestResponse:
     """Log một interaction event giữa 2 users."""
-    inserted_id = ingest_event(
+    result = ingest_event(
         db,
         actor_user_id=evt.actor_user_id,
         target_user_id=evt.target_user_id,
@@ -26,4 +33,31 @@ def post_event(evt: InteractionEventIn, db: Session = Depends(get_db)) -> Ingest
         session_id=evt.session_id,
         metadata=evt.metadata,
     )
-    return IngestResponse(inserted_id=inserted_id)
+    return IngestResponse(inserted_id=result.inserted_id, status=result.status)
+
+
+@router.post("/events/batch", response_model=BatchIngestResponse)
+def post_events_batch(batch: InteractionEventBatchIn, db: Session = Depends(get_db)) -> BatchIngestResponse:
+    """Log nhiều interaction events trong 1 request (1 transaction, multi-row insert)."""
+    if len(batch.events) > settings.INGEST_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"events must contain at most {settings.INGEST_BATCH_MAX_SIZE} items",
+        )
+
+    results = ingest_events_batch(db, batch.events)
+    inserted = sum(1 for r in results if r.status == "inserted")
+    rejected = sum(1 for r in results if r.status == "rejected")
+    capped = sum(1 for r in results if r.status == "capped")
+    spooled = sum(1 for r in results if r.status == "spooled")
+    return BatchIngestResponse(
+        inserted=inserted,
+        rejected=rejected,
+        filtered=len(results) - inserted - rejected - capped - spooled,
+        capped=capped,
+        spooled=spooled,
+        results=[
+            IngestItemResult(index=r.index, status=r.status, inserted_id=r.inserted_id, error=r.error)
+            for r in results
+        ],
+    )
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
@@ -19,7 +20,10 @@ from app.models import (
 from app.utils.config import settings
 from app.services.post_candidates import generate_post_candidates
 from app.services.reel_candidates import generate_reel_candidates
+from app.services.cf_artifact import acquire_artifact
+from app.services.friend_graph import get_friend_ids
 from app.services.recommend_db import (
+    UserScoreRow,
     get_similar_users_shared_targets,
     recommend_popular_users,
     recommend_users_neighbors_2hop_weighted,
@@ -42,6 +46,26 @@ def similar_users(
     if window_days < 1 or window_days > 365:
         raise HTTPException(status_code=400, detail="window_days must be in [1, 365]")
 
+    # Artifact CF (train_cf.py) train cho đúng window → tra trực tiếp; user chưa có trong artifact → SQL
+    # (giữ ref tới version đang dùng trong lúc tra → hot reload không unmap giữa chừng)
+    found = None
+    with acquire_artifact() as artifact:
+        if artifact is not None and artifact.window_days == window_days:
+            found = artifact.neighbors(user_id, k=k)
+            built_at = artifact.built_at
+    if found is not None:
+        neighbor_ids, scores = found
+        return SimilarUsersResponse(
+            user_id=user_id,
+            window_days=window_days,
+            neighbors=[
+                UserScore(user_id=uid, score=sc, reason="cosine")
+                for uid, sc in zip(neighbor_ids.tolist(), scores.tolist())
+            ],
+            strategy="cosine_neighbors_artifact",
+            generated_at=datetime.fromisoformat(built_at),
+        )
+
     neighbors, generated_at = get_similar_users_shared_targets(
         db, user_id=user_id, k=k, window_days=window_days
     )
@@ -69,31 +93,38 @@ def recommend_users(
     if window_days < 1 or window_days > 365:
         raise HTTPException(status_code=400, detail="window_days must be in [1, 365]")
 
-    recs, generated_at = recommend_users_neighbors_2hop_weighted(
-        db,
-        user_id=user_id,
-        k=k,
-        window_days=window_days,
-        neighbor_k=neighbor_k,
-    )
-    # Fallback: nếu CF không tìm được candidate, dùng popular users
-    if not recs:
-        from sqlalchemy import select
-        from app.models.models import Friend
-        # Lấy danh sách bạn bè để loại bỏ khỏi cả kết quả fallback
-        friends_q = select(Friend.friend_id).where(Friend.user_id == user_id)
-        friends_rev_q = select(Friend.user_id).where(Friend.friend_id == user_id)
-        exclude_ids = {user_id}
-        exclude_ids.update({int(r[0]) for r in db.execute(friends_q).all()})
-        exclude_ids.update({int(r[0]) for r in db.execute(friends_rev_q).all()})
-
-        fallback_recs, generated_at = recommend_popular_users(
+    # Artifact CF train cho đúng (window, neighbor_k) → đề xuất đã tính sẵn, chỉ lọc bạn bè
+    found = None
+    with acquire_artifact() as artifact:
+        if artifact is not None and artifact.window_days == window_days and artifact.neighbor_k == neighbor_k:
+            friend_ids = get_friend_ids(db, user_id)
+            found = artifact.recommendations(user_id, k=k, exclude_user_ids=friend_ids)
+            built_at = artifact.built_at
+    if found is not None:
+        rec_ids, scores = found
+        recs = [
+            UserScoreRow(user_id=uid, score=sc, reason="neighbors_2hop_weighted")
+            for uid, sc in zip(rec_ids.tolist(), scores.tolist())
+        ]
+        generated_at = datetime.fromisoformat(built_at)
+        # Fallback: artifact không có đề xuất → popular users (loại bạn bè + chính user)
+        if not recs:
+            recs, generated_at = recommend_popular_users(
+                db,
+                exclude_user_ids=friend_ids | {user_id},
+                k=k,
+                window_days=window_days,
+            )
+    else:
+        # 2-hop + fallback popular trong cùng 1 câu SQL
+        recs, generated_at = recommend_users_neighbors_2hop_weighted(
             db,
-            exclude_user_ids=exclude_ids,
+            user_id=user_id,
             k=k,
             window_days=window_days,
+            neighbor_k=neighbor_k,
+            popular_fallback=True,
         )
-        recs = fallback_recs
 
     return RecommendUsersResponse(
         user_id=user_id,
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Script to backfill interaction events from an NDJSON or CSV stream.
+Rows are validated on the fly and written with COPY FROM STDIN in chunks.
+
+Usage:
+    python app/jobs/backfill_events.py events.ndjson
+    python app/jobs/backfill_events.py events.csv --chunk-rows 100000
+    cat events.ndjson | python app/jobs/backfill_events.py - --format ndjson
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.bulk_ingest import bulk_load_records, iter_csv_records, iter_ndjson_records
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Backfill user_interaction_events via COPY")
+    parser.add_argument("path", help="Đường dẫn file NDJSON/CSV, hoặc '-' để đọc từ stdin")
+    parser.add_argument(
+        "--format",
+        choices=("ndjson", "csv"),
+        default=None,
+        help="Định dạng input (mặc định đoán theo đuôi file, stdin = ndjson)",
+    )
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="Số row mỗi lần COPY + commit")
+    return parser.parse_args()
+
+
+def run_backfill(path: str, fmt: str | None, chunk_rows: int) -> None:
+    """Main function to run the backfill job."""
+    if fmt is None:
+        fmt = "csv" if path.lower().endswith(".csv") else "ndjson"
+
+    print("=" * 60)
+    print(f"📥 Starting event backfill at {utcnow()} ({fmt}, chunk={chunk_rows})")
+    print("=" * 60)
+
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8", newline="")
+    db = SessionLocal()
+    try:
+        records = iter_csv_records(f) if fmt == "csv" else iter_ndjson_records(f)
+        stats = bulk_load_records(db, records, chunk_rows=chunk_rows)
+
+        print("\n✅ Success!")
+        print(f"   Loaded {stats.accepted} events in {stats.chunks} chunks ({stats.elapsed_s:.1f}s, {stats.rows_per_sec:,.0f} rows/s)")
+        print(f"   Rejected {stats.rejected} events")
+        for line_no, error in stats.errors[:20]:
+            print(f"   - line {line_no}: {error}")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during backfill job: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+        if f is not sys.stdin:
+            f.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_backfill(args.path, args.format, args.chunk_rows)
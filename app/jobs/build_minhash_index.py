@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Script to build the MinHash/LSH index behind /api/similar-users from the daily rollup.
+Each actor's distinct targets in the window get a MinHash signature; banded LSH buckets give
+candidate neighbors, re-scored with the exact shared-target count at query time. The API
+serves from the index (CF_MINHASH_INDEX_PATH) when the requested window_days matches.
+Run periodically (e.g. hourly) via cron/task scheduler.
+
+Usage:
+    python app/jobs/build_minhash_index.py
+    python app/jobs/build_minhash_index.py --days 30 --num-perm 128 --bands 64 --out artifacts/minhash_30d
+    python app/jobs/build_minhash_index.py --report 500 --k 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.minhash_lsh import build_minhash_index_from_db, recall_report, save_minhash_index
+from app.utils.config import settings
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the MinHash/LSH shared-target neighbor index")
+    parser.add_argument("--days", type=int, default=30, help="Window (ngày) của tập target, = window_days của API")
+    parser.add_argument("--num-perm", type=int, default=settings.CF_MINHASH_NUM_PERM, help="Số hàm hash / chữ ký")
+    parser.add_argument("--bands", type=int, default=settings.CF_MINHASH_BANDS, help="Số băng LSH")
+    parser.add_argument("--seed", type=int, default=0, help="Seed sinh hệ số hash")
+    parser.add_argument(
+        "--out",
+        default=settings.CF_MINHASH_INDEX_PATH,
+        help="Thư mục index (mặc định CF_MINHASH_INDEX_PATH); bỏ trống = chỉ build + report",
+    )
+    parser.add_argument("--report", type=int, default=0, help="Đo recall so với top-k chính xác trên N actor (0 = bỏ qua)")
+    parser.add_argument("--k", type=int, default=settings.DEFAULT_K, help="k của recall report")
+    return parser.parse_args()
+
+
+def run_build(days: int, num_perm: int, bands: int, seed: int, out: str | None, report: int, k: int) -> None:
+    """Main function to run the index build job."""
+    print("=" * 60)
+    print(f"🔎 Starting MinHash/LSH index build at {utcnow()} (window={days}d, num_perm={num_perm}, bands={bands})")
+    print("=" * 60)
+
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        index = build_minhash_index_from_db(db, window_days=days, num_perm=num_perm, bands=bands, seed=seed)
+        elapsed = time.perf_counter() - t0
+
+        print("\n✅ Success!")
+        print(f"   Indexed {len(index)} actors / {len(index.targets)} (actor, target) pairs in {elapsed:.2f}s")
+        if out:
+            print(f"   Saved index to {save_minhash_index(index, out)}")
+        else:
+            print("   --out / CF_MINHASH_INDEX_PATH not set – index not saved")
+        if report > 0:
+            r = recall_report(index, k=k, sample_size=report, seed=seed)
+            print(f"   Recall@{r.k} on {r.sampled} actors: {r.recall:.4f}")
+            print(f"   Candidates / query: {r.mean_candidates:.1f} ({100 * r.candidate_fraction:.2f}% of actors)")
+            print(f"   Query time: LSH {r.lsh_ms_per_query:.3f} ms, exact {r.exact_ms_per_query:.3f} ms")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during index build: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_build(args.days, args.num_perm, args.bands, args.seed, args.out, args.report, args.k)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Script to build the SimHash ANN index over the CF matrix and report its recall / latency.
+Rows of M (aggregate_pair_scores → build_sparse_matrix, pruned like train_cf.py) are L2-normalized
+and hashed into CF_SIMHASH_TABLES tables of CF_SIMHASH_BITS bits; queries probe buckets within
+CF_SIMHASH_PROBE_RADIUS bits and re-rank candidates by exact cosine. Use --report to pick the
+settings used by `train_cf.py --ann` (more tables / fewer bits / larger radius → higher recall, slower).
+
+Usage:
+    python app/jobs/build_simhash_index.py --report 500
+    python app/jobs/build_simhash_index.py --days 30 --tables 24 --bits 10 --probe-radius 2 --report 500 --k 20
+    python app/jobs/build_simhash_index.py --out artifacts/simhash_30d
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.matrix import build_sparse_matrix, prune_topk_rows
+from app.services.preprocess import aggregate_pair_scores
+from app.services.simhash_ann import build_simhash_index, recall_report, save_simhash_index
+from app.utils.config import settings
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the SimHash ANN index for cosine neighbors and report recall")
+    parser.add_argument("--days", type=int, default=30, help="Window (ngày), = --days của train_cf.py")
+    parser.add_argument("--topk-per-actor", type=int, default=1000, help="Edge pruning trước khi hash, như train_cf.py")
+    parser.add_argument("--tables", type=int, default=settings.CF_SIMHASH_TABLES, help="Số bảng hash")
+    parser.add_argument("--bits", type=int, default=settings.CF_SIMHASH_BITS, help="Số bit / bảng (<= 64)")
+    parser.add_argument(
+        "--probe-radius", type=int, default=settings.CF_SIMHASH_PROBE_RADIUS, help="Bán kính Hamming khi dò bucket"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed sinh vector chiếu")
+    parser.add_argument("--out", default=None, help="Thư mục lưu index (.npy + meta.json); bỏ trống = không lưu")
+    parser.add_argument("--report", type=int, default=0, help="Đo recall so với top-k chính xác trên N user (0 = bỏ qua)")
+    parser.add_argument("--k", type=int, default=settings.DEFAULT_K, help="k của recall report")
+    return parser.parse_args()
+
+
+def run_build(
+    days: int,
+    topk_per_actor: int,
+    tables: int,
+    bits: int,
+    probe_radius: int,
+    seed: int,
+    out: str | None,
+    report: int,
+    k: int,
+) -> None:
+    """Main function to run the index build job."""
+    print("=" * 60)
+    print(
+        f"🔎 Starting SimHash index build at {utcnow()} "
+        f"(window={days}d, tables={tables}, bits={bits}, probe_radius={probe_radius})"
+    )
+    print("=" * 60)
+
+    db = SessionLocal()
+    try:
+        pairs = aggregate_pair_scores(db, window_days=days, half_life_days=float(days))
+        M, index = build_sparse_matrix(pairs, topk_per_actor=0)
+        M_sim = prune_topk_rows(M, topk_per_actor) if topk_per_actor > 0 else M
+
+        t0 = time.perf_counter()
+        ann = build_simhash_index(M_sim, index, tables=tables, bits=bits, seed=seed)
+        elapsed = time.perf_counter() - t0
+
+        print("\n✅ Success!")
+        print(f"   Indexed {len(ann)} users / {len(ann.targets)} (user, target) entries in {elapsed:.2f}s")
+        if out:
+            print(f"   Saved index to {save_simhash_index(ann, out)}")
+        if report > 0:
+            r = recall_report(ann, k=k, sample_size=report, probe_radius=probe_radius, seed=seed)
+            print(f"   Recall@{r.k} on {r.sampled} users: {r.recall:.4f}")
+            print(f"   Candidates / query: {r.mean_candidates:.1f} ({100 * r.candidate_fraction:.2f}% of users)")
+            print(f"   Query time: ANN {r.lsh_ms_per_query:.3f} ms, exact {r.exact_ms_per_query:.3f} ms")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during index build: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_build(
+        args.days,
+        args.topk_per_actor,
+        args.tables,
+        args.bits,
+        args.probe_radius,
+        args.seed,
+        args.out,
+        args.report,
+        args.k,
+    )
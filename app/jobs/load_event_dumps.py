@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Script to load exported event dumps (CSV/Parquet) into user_interaction_events.
+Files are read in fixed-size chunks, validated column-wise and bulk-loaded with binary COPY.
+
+Usage:
+    python app/jobs/load_event_dumps.py exports/events-2026-01-*.parquet
+    python app/jobs/load_event_dumps.py exports/events.csv --chunk-rows 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import sys
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.bulk_ingest import BulkLoadStats
+from app.services.columnar_ingest import load_event_dump
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load CSV/Parquet event dumps via binary COPY")
+    parser.add_argument("paths", nargs="+", help="File hoặc glob pattern (.csv, .parquet)")
+    parser.add_argument("--chunk-rows", type=int, default=500_000, help="Số row mỗi chunk (đọc + COPY + commit)")
+    return parser.parse_args()
+
+
+def run_load(patterns: list[str], chunk_rows: int) -> None:
+    """Main function to run the loader job."""
+    paths = sorted({p for pattern in patterns for p in (glob.glob(pattern) or [pattern])})
+
+    print("=" * 60)
+    print(f"📦 Starting event dump load at {utcnow()} ({len(paths)} files, chunk={chunk_rows})")
+    print("=" * 60)
+
+    db = SessionLocal()
+    total = BulkLoadStats()
+    try:
+        for path in paths:
+            before_rows, before_s = total.accepted, total.elapsed_s
+            load_event_dump(db, path, chunk_rows=chunk_rows, stats=total)
+            rows, secs = total.accepted - before_rows, total.elapsed_s - before_s
+            rate = rows / secs if secs > 0 else 0.0
+            print(f"   {path}: {rows} rows in {secs:.1f}s ({rate:,.0f} rows/s)")
+
+        print("\n✅ Success!")
+        print(f"   Loaded {total.accepted} events in {total.chunks} chunks ({total.elapsed_s:.1f}s, {total.rows_per_sec:,.0f} rows/s)")
+        print(f"   Rejected {total.rejected} events")
+        for line_no, error in total.errors[:20]:
+            print(f"   - row {line_no}: {error}")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during load job: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_load(args.paths, args.chunk_rows)
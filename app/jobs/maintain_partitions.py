@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Script to maintain range partitions of user_interaction_events.
+Creates partitions for upcoming periods and drops (or detaches for archiving)
+partitions older than the retention window; the daily rollup, event metadata and
+materialized pair scores get the same retention, and the pair-score window
+slides forward to today.
+Run daily via cron/task scheduler.
+
+Usage:
+    python app/jobs/maintain_partitions.py
+    python app/jobs/maintain_partitions.py --ahead 6 --retention-days 365 --detach
+    python app/jobs/maintain_partitions.py --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.daily_agg import expire_daily_rows
+from app.services.event_meta import expire_event_meta
+from app.services.pair_scores import expire_pair_scores, pair_scores_enabled, slide_pair_window
+from app.services.partitions import (
+    ensure_future_partitions,
+    expire_partitions,
+    is_partitioned,
+    list_event_partitions,
+)
+from app.utils.config import settings
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Create future / expire old user_interaction_events partitions")
+    parser.add_argument("--ahead", type=int, default=settings.EVENTS_PARTITIONS_AHEAD, help="Số kỳ tạo trước")
+    parser.add_argument(
+        "--interval",
+        choices=("month", "week"),
+        default=settings.EVENTS_PARTITION_INTERVAL,
+        help="Độ dài 1 partition",
+    )
+    parser.add_argument(
+        "--retention-days",
+        type=int,
+        default=settings.EVENTS_RETENTION_DAYS,
+        help="Partition kết thúc trước (hôm nay - N ngày) bị xử lý",
+    )
+    parser.add_argument("--detach", action="store_true", help="DETACH (giữ bảng để archive) thay vì DROP")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ in partitions sẽ bị xử lý")
+    return parser.parse_args()
+
+
+def run_maintenance(ahead: int, interval: str, retention_days: int, detach: bool, dry_run: bool) -> None:
+    """Main function to run the partition maintenance job."""
+    print("=" * 60)
+    print(f"🗂️  Starting partition maintenance at {utcnow()} (interval={interval}, retention={retention_days}d)")
+    print("=" * 60)
+
+    db = SessionLocal()
+    try:
+        if not is_partitioned(db):
+            print("\n⚠️ user_interaction_events is not partitioned – run sql/003_partition_user_interaction_events.sql first")
+            sys.exit(1)
+
+        created = [] if dry_run else ensure_future_partitions(db, ahead=ahead, interval=interval)
+        expired = expire_partitions(db, retention_days=retention_days, detach=detach, dry_run=dry_run)
+        # Rollup ngày + side table session/metadata + pair scores dùng cùng retention với raw events
+        daily_deleted = meta_deleted = pairs_deleted = pair_days = 0
+        if not dry_run:
+            pair_days = slide_pair_window(db) if pair_scores_enabled() else 0
+            before = utcnow().date() - timedelta(days=retention_days)
+            daily_deleted = expire_daily_rows(db, before=before)
+            meta_deleted = expire_event_meta(db, before=before)
+            pairs_deleted = expire_pair_scores(db, before=before)
+
+        print("\n✅ Success!")
+        print(f"   Created {len(created)} partitions: {', '.join(created) or '-'}")
+        action = "Would expire" if dry_run else ("Detached" if detach else "Dropped")
+        print(f"   {action} {len(expired)} partitions: {', '.join(expired) or '-'}")
+        print(f"   Deleted {daily_deleted} user_interaction_daily rows older than retention")
+        print(f"   Deleted {meta_deleted} user_interaction_event_meta rows older than retention")
+        print(f"   Deleted {pairs_deleted} user_pair_scores rows with no interaction within retention")
+        print(f"   Slid user_pair_scores window forward by {pair_days} days")
+        partitions = list_event_partitions(db)
+        if partitions:
+            print(f"   Now {len(partitions)} partitions: {partitions[0].start} → {partitions[-1].end}")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during partition maintenance: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_maintenance(args.ahead, args.interval, args.retention_days, args.detach, args.dry_run)
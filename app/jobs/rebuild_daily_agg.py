@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Script to (re)build the user_interaction_daily rollup from raw events.
+Ingest keeps the rollup up to date; run this once after enabling it on an existing
+database, or to repair days written outside the service (manual SQL, restores).
+
+Usage:
+    python app/jobs/rebuild_daily_agg.py --days 365
+    python app/jobs/rebuild_daily_agg.py --since 2026-01-01 --until 2026-02-01
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.daily_agg import rebuild_daily_from_events
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Rebuild user_interaction_daily from user_interaction_events")
+    parser.add_argument("--days", type=int, default=30, help="Số ngày gần nhất cần rebuild (bỏ qua nếu có --since)")
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="Ngày bắt đầu (YYYY-MM-DD, UTC)")
+    parser.add_argument("--until", type=date.fromisoformat, default=None, help="Ngày kết thúc, không gồm (YYYY-MM-DD)")
+    return parser.parse_args()
+
+
+def run_rebuild(since: date, until: date | None) -> None:
+    """Main function to run the rebuild job."""
+    print("=" * 60)
+    print(f"🧱 Starting daily rollup rebuild at {utcnow()} ({since} → {until or 'now'})")
+    print("=" * 60)
+
+    db = SessionLocal()
+    try:
+        written = rebuild_daily_from_events(db, since=since, until=until)
+
+        print("\n✅ Success!")
+        print(f"   Upserted {written} (actor, target, content, event_type, day) rows")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during rebuild job: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    since = args.since or (utcnow().date() - timedelta(days=args.days))
+    run_rebuild(since, args.until)
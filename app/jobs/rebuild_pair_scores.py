@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Script to (re)build the materialized user_pair_scores table from the daily rollup.
+Ingest keeps the table up to date and maintain_partitions.py slides its window daily; run
+this once after enabling it (or after changing PAIR_SCORES_HALF_LIFE_DAYS /
+PAIR_SCORES_WINDOW_DAYS / running rebuild_daily_agg.py). Readers only switch to the table
+after the first successful rebuild (watermark in cf_watermarks), for the same window only.
+
+Usage:
+    python app/jobs/rebuild_pair_scores.py
+    python app/jobs/rebuild_pair_scores.py --days 7
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.pair_scores import pair_scores_enabled, rebuild_pair_scores
+from app.utils.config import settings
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Rebuild user_pair_scores from user_interaction_daily")
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=settings.PAIR_SCORES_WINDOW_DAYS,
+        help="Window (số ngày rollup gần nhất) của store; reader chỉ dùng store với đúng window này",
+    )
+    return parser.parse_args()
+
+
+def run_rebuild(days: int) -> None:
+    """Main function to run the rebuild job."""
+    print("=" * 60)
+    print(
+        f"🧮 Starting pair score rebuild at {utcnow()} "
+        f"(window {days}d, half-life {settings.PAIR_SCORES_HALF_LIFE_DAYS}d)"
+    )
+    print("=" * 60)
+
+    if not pair_scores_enabled():
+        print("\n⚠️ PAIR_SCORES_ENABLED is off (or half-life <= 0) – ingest would not keep the table up to date")
+        sys.exit(1)
+
+    db = SessionLocal()
+    try:
+        written = rebuild_pair_scores(db, window_days=days)
+
+        print("\n✅ Success!")
+        print(f"   Wrote {written} (actor, target) pair scores")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during rebuild job: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_rebuild(args.days)
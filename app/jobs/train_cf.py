@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Script to train the CF model offline and publish it as a versioned artifact.
+Runs aggregate_pair_scores → build_sparse_matrix → topk_user_neighbors, precomputes 2-hop
+recommendations, writes flat NumPy arrays to MODEL_PATH/<version>/ and publishes it in
+MODEL_PATH/manifest.json (version + checksums). Running API workers hot reload the published
+version; /api/similar-users and /api/recommend-users serve from it (requests with another
+window_days / neighbor_k, or unknown users, still use SQL).
+With --incremental, only actors whose rollup rows were written since the last run (ingest time,
+user_interaction_daily.updated_at; watermark in cf_watermarks) are re-aggregated and patched into
+the pair-score matrix stored with the published version; their rows and those of actors sharing
+targets with them are recomputed, other rows are copied. Falls back to a full train when there is
+no matching watermark or the published version has no stored matrix. Run incrementally often
+(e.g. every 15 minutes) and fully once a day so data leaving the window is dropped.
+With --ann, a full train takes neighbors from a SimHash ANN index (CF_SIMHASH_TABLES / BITS /
+PROBE_RADIUS) instead of exact all-pairs cosine; measure recall for those settings with
+app/jobs/build_simhash_index.py --report. Incremental runs recompute affected rows exactly.
+Run periodically via cron/task scheduler.
+
+Usage:
+    python app/jobs/train_cf.py
+    python app/jobs/train_cf.py --days 30 --neighbor-k 100 --workers 4
+    python app/jobs/train_cf.py --out artifacts/cf --keep 5
+    python app/jobs/train_cf.py --incremental
+    python app/jobs/train_cf.py --ann
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path (needed if run from anywhere)
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.cf_artifact import (
+    WATERMARK_NAME,
+    incremental_base,
+    refresh_cf_artifact,
+    save_cf_artifact,
+    train_cf_artifact,
+    watermark_params,
+)
+from app.services.watermarks import set_watermark
+from app.utils.config import settings
+from app.utils.database import SessionLocal
+from app.services.time_utils import utcnow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train CF neighbors / recommendations into a versioned artifact")
+    parser.add_argument("--days", type=int, default=30, help="Window (ngày), = window_days của API")
+    parser.add_argument("--neighbor-k", type=int, default=100, help="Số neighbors / user, = neighbor_k của API")
+    parser.add_argument("--rec-k", type=int, default=settings.MAX_K, help="Số đề xuất lưu / user")
+    parser.add_argument("--topk-per-actor", type=int, default=1000, help="Edge pruning trước khi tính similarity")
+    parser.add_argument("--workers", type=int, default=settings.CF_SIM_WORKERS, help="Số process tính similarity")
+    parser.add_argument("--out", default=settings.MODEL_PATH, help="Thư mục gốc chứa các version (mặc định MODEL_PATH)")
+    parser.add_argument("--keep", type=int, default=3, help="Số version giữ lại")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Chỉ tính lại actor có event mới từ lần chạy trước (+ actor chung target); không có mốc → train toàn bộ",
+    )
+    parser.add_argument(
+        "--ann",
+        action="store_true",
+        help="Train toàn bộ: neighbors qua index ANN SimHash (xấp xỉ) thay vì cosine all-pairs",
+    )
+    return parser.parse_args()
+
+
+def run_train(
+    days: int,
+    neighbor_k: int,
+    rec_k: int,
+    topk_per_actor: int,
+    workers: int,
+    out: str,
+    keep: int,
+    incremental: bool = False,
+    ann: bool = False,
+) -> None:
+    """Main function to run the training job."""
+    print("=" * 60)
+    print(f"🧠 Starting CF training at {utcnow()} (window={days}d, neighbor_k={neighbor_k}, rec_k={rec_k})")
+    print("=" * 60)
+
+    db = SessionLocal()
+    try:
+        started_at = utcnow()
+        t0 = time.perf_counter()
+        base = None
+        if incremental:
+            base = incremental_base(
+                db, out, window_days=days, neighbor_k=neighbor_k, rec_k=rec_k, topk_per_actor=topk_per_actor
+            )
+            if base is None:
+                print("⚠️ No watermark matching the published version / parameters – running a full train")
+        if base is not None:
+            artifact, recomputed = refresh_cf_artifact(db, base[0], since=base[1], topk_per_actor=topk_per_actor)
+        else:
+            artifact = train_cf_artifact(
+                db,
+                window_days=days,
+                neighbor_k=neighbor_k,
+                rec_k=rec_k,
+                topk_per_actor=topk_per_actor,
+                workers=workers,
+                ann=ann,
+            )
+            recomputed = len(artifact)
+        elapsed = time.perf_counter() - t0
+        path = save_cf_artifact(artifact, out, keep=keep)
+        set_watermark(db, WATERMARK_NAME, started_at, watermark_params(artifact, topk_per_actor=topk_per_actor))
+        db.commit()
+
+        print("\n✅ Success!")
+        mode = f"incremental since {base[1]}" if base is not None else ("full, ANN" if ann else "full")
+        print(f"   Recomputed {recomputed} / {len(artifact)} users in {elapsed:.2f}s ({mode})")
+        print(f"   {len(artifact.nb_ids)} neighbors, {len(artifact.rec_ids)} recommendations")
+        print(f"   Published version {artifact.version} → {path}")
+        print("-" * 60)
+
+    except Exception as e:
+        print(f"\n❌ Error during training job: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_train(
+        args.days,
+        args.neighbor_k,
+        args.rec_k,
+        args.topk_per_actor,
+        args.workers,
+        args.out,
+        args.keep,
+        args.incremental,
+        args.ann,
+    )
@@ -1,20 +1,29 @@
 """Database models and Pydantic schemas."""
 
 from app.models.models import (
+    CfWatermark,
     Comment,
+    EventType,
     Friend,
+    IngestSpoolOffset,
     Post,
     Reel,
     PostLike,
     PostMedia,
     User,
     UserInteractionEvent,
+    UserInteractionEventMeta,
+    UserInteractionDaily,
+    UserPairScore,
     UserPostEngagement,
     UserReelEngagement,
     UserProfileFeatures,
 )
 from app.models.schemas import (
+    BatchIngestResponse,
+    IngestItemResult,
     IngestResponse,
+    InteractionEventBatchIn,
     InteractionEventIn,
     PostScore,
     ReelScore,
@@ -26,7 +35,13 @@ from app.models.schemas import (
 )
 
 __all__ = [
+    "EventType",
     "UserInteractionEvent",
+    "UserInteractionEventMeta",
+    "UserInteractionDaily",
+    "UserPairScore",
+    "CfWatermark",
+    "IngestSpoolOffset",
     "Post",
     "Reel",
     "Friend",
@@ -39,6 +54,9 @@ __all__ = [
     "UserProfileFeatures",
     "InteractionEventIn",
     "IngestResponse",
+    "InteractionEventBatchIn",
+    "IngestItemResult",
+    "BatchIngestResponse",
     "UserScore",
     "PostScore",
     "ReelScore",
@@ -14,40 +14,144 @@ from sqlalchemy import (
     Index,
     Integer,
     JSON,
+    SmallInteger,
     String,
+    func,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.utils.database import Base
 
 
+class EventType(Base):
+    """Lookup mã smallint ↔ tên event type, đồng bộ từ EVENT_TYPE_CODES / EVENT_WEIGHTS lúc startup."""
+
+    __tablename__ = "event_types"
+
+    code: Mapped[int] = mapped_column(SmallInteger, primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    weight: Mapped[float] = mapped_column(Float, nullable=False)
+
+
 class UserInteractionEvent(Base):
+    """
+    Raw events, range-partitioned theo tháng trên occurred_at (xem sql/001, app/services/partitions.py).
+    Postgres yêu cầu PK chứa partition key → PK = (id, occurred_at).
+
+    event_type lưu mã smallint (EVENT_TYPE_CODES); session_id / meta (ít dùng) nằm ở
+    user_interaction_event_meta để row của bảng nóng nhất gọn nhất có thể.
+    """
+
     __tablename__ = "user_interaction_events"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
 
     actor_user_id: Mapped[int] = mapped_column(Integer, nullable=False)
     target_user_id: Mapped[int] = mapped_column(Integer, nullable=False)
 
-    event_type: Mapped[str] = mapped_column(String, nullable=False)
+    event_type: Mapped[int] = mapped_column(SmallInteger, nullable=False)
     event_value: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
 
     content_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
-    session_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
 
-    occurred_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    occurred_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
 
-    meta: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False, default=dict)
-
     __table_args__ = (
         Index("idx_uie_actor_time", "actor_user_id", "occurred_at"),
         Index("idx_uie_target_time", "target_user_id", "occurred_at"),
         Index("idx_uie_pair_time", "actor_user_id", "target_user_id", "occurred_at"),
         Index("idx_uie_type_time", "event_type", "occurred_at"),
+        {"postgresql_partition_by": "RANGE (occurred_at)"},
     )
 
 
+class UserInteractionEventMeta(Base):
+    """session_id / metadata của event (chỉ có row khi event có 1 trong 2), join theo (event_id, occurred_at)."""
+
+    __tablename__ = "user_interaction_event_meta"
+
+    event_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    occurred_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+
+    session_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    meta: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False, default=dict)
+
+    __table_args__ = (Index("idx_uiem_occurred_at", "occurred_at"),)
+
+
+class UserInteractionDaily(Base):
+    """
+    Rollup của user_interaction_events theo ngày (UTC), cập nhật ngay lúc ingest (xem app/services/daily_agg.py).
+
+    1 row / (actor, target, content, event_type, day); content_id = 0 nếu event không gắn content.
+    event_count gồm cả event vượt cap không được lưu raw (cap-aware ingest).
+    """
+
+    __tablename__ = "user_interaction_daily"
+
+    actor_user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    target_user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    content_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, default=0)
+    event_type: Mapped[int] = mapped_column(SmallInteger, primary_key=True)  # mã EVENT_TYPE_CODES
+    day: Mapped[datetime] = mapped_column(Date, primary_key=True)
+
+    event_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_occurred_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    # Thời điểm ghi gần nhất (giờ ingest, không phải occurred_at) → actor "dirty" cho train_cf.py --incremental
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("idx_uid_day", "day"),
+        Index("idx_uid_actor_day", "actor_user_id", "day"),
+        Index("idx_uid_target_day", "target_user_id", "day"),
+        Index("idx_uid_content_day", "content_id", "day"),
+        Index("idx_uid_updated_at", "updated_at"),
+    )
+
+
+class UserPairScore(Base):
+    """
+    Score (actor, target) đã decay, cập nhật dần lúc ingest (xem app/services/pair_scores.py).
+
+    `score` là giá trị tại thời điểm `as_of`; tại thời điểm t > as_of: score * 2^(-(t - as_of) / half_life).
+    """
+
+    __tablename__ = "user_pair_scores"
+
+    actor_user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    target_user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+
+    score: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    as_of: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    last_interaction_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (Index("idx_ups_last_interaction", "last_interaction_at"),)
+
+
+class CfWatermark(Base):
+    """Mốc của các bảng / artifact CF được duy trì dần (vd. lần rebuild user_pair_scores gần nhất + tham số)."""
+
+    __tablename__ = "cf_watermarks"
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    params: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False, default=dict)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+
+class IngestSpoolOffset(Base):
+    """Offset đã drain của từng segment spool local (xem app/services/ingest_spool.py), cập nhật cùng transaction với COPY."""
+
+    __tablename__ = "ingest_spool_offsets"
+
+    spool_id: Mapped[str] = mapped_column(String, primary_key=True)
+    segment: Mapped[str] = mapped_column(String, primary_key=True)
+    byte_offset: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+
 class User(Base):
     """ORM model for the `users` table."""
 
@@ -380,6 +484,9 @@ class Friend(Base):
         DateTime(timezone=True), nullable=False, default=datetime.utcnow
     )
 
+    # Tra chiều ngược (friend_id = u) khi đọc bạn bè 2 chiều
+    __table_args__ = (Index("idx_friends_friend_id", "friend_id"),)
+
 
 class PostView(Base):
     """ORM model for the `post_views` table."""
@@ -21,7 +21,28 @@ class InteractionEventIn(BaseModel):
 
 
 class IngestResponse(BaseModel):
-    inserted_id: int
+    inserted_id: Optional[int] = None
+    status: str = "inserted"  # "inserted" | "filtered" (view trùng/bị sampling) | "capped" (vượt cap, chỉ cộng rollup ngày) | "spooled" (đã ghi spool local, chờ drain)
+
+
+class InteractionEventBatchIn(BaseModel):
+    events: list[InteractionEventIn]
+
+
+class IngestItemResult(BaseModel):
+    index: int
+    status: str  # "inserted" | "rejected" | "filtered" | "capped" | "spooled"
+    inserted_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BatchIngestResponse(BaseModel):
+    inserted: int
+    rejected: int
+    filtered: int = 0
+    capped: int = 0
+    spooled: int = 0
+    results: list[IngestItemResult]
 
 
 class UserScore(BaseModel):
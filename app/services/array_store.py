@@ -0,0 +1,68 @@
+"""Lưu / đọc 1 nhóm mảng NumPy dạng thư mục (mỗi mảng 1 file .npy + meta.json), đọc lại được bằng mmap."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, Tuple
+
+import numpy as np
+
+
+def write_array_dir(path: str | os.PathLike, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> Path:
+    """
+    Ghi `arrays` + `meta` thành thư mục `path` (ghi đè nếu đã có).
+
+    Ghi vào thư mục tạm cạnh đích rồi đổi tên → reader không bao giờ thấy thư mục ghi dở.
+    """
+    dest = Path(path)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f"{dest.name}.tmp-{os.getpid()}")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir()
+    for name, arr in arrays.items():
+        np.save(tmp / f"{name}.npy", np.asarray(arr))
+    (tmp / "meta.json").write_text(json.dumps(meta))
+
+    old = dest.with_name(f"{dest.name}.old-{os.getpid()}")
+    if dest.exists():
+        dest.rename(old)
+    tmp.rename(dest)
+    if old.exists():
+        shutil.rmtree(old)
+    return dest
+
+
+def read_array_dir(
+    path: str | os.PathLike, names: Iterable[str], *, mmap: bool = True
+) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Đọc các mảng `names` + meta.json của thư mục `path` (mmap chỉ đọc nếu mmap=True)."""
+    src = Path(path)
+    meta = json.loads((src / "meta.json").read_text())
+    mode = "r" if mmap else None
+    arrays = {name: np.load(src / f"{name}.npy", mmap_mode=mode) for name in names}
+    return arrays, meta
+
+
+def meta_mtime_ns(path: str | os.PathLike) -> int | None:
+    """mtime (ns) của meta.json – đổi mỗi lần thư mục được ghi lại; None nếu chưa có."""
+    try:
+        return (Path(path) / "meta.json").stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def array_dir_checksums(path: str | os.PathLike) -> Dict[str, str]:
+    """sha256 của từng file .npy trong thư mục `path` (tên file → hex digest)."""
+    out: Dict[str, str] = {}
+    for f in sorted(Path(path).glob("*.npy")):
+        h = hashlib.sha256()
+        with open(f, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+        out[f.name] = h.hexdigest()
+    return out
@@ -0,0 +1,198 @@
+"""Bulk ingest (backfill) events vào `user_interaction_events` bằng COPY FROM STDIN."""
+
+from __future__ import annotations
+
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional, TextIO
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app.models.schemas import InteractionEventIn
+from app.services.constants import EVENT_TYPE_CODES
+from app.services.daily_agg import DailyRollup, upsert_daily_rows
+from app.services.event_meta import allocate_event_ids, has_meta, meta_rows, store_meta_enabled, write_event_meta
+from app.services.ingest import normalize_event
+
+# Thứ tự cột ghi bằng COPY (khớp key của dict trả về từ normalize_event;
+# session_id/meta đi vào side table user_interaction_event_meta)
+COPY_COLUMNS: tuple[str, ...] = (
+    "actor_user_id",
+    "target_user_id",
+    "event_type",
+    "event_value",
+    "content_id",
+    "occurred_at",
+    "created_at",
+)
+
+# Giữ tối đa N lỗi mẫu trong stats để không phình bộ nhớ khi file bẩn
+MAX_ERROR_SAMPLES = 100
+
+
+@dataclass
+class BulkLoadStats:
+    accepted: int = 0
+    rejected: int = 0
+    chunks: int = 0
+    elapsed_s: float = 0.0
+    errors: list[tuple[int, str]] = field(default_factory=list)  # (line_no, error)
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.accepted / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    def add_error(self, line_no: int, error: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_ERROR_SAMPLES:
+            self.errors.append((line_no, error))
+
+
+def parse_raw_event(raw: dict[str, Any]) -> dict[str, Any]:
+    """
+    Parse 1 record thô (1 dòng NDJSON hoặc CSV) thành row đã normalize.
+
+    - Chấp nhận schema của API (`InteractionEventIn`) và schema CSV trong README
+      (`value`/`count`, `metadata` dạng JSON string).
+    - Validate + normalize giống hệt `ingest_event` (lowercase event_type, UTC, chặn self-interaction).
+
+    Raise ValueError nếu record không hợp lệ.
+    """
+    data = {k: v for k, v in raw.items() if v is not None and v != ""}
+    if "value" not in data and "count" in data:
+        data["value"] = data["count"]
+    meta = data.get("metadata")
+    if isinstance(meta, str):
+        try:
+            data["metadata"] = json.loads(meta)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"metadata is not valid JSON: {e}")
+
+    try:
+        evt = InteractionEventIn.model_validate(data)
+    except ValidationError as e:
+        raise ValueError(f"invalid event: {e.errors(include_url=False)}")
+
+    return normalize_event(
+        actor_user_id=evt.actor_user_id,
+        target_user_id=evt.target_user_id,
+        event_type=evt.event_type,
+        timestamp=evt.timestamp,
+        value=evt.value,
+        content_id=evt.content_id,
+        session_id=evt.session_id,
+        metadata=evt.metadata,
+    )
+
+
+def iter_ndjson_records(lines: Iterable[str]) -> Iterator[tuple[int, Optional[dict[str, Any]], Optional[str]]]:
+    """Đọc lần lượt từng dòng NDJSON → (line_no, record | None, error | None). Bỏ qua dòng trống."""
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "record must be a JSON object"
+            continue
+        yield line_no, record, None
+
+
+def iter_csv_records(f: TextIO) -> Iterator[tuple[int, Optional[dict[str, Any]], Optional[str]]]:
+    """Đọc lần lượt từng dòng CSV (có header) → (line_no, record | None, error | None)."""
+    reader = csv.DictReader(f)
+    for record in reader:
+        yield reader.line_num, record, None
+
+
+def copy_event_rows(db: Session, rows: Iterable[dict[str, Any]]) -> int:
+    """
+    Ghi các row đã normalize bằng 1 lệnh COPY FROM STDIN (text format) trên connection của session.
+
+    Nếu có row mang session_id/metadata (và EVENTS_STORE_META bật): cấp trước id cho cả nhóm,
+    COPY kèm cột id rồi COPY side rows vào `user_interaction_event_meta`.
+
+    Không commit – caller tự quyết định ranh giới transaction. Trả về số row đã ghi.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    ids: Optional[list[int]] = None
+    if store_meta_enabled() and any(has_meta(r) for r in rows):
+        ids = allocate_event_ids(db, len(rows))
+
+    raw_conn = db.connection().connection.driver_connection
+    columns = ("id", *COPY_COLUMNS) if ids is not None else COPY_COLUMNS
+    type_idx = COPY_COLUMNS.index("event_type")
+    sql = f"COPY user_interaction_events ({', '.join(columns)}) FROM STDIN"
+    with raw_conn.cursor() as cur:
+        with cur.copy(sql) as copy:
+            for i, row in enumerate(rows):
+                values = [row[c] for c in COPY_COLUMNS]
+                values[type_idx] = EVENT_TYPE_CODES[values[type_idx]]
+                if ids is not None:
+                    values.insert(0, ids[i])
+                copy.write_row(values)
+
+    if ids is not None:
+        write_event_meta(db, meta_rows(ids, rows))
+    return len(rows)
+
+
+def bulk_load_records(
+    db: Session,
+    records: Iterable[tuple[int, Optional[dict[str, Any]], Optional[str]]],
+    *,
+    chunk_rows: int = 50000,
+) -> BulkLoadStats:
+    """
+    Stream records → validate/normalize từng dòng → COPY theo chunk.
+
+    - Không materialize toàn bộ input: chỉ giữ 1 chunk (tối đa `chunk_rows` row) → 1 COPY → commit.
+    - Rollup `user_interaction_daily` của chunk được gom trong lúc stream và upsert cùng transaction.
+    - Record lỗi bị bỏ qua và ghi vào stats (kèm số dòng) thay vì làm hỏng cả chunk.
+    """
+    stats = BulkLoadStats()
+    started = time.perf_counter()
+    it = iter(records)
+    exhausted = False
+
+    def _chunk() -> Iterator[dict[str, Any]]:
+        nonlocal exhausted
+        emitted = 0
+        while emitted < chunk_rows:
+            try:
+                line_no, record, error = next(it)
+            except StopIteration:
+                exhausted = True
+                return
+            if error is None:
+                try:
+                    row = parse_raw_event(record or {})
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                stats.add_error(line_no, error)
+                continue
+            emitted += 1
+            rollup.add(row)
+            yield row
+
+    while not exhausted:
+        rollup = DailyRollup()  # rollup của chunk đang ghi (_chunk cộng dồn vào đây)
+        written = copy_event_rows(db, _chunk())
+        if written:
+            upsert_daily_rows(db, rollup.rows())
+            db.commit()
+            stats.accepted += written
+            stats.chunks += 1
+
+    stats.elapsed_s = time.perf_counter() - started
+    return stats
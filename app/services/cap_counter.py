@@ -0,0 +1,148 @@
+"""In-memory per-day event counters cho cap-aware ingest."""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.models import UserInteractionDaily
+from app.services.constants import VIEW_EVENT_TYPES, cap_for_event, decode_event_type
+from app.services.time_utils import utcnow
+
+CapKey = tuple[int, int, int, str]  # (actor, target, content_id | 0, event_type)
+
+
+def ingest_cap_for_event(event_type: str, *, view_sample_n: int = 1) -> int:
+    """
+    Số raw event cần lưu / ngày để score đạt cap: mỗi view đã sampling được tính VIEW_SAMPLE_N lần
+    vào count của rollup → chỉ cần ceil(cap / N) view đã sampling.
+    """
+    cap = cap_for_event(event_type)
+    if event_type in VIEW_EVENT_TYPES and view_sample_n > 1:
+        return max(1, math.ceil(cap / view_sample_n))
+    return cap
+
+
+def cap_key(row: dict[str, Any]) -> CapKey:
+    return (
+        int(row["actor_user_id"]),
+        int(row["target_user_id"]),
+        int(row.get("content_id") or 0),
+        row["event_type"],
+    )
+
+
+class CapCounter:
+    """
+    Đếm số raw event đã lưu theo (actor, target, content, event_type, day UTC).
+
+    - Chỉ giữ ngày hôm nay + hôm qua; event cũ hơn (đến trễ) luôn được lưu raw.
+    - Mỗi ngày tối đa `max_keys` key; key mới khi đã đầy → không theo dõi, lưu raw.
+    - Counter là của riêng process: các worker khác cũng ghi nên count luôn <= thực tế
+      → chỉ có thể lưu thừa raw row, không bao giờ bỏ row cần cho score.
+    """
+
+    def __init__(self, *, max_keys: int = 1_000_000, view_sample_n: int = 1) -> None:
+        self._max_keys = max(1, int(max_keys))
+        self._view_sample_n = max(1, int(view_sample_n))
+        self._days: dict[date, dict[CapKey, int]] = {}
+        self._lock = threading.Lock()
+
+    def _day_counts(self, day: date, *, today: date) -> Optional[dict[CapKey, int]]:
+        if day < today - timedelta(days=1):
+            return None
+        counts = self._days.get(day)
+        if counts is None:
+            for old in [d for d in self._days if d < today - timedelta(days=1)]:
+                del self._days[old]
+            counts = self._days[day] = {}
+        return counts
+
+    def admit(self, row: dict[str, Any]) -> bool:
+        """
+        True → lưu raw (chưa chạm cap, count tăng 1); False → đã đủ cap, chỉ cần cộng rollup ngày.
+        """
+        day = row["occurred_at"].date()
+        key = cap_key(row)
+        with self._lock:
+            counts = self._day_counts(day, today=utcnow().date())
+            if counts is None:
+                return True
+            n = counts.get(key)
+            if n is None:
+                if len(counts) >= self._max_keys:
+                    return True
+                n = 0
+            if n >= ingest_cap_for_event(key[3], view_sample_n=self._view_sample_n):
+                return False
+            counts[key] = n + 1
+            return True
+
+    def release(self, row: dict[str, Any]) -> None:
+        """Trả lại 1 slot đã admit nhưng ghi thất bại (transaction rollback)."""
+        key = cap_key(row)
+        with self._lock:
+            counts = self._days.get(row["occurred_at"].date())
+            if counts and counts.get(key, 0) > 0:
+                counts[key] -= 1
+
+    def load(self, db: Session) -> int:
+        """
+        Rebuild counters từ rollup `user_interaction_daily` (hôm qua + hôm nay), ưu tiên key có count lớn.
+        Count view trong rollup đã nhân VIEW_SAMPLE_N → chia lại (làm tròn xuống) thành số view đã lưu.
+        Trả về số key đã nạp.
+        """
+        today = utcnow().date()
+        d = UserInteractionDaily
+        q = (
+            select(d.actor_user_id, d.target_user_id, d.content_id, d.event_type, d.day, d.event_count)
+            .where(d.day >= today - timedelta(days=1))
+            .order_by(d.event_count.desc())
+        )
+
+        days: dict[date, dict[CapKey, int]] = defaultdict(dict)
+        loaded = 0
+        for actor_id, target_id, content_id, event_type, day, n in db.execute(q).all():
+            counts = days[day]
+            if len(counts) >= self._max_keys:
+                continue
+            et = decode_event_type(event_type)
+            n = int(n) // self._view_sample_n if et in VIEW_EVENT_TYPES else int(n)
+            counts[(int(actor_id), int(target_id), int(content_id), et)] = n
+            loaded += 1
+
+        with self._lock:
+            self._days = dict(days)
+        return loaded
+
+
+_cap_counter: Optional[CapCounter] = None
+
+
+def get_cap_counter() -> Optional[CapCounter]:
+    """Counter dùng chung cho process, None nếu INGEST_CAP_ENABLED tắt."""
+    global _cap_counter
+    from app.utils.config import settings
+
+    if not settings.INGEST_CAP_ENABLED:
+        return None
+    if _cap_counter is None:
+        _cap_counter = CapCounter(
+            max_keys=settings.INGEST_CAP_MAX_KEYS,
+            view_sample_n=settings.VIEW_SAMPLE_N,
+        )
+    return _cap_counter
+
+
+def warm_cap_counter(db: Session) -> int:
+    """Nạp counters từ DB (gọi ở startup). Trả về số key đã nạp (0 nếu tắt)."""
+    counter = get_cap_counter()
+    if counter is None:
+        return 0
+    return counter.load(db)
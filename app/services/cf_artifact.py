@@ -0,0 +1,736 @@
+"""
+Artifact CF train offline (app/jobs/train_cf.py): neighbors cosine + đề xuất 2-hop của mọi user, dạng mảng phẳng.
+
+Pipeline: aggregate_pair_scores → build_sparse_matrix → topk_user_neighbors (cosine; hoặc ANN SimHash khi ann=True)
+→ R = S @ M (S = top-k neighbors có trọng số cosine, M = score (actor, target) đã decay) bỏ target đã tương tác / chính mình.
+
+Artifact lưu kèm M đầy đủ (m_indptr / m_targets / m_scores) để cập nhật dần chỉ cần aggregate lại hàng của actor
+dirty rồi vá vào M (refresh_cf_artifact) thay vì đọc lại cả window.
+
+Mỗi version là 1 thư mục dưới MODEL_PATH (app.services.array_store, đọc bằng mmap); `manifest.json` chứa
+version đang publish + checksum, ArtifactRegistry hot reload theo manifest. Tra 1 user = searchsorted trên
+user_ids + copy k phần tử của CSR.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy.orm import Session
+
+from app.services.array_store import array_dir_checksums, read_array_dir, write_array_dir
+from app.services.matrix import ActorTargetIndex, build_sparse_matrix, prune_topk_rows, topk_user_neighbors
+from app.services.preprocess import aggregate_pair_scores
+from app.services.simhash_ann import build_simhash_index, topk_user_neighbors_ann
+from app.services.time_utils import half_life_decay, utcnow
+from app.services.watermarks import get_watermark
+from app.utils.config import settings
+
+MANIFEST_FILE = "manifest.json"
+# Mốc (cf_watermarks) của lần train / cập nhật artifact gần nhất: value = lúc bắt đầu đọc dữ liệu
+WATERMARK_NAME = "cf_neighbors"
+
+_ARRAY_FIELDS = ("user_ids", "nb_indptr", "nb_ids", "nb_scores", "rec_indptr", "rec_ids", "rec_scores")
+# M đầy đủ (CSR theo user_ids) – chỉ job cập nhật dần đọc, API không đụng tới
+_M_FIELDS = ("m_indptr", "m_targets", "m_scores")
+
+# updated_at = giờ ingest của lần ghi rollup gần nhất (sql/009) → bắt cả event ghi bù có occurred_at cũ
+_DIRTY_ACTORS_SQL = """
+SELECT DISTINCT actor_user_id
+FROM user_interaction_daily
+WHERE updated_at >= %(since)s AND day >= %(cutoff)s
+"""
+
+# Ước lượng bytes / phần tử khi tính R = S[block] @ M (data + index + workspace)
+_REC_BYTES_PER_ENTRY = 16
+
+
+@dataclass(frozen=True)
+class CFArtifact:
+    """
+    1 version artifact CF (mảng có thể là memmap):
+    - user_ids (n,) int64 tăng dần = hàng của 2 CSR bên dưới
+    - nb_indptr / nb_ids / nb_scores: top neighbor_k neighbors (cosine giảm dần, hoà → user_id tăng dần)
+    - rec_indptr / rec_ids / rec_scores: top rec_k đề xuất 2-hop (chưa lọc bạn bè – lọc lúc serve)
+    - m_indptr / m_targets / m_scores: M (score actor → target đã decay tới ngày ref_day) theo user_ids;
+      None ở version cũ chưa lưu M (khi đó không cập nhật dần được)
+    """
+
+    user_ids: np.ndarray
+    nb_indptr: np.ndarray
+    nb_ids: np.ndarray
+    nb_scores: np.ndarray
+    rec_indptr: np.ndarray
+    rec_ids: np.ndarray
+    rec_scores: np.ndarray
+    version: str
+    window_days: int
+    half_life_days: float
+    neighbor_k: int
+    rec_k: int
+    built_at: str
+    m_indptr: Optional[np.ndarray] = None
+    m_targets: Optional[np.ndarray] = None
+    m_scores: Optional[np.ndarray] = None
+    ref_day: Optional[str] = None
+
+    @property
+    def has_matrix(self) -> bool:
+        return self.m_indptr is not None and self.ref_day is not None
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def row_of(self, user_id: int) -> Optional[int]:
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row < len(self.user_ids) and int(self.user_ids[row]) == int(user_id):
+            return row
+        return None
+
+    def neighbors(self, user_id: int, *, k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Top-k neighbors (ids, cosine) của user_id; None nếu user không có trong artifact."""
+        row = self.row_of(user_id)
+        if row is None:
+            return None
+        lo = int(self.nb_indptr[row])
+        hi = min(int(self.nb_indptr[row + 1]), lo + k)
+        return np.array(self.nb_ids[lo:hi]), np.array(self.nb_scores[lo:hi])
+
+    def recommendations(
+        self, user_id: int, *, k: int, exclude_user_ids: Optional[set[int]] = None
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Top-k đề xuất (ids, score) của user_id, bỏ exclude_user_ids; None nếu user không có trong artifact."""
+        row = self.row_of(user_id)
+        if row is None:
+            return None
+        lo, hi = int(self.rec_indptr[row]), int(self.rec_indptr[row + 1])
+        ids, scores = np.array(self.rec_ids[lo:hi]), np.array(self.rec_scores[lo:hi])
+        if exclude_user_ids:
+            keep = ~np.isin(ids, np.fromiter(exclude_user_ids, dtype=np.int64, count=len(exclude_user_ids)))
+            ids, scores = ids[keep], scores[keep]
+        return ids[:k], scores[:k]
+
+
+def _two_hop_recommendations(
+    S: csr_matrix,
+    M: csr_matrix,
+    actor_ids: np.ndarray,
+    target_ids: np.ndarray,
+    *,
+    rec_k: int,
+    budget_bytes: int,
+    rows: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    R = S @ M theo block hàng (ước lượng <= budget_bytes / block), bỏ target actor đã có trong M và chính actor;
+    giữ top rec_k / hàng → CSR (indptr, target_id, score) sắp score giảm dần, hoà → target_id tăng dần.
+
+    Hàng i của S là actor hàng rows[i] của M (mặc định rows = tất cả hàng theo thứ tự).
+    """
+    n = S.shape[0]
+    if rows is None:
+        rows = np.arange(n)
+    self_col = np.searchsorted(target_ids, actor_ids)
+    self_col[self_col >= len(target_ids)] = 0
+    has_self_col = target_ids[self_col] == actor_ids
+
+    block_rows = max(1, budget_bytes // (_REC_BYTES_PER_ENTRY * max(1, M.shape[1])))
+    lengths = np.zeros(n, dtype=np.int64)
+    out_cols, out_vals = [], []
+    for start in range(0, n, block_rows):
+        end = min(n, start + block_rows)
+        block = rows[start:end]
+        R = (S[start:end] @ M).tocsr()
+        seen = M[block]
+        seen.data[:] = 1.0
+        R = (R - R.multiply(seen)).tocsr()
+
+        actor_rows = block[np.repeat(np.arange(end - start), np.diff(R.indptr))]
+        is_self = has_self_col[actor_rows] & (R.indices == self_col[actor_rows])
+        R.data[is_self] = 0
+        R.eliminate_zeros()
+        R.sort_indices()
+        R = prune_topk_rows(R, rec_k)
+
+        local = np.repeat(np.arange(end - start), np.diff(R.indptr))
+        order = np.lexsort((R.indices, -R.data, local))
+        lengths[start:end] = np.diff(R.indptr)
+        out_cols.append(R.indices[order])
+        out_vals.append(R.data[order])
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    cols = np.concatenate(out_cols) if out_cols else np.empty(0, dtype=np.int64)
+    vals = np.concatenate(out_vals) if out_vals else np.empty(0, dtype=np.float32)
+    return indptr, target_ids[cols], vals.astype(np.float32)
+
+
+def train_cf_artifact(
+    db: Session,
+    *,
+    window_days: int = 30,
+    half_life_days: Optional[float] = None,
+    neighbor_k: int = 100,
+    rec_k: Optional[int] = None,
+    topk_per_actor: int = 1000,
+    memory_budget_mb: Optional[int] = None,
+    workers: Optional[int] = None,
+    ann: bool = False,
+) -> CFArtifact:
+    """
+    Train toàn bộ pipeline CF cho window_days (half-life mặc định = window_days, như recommend 2-hop).
+
+    - Similarity tính trên M đã prune top-k / actor (topk_per_actor); đề xuất 2-hop + loại target đã tương tác
+      dùng M đầy đủ.
+    - rec_k mặc định settings.MAX_K (API không bao giờ hỏi nhiều hơn).
+    - ann=True: neighbors lấy từ index SimHash (CF_SIMHASH_TABLES / BITS / PROBE_RADIUS) thay vì cosine
+      all-pairs – xấp xỉ, đo recall bằng app/jobs/build_simhash_index.py --report.
+    """
+    if half_life_days is None:
+        half_life_days = float(window_days)
+    if rec_k is None:
+        rec_k = settings.MAX_K
+    if memory_budget_mb is None:
+        memory_budget_mb = settings.CF_SIM_BLOCK_MEMORY_MB
+
+    ref_day = utcnow().date()
+    pairs = aggregate_pair_scores(db, window_days=window_days, half_life_days=half_life_days)
+    M, index = build_sparse_matrix(pairs, topk_per_actor=0)
+    actor_ids = np.asarray(index.row_to_actor, dtype=np.int64)
+    target_ids = np.asarray(index.col_to_target, dtype=np.int64)
+    n = len(actor_ids)
+
+    M_sim = prune_topk_rows(M, topk_per_actor) if topk_per_actor > 0 else M
+    if ann:
+        nb = topk_user_neighbors_ann(build_simhash_index(M_sim, index), k=neighbor_k)
+    else:
+        nb = topk_user_neighbors(M_sim, index, k=neighbor_k, memory_budget_mb=memory_budget_mb, workers=workers)
+    nb_rows = np.searchsorted(actor_ids, nb.user_ids)
+    nb_indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nb_rows, minlength=n), out=nb_indptr[1:])
+
+    S = csr_matrix((nb.scores, np.searchsorted(actor_ids, nb.neighbor_ids), nb_indptr), shape=(n, n))
+    rec_indptr, rec_ids, rec_scores = _two_hop_recommendations(
+        S, M, actor_ids, target_ids, rec_k=rec_k, budget_bytes=int(memory_budget_mb) * 1024 * 1024
+    )
+
+    built_at = utcnow()
+    return CFArtifact(
+        user_ids=actor_ids,
+        nb_indptr=nb_indptr,
+        nb_ids=nb.neighbor_ids,
+        nb_scores=nb.scores,
+        rec_indptr=rec_indptr,
+        rec_ids=rec_ids,
+        rec_scores=rec_scores,
+        version=built_at.strftime("%Y%m%dT%H%M%S%fZ"),
+        window_days=int(window_days),
+        half_life_days=float(half_life_days),
+        neighbor_k=int(neighbor_k),
+        rec_k=int(rec_k),
+        built_at=built_at.isoformat(),
+        m_indptr=np.asarray(M.indptr, dtype=np.int64),
+        m_targets=target_ids[M.indices],
+        m_scores=np.asarray(M.data, dtype=np.float32),
+        ref_day=ref_day.isoformat(),
+    )
+
+
+def dirty_actor_ids(
+    db: Session, *, since: datetime, window_days: int, overlap_s: Optional[float] = None
+) -> np.ndarray:
+    """
+    Actor có row rollup (trong window_days) được ghi từ since - overlap_s: updated_at là giờ ingest, nên event
+    ghi bù / spool drain trễ với occurred_at cũ vẫn đánh dấu actor.
+
+    updated_at = now() của transaction ghi, commit sau đó → lùi lại overlap_s giây (mặc định
+    settings.CF_INCREMENTAL_OVERLAP_S) để row commit sau lần đọc trước không lọt giữa 2 lần chạy. Tính lại thừa
+    vài actor là vô hại.
+    """
+    if overlap_s is None:
+        overlap_s = settings.CF_INCREMENTAL_OVERLAP_S
+    since = since - timedelta(seconds=overlap_s)
+    cutoff = utcnow().date() - timedelta(days=window_days)
+    raw_conn = db.connection().connection.driver_connection
+    with raw_conn.cursor() as cur:
+        cur.execute(_DIRTY_ACTORS_SQL, {"since": since, "cutoff": cutoff})
+        rows = cur.fetchall()
+    return np.array(sorted(int(r[0]) for r in rows), dtype=np.int64)
+
+
+def affected_rows(M_sim: csr_matrix, dirty_rows: np.ndarray, dirty_cols: np.ndarray) -> np.ndarray:
+    """
+    Hàng có top-k neighbors / đề xuất có thể đổi khi actor dirty đổi: hàng của họ (dirty_rows) + mọi hàng có
+    ít nhất 1 target thuộc dirty_cols trong M_sim.
+
+    dirty_cols = target cũ + mới của actor dirty (M đầy đủ, chưa prune) → gồm cả target vừa rơi khỏi top-k / actor
+    của họ và target của actor vừa rời M. Quét 1 lượt M_sim.indices (không dựng M_sim.T).
+    """
+    if dirty_rows.size == 0 and dirty_cols.size == 0:
+        return np.empty(0, dtype=np.int64)
+    colmask = np.zeros(M_sim.shape[1], dtype=bool)
+    colmask[dirty_cols] = True
+    hits = np.zeros(M_sim.nnz + 1, dtype=np.int64)
+    np.cumsum(colmask[M_sim.indices], out=hits[1:])
+    sharers = np.flatnonzero(hits[M_sim.indptr[1:]] > hits[M_sim.indptr[:-1]])
+    return np.union1d(dirty_rows, sharers).astype(np.int64)
+
+
+def _lookup(sorted_ids: np.ndarray, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(vị trí, có mặt?) của từng phần tử `ids` trong mảng đã sort `sorted_ids`."""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    at = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return at, np.asarray(sorted_ids[at]) == ids
+
+
+def _row_positions(indptr: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Vị trí trong data của các hàng `rows` của 1 CSR (nối liền theo thứ tự rows)."""
+    starts = np.asarray(indptr[rows], dtype=np.int64)
+    lengths = np.asarray(indptr[rows + 1], dtype=np.int64) - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+
+
+def _patch_rows(
+    base_users: np.ndarray,
+    base: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    users: np.ndarray,
+    rows: np.ndarray,
+    new: Tuple[np.ndarray, np.ndarray, np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    CSR (indptr, ids, scores) theo `users`: hàng `rows` lấy từ `new` (CSR theo thứ tự rows), hàng khác
+    copy từ `base` (CSR theo base_users); user không có ở base và không nằm trong rows → hàng rỗng.
+    """
+    base_indptr, base_ids, base_scores = base
+    new_indptr, new_ids, new_scores = new
+    n = len(users)
+    at, in_base = _lookup(base_users, users)
+    in_base[rows] = False
+    keep_rows = np.flatnonzero(in_base)
+
+    lengths = np.zeros(n, dtype=np.int64)
+    lengths[rows] = np.diff(new_indptr)
+    lengths[keep_rows] = np.asarray(base_indptr[at[keep_rows] + 1]) - np.asarray(base_indptr[at[keep_rows]])
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+
+    ids = np.empty(int(indptr[-1]), dtype=np.int64)
+    scores = np.empty(int(indptr[-1]), dtype=np.float32)
+    src = _row_positions(base_indptr, at[keep_rows])
+    dst = _row_positions(indptr, keep_rows)
+    ids[dst], scores[dst] = base_ids[src], base_scores[src]
+    dst = _row_positions(indptr, rows)
+    ids[dst], scores[dst] = new_ids, new_scores
+    return indptr, ids, scores
+
+
+def _ids_index(actor_ids: np.ndarray, target_ids: np.ndarray) -> ActorTargetIndex:
+    """Index chỉ gồm mảng hàng / cột → user_id (topk_user_neighbors chỉ dùng row_to_actor); không dựng dict."""
+    return ActorTargetIndex(actor_to_row={}, row_to_actor=actor_ids, target_to_col={}, col_to_target=target_ids)
+
+
+def refresh_cf_artifact(
+    db: Session,
+    base: CFArtifact,
+    *,
+    since: datetime,
+    topk_per_actor: int = 1000,
+    memory_budget_mb: Optional[int] = None,
+) -> Tuple[CFArtifact, int]:
+    """
+    Cập nhật dần `base` (cần M đã lưu – base.has_matrix): chỉ aggregate lại hàng M của actor có row rollup ghi
+    từ `since` (dirty_actor_ids), vá vào M của base, rồi tính lại neighbors + đề xuất của họ và actor có chung
+    target với họ (affected_rows); hàng khác copy nguyên từ base → version mới.
+
+    - Đọc DB + aggregate tỉ lệ với số actor dirty. Hàng M không đổi được dời mốc decay từ base.ref_day tới hôm nay
+      (nhân half_life_decay(số ngày) – decay mũ nên giống hệt aggregate lại); phần việc còn lại trên toàn M
+      (prune, normalize, quét cột) là vài lượt NumPy trong bộ nhớ.
+    - Similarity chỉ tính cho các hàng bị ảnh hưởng (topk_user_neighbors(rows=...)); kết quả mỗi hàng tính lại
+      giống train toàn bộ trên cùng dữ liệu. Neighbors / đề xuất của hàng không tính lại giữ mốc decay của lần
+      tính trước (decay đồng đều → thứ tự không đổi).
+    - Dữ liệu rơi khỏi window chỉ được bỏ khi train toàn bộ định kỳ.
+
+    Trả về (artifact, số hàng tính lại).
+    """
+    if not base.has_matrix:
+        raise ValueError(f"Version {base.version} không lưu M – cần train toàn bộ")
+    if memory_budget_mb is None:
+        memory_budget_mb = settings.CF_SIM_BLOCK_MEMORY_MB
+
+    ref_day = utcnow().date()
+    dirty = dirty_actor_ids(db, since=since, window_days=base.window_days)
+    fresh = aggregate_pair_scores(
+        db, window_days=base.window_days, half_life_days=base.half_life_days, actor_ids=dirty
+    ).sorted()
+    fresh_users, fresh_counts = np.unique(fresh.actors, return_counts=True)
+    fresh_indptr = np.zeros(len(fresh_users) + 1, dtype=np.int64)
+    np.cumsum(fresh_counts, out=fresh_indptr[1:])
+
+    # M mới = hàng base (dời mốc decay) trừ actor dirty + hàng vừa aggregate của actor dirty
+    base_users = np.asarray(base.user_ids)
+    age = (ref_day - date.fromisoformat(base.ref_day)).days
+    decay = half_life_decay(float(age), half_life_days=base.half_life_days)
+    base_scores = np.asarray(base.m_scores)
+    if decay != 1.0:
+        base_scores = (base_scores.astype(np.float64) * decay).astype(np.float32)
+    actor_ids = np.union1d(np.setdiff1d(base_users, dirty, assume_unique=True), fresh_users)
+    fresh_rows = np.searchsorted(actor_ids, fresh_users)
+    m_indptr, m_targets, m_scores = _patch_rows(
+        base_users, (base.m_indptr, base.m_targets, base_scores), actor_ids, fresh_rows,
+        (fresh_indptr, fresh.targets, fresh.scores),
+    )
+    target_ids = np.unique(m_targets)
+    n = len(actor_ids)
+    M = csr_matrix((m_scores, np.searchsorted(target_ids, m_targets), m_indptr), shape=(n, len(target_ids)))
+    M.has_sorted_indices = True  # mỗi hàng (base hoặc fresh) đã sắp theo target
+    M_sim = prune_topk_rows(M, topk_per_actor) if topk_per_actor > 0 else M
+
+    dirty_base_rows, in_base = _lookup(base_users, dirty)
+    old_targets = base.m_targets[_row_positions(np.asarray(base.m_indptr), dirty_base_rows[in_base])]
+    dirty_cols, in_m = _lookup(target_ids, np.union1d(old_targets, fresh.targets))
+    rows = affected_rows(M_sim, fresh_rows, dirty_cols[in_m])
+
+    nb = topk_user_neighbors(
+        M_sim, _ids_index(actor_ids, target_ids), k=base.neighbor_k, memory_budget_mb=memory_budget_mb, rows=rows
+    )
+    local = np.searchsorted(rows, np.searchsorted(actor_ids, nb.user_ids))
+    nb_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(local, minlength=len(rows)), out=nb_indptr[1:])
+    S = csr_matrix((nb.scores, np.searchsorted(actor_ids, nb.neighbor_ids), nb_indptr), shape=(len(rows), n))
+    rec_new = _two_hop_recommendations(
+        S, M, actor_ids, target_ids, rec_k=base.rec_k, budget_bytes=int(memory_budget_mb) * 1024 * 1024, rows=rows
+    )
+
+    nb_indptr, nb_ids, nb_scores = _patch_rows(
+        base_users, (base.nb_indptr, base.nb_ids, base.nb_scores), actor_ids, rows,
+        (nb_indptr, nb.neighbor_ids, nb.scores),
+    )
+    rec_indptr, rec_ids, rec_scores = _patch_rows(
+        base_users, (base.rec_indptr, base.rec_ids, base.rec_scores), actor_ids, rows, rec_new
+    )
+
+    built_at = utcnow()
+    artifact = CFArtifact(
+        user_ids=actor_ids,
+        nb_indptr=nb_indptr,
+        nb_ids=nb_ids,
+        nb_scores=nb_scores,
+        rec_indptr=rec_indptr,
+        rec_ids=rec_ids,
+        rec_scores=rec_scores,
+        version=built_at.strftime("%Y%m%dT%H%M%S%fZ"),
+        window_days=base.window_days,
+        half_life_days=base.half_life_days,
+        neighbor_k=base.neighbor_k,
+        rec_k=base.rec_k,
+        built_at=built_at.isoformat(),
+        m_indptr=m_indptr,
+        m_targets=m_targets,
+        m_scores=m_scores,
+        ref_day=ref_day.isoformat(),
+    )
+    return artifact, len(rows)
+
+
+def _meta(artifact: CFArtifact) -> Dict[str, object]:
+    return {
+        "version": artifact.version,
+        "window_days": artifact.window_days,
+        "half_life_days": artifact.half_life_days,
+        "neighbor_k": artifact.neighbor_k,
+        "rec_k": artifact.rec_k,
+        "built_at": artifact.built_at,
+        "ref_day": artifact.ref_day,
+        "users": len(artifact),
+    }
+
+
+def list_versions(root: str | os.PathLike) -> list[str]:
+    """Các version đã ghi xong dưới root (tên thư mục, tăng dần theo thời gian)."""
+    base = Path(root)
+    if not base.is_dir():
+        return []
+    return sorted(p.name for p in base.iterdir() if p.is_dir() and (p / "meta.json").exists())
+
+
+def _combined_checksum(files: Dict[str, str]) -> str:
+    h = hashlib.sha256()
+    for name in sorted(files):
+        h.update(f"{name}:{files[name]}\n".encode())
+    return h.hexdigest()
+
+
+def read_manifest(root: str | os.PathLike) -> Optional[Dict[str, Any]]:
+    """Manifest đang publish (`root/manifest.json`: version, checksum, files); None nếu chưa có."""
+    try:
+        return json.loads((Path(root) / MANIFEST_FILE).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def verify_artifact(path: str | os.PathLike, manifest: Dict[str, Any]) -> bool:
+    """Checksum các file .npy của `path` khớp manifest (đọc hết file 1 lần → cũng làm ấm page cache)."""
+    files = array_dir_checksums(path)
+    return files == manifest.get("files") and _combined_checksum(files) == manifest.get("checksum")
+
+
+def save_cf_artifact(artifact: CFArtifact, root: str | os.PathLike, *, keep: int = 3) -> Path:
+    """
+    Ghi version mới vào `root/<version>`, rồi publish `root/manifest.json` (version + sha256 từng file,
+    ghi file tạm + os.replace) → các API worker tự đổi sang version mới (ArtifactRegistry).
+
+    Giữ lại `keep` version mới nhất (không bao giờ xoá version vừa publish). Worker còn map version bị xoá
+    vẫn đọc được (file chỉ biến mất khi mapping cuối cùng được release).
+    """
+    base = Path(root)
+    names = _ARRAY_FIELDS + (_M_FIELDS if artifact.has_matrix else ())
+    dest = write_array_dir(base / artifact.version, {name: getattr(artifact, name) for name in names}, _meta(artifact))
+    files = array_dir_checksums(dest)
+    manifest = {
+        "version": artifact.version,
+        "checksum": _combined_checksum(files),
+        "files": files,
+        "published_at": utcnow().isoformat(),
+    }
+    tmp = base / f"{MANIFEST_FILE}.tmp-{os.getpid()}"
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, base / MANIFEST_FILE)
+
+    if keep > 0:
+        for old in list_versions(base)[:-keep]:
+            if old != artifact.version:
+                shutil.rmtree(base / old, ignore_errors=True)
+    return dest
+
+
+def load_cf_artifact(path: str | os.PathLike, *, mmap: bool = True) -> CFArtifact:
+    has_matrix = all((Path(path) / f"{name}.npy").exists() for name in _M_FIELDS)
+    arrays, meta = read_array_dir(path, _ARRAY_FIELDS + (_M_FIELDS if has_matrix else ()), mmap=mmap)
+    return CFArtifact(
+        version=str(meta["version"]),
+        window_days=int(meta["window_days"]),
+        half_life_days=float(meta["half_life_days"]),
+        neighbor_k=int(meta["neighbor_k"]),
+        rec_k=int(meta["rec_k"]),
+        built_at=str(meta["built_at"]),
+        ref_day=meta.get("ref_day") if has_matrix else None,
+        **arrays,
+    )
+
+
+def watermark_params(artifact: CFArtifact, *, topk_per_actor: int) -> Dict[str, object]:
+    """params lưu cùng mốc WATERMARK_NAME – refresh_cf_artifact chỉ dùng được base có params khớp."""
+    return {
+        "version": artifact.version,
+        "window_days": artifact.window_days,
+        "half_life_days": artifact.half_life_days,
+        "neighbor_k": artifact.neighbor_k,
+        "rec_k": artifact.rec_k,
+        "topk_per_actor": int(topk_per_actor),
+    }
+
+
+def incremental_base(
+    db: Session,
+    root: str | os.PathLike,
+    *,
+    window_days: int,
+    neighbor_k: int,
+    rec_k: int,
+    topk_per_actor: int,
+) -> Optional[Tuple[CFArtifact, datetime]]:
+    """
+    (artifact đang publish ở `root`, mốc since) nếu cập nhật dần được: mốc WATERMARK_NAME mô tả đúng version
+    trong manifest, cùng tham số và version có lưu M; None → cần train toàn bộ.
+    """
+    manifest = read_manifest(root)
+    wm = get_watermark(db, WATERMARK_NAME)
+    if manifest is None or wm is None:
+        return None
+    path = Path(root) / str(manifest["version"])
+    if not path.is_dir():
+        return None
+    base = load_cf_artifact(path)
+    if not base.has_matrix:
+        return None
+    expected = watermark_params(base, topk_per_actor=topk_per_actor)
+    wanted = {"window_days": int(window_days), "neighbor_k": int(neighbor_k), "rec_k": int(rec_k)}
+    if dict(wm.params or {}) != expected or any(expected[key] != value for key, value in wanted.items()):
+        return None
+    return base, wm.value
+
+
+@dataclass
+class _LoadedArtifact:
+    artifact: Optional[CFArtifact]
+    refs: int = 0
+    retired: bool = False
+
+
+class ArtifactRegistry:
+    """
+    Artifact CF đang phục vụ của 1 process, hot reload không cần restart.
+
+    - Thread nền (start / stop) stat manifest.json mỗi reload_interval_s; version mới được map read-only
+      (mmap → các worker trên cùng host dùng chung page cache), kiểm checksum, rồi đổi tham chiếu active dưới lock.
+      acquire() không bao giờ đọc manifest hay hash file: chỉ lấy version active đã kiểm xong; checksum sai
+      → giữ version cũ.
+    - Request giữ 1 ref trong suốt `with acquire() as artifact`; version cũ bị retire và chỉ được release
+      (bỏ tham chiếu → unmap) khi ref cuối cùng trả về.
+    """
+
+    def __init__(self, *, root: Optional[str] = None, reload_interval_s: Optional[float] = None) -> None:
+        self._root = root
+        self._reload_interval_s = reload_interval_s
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._active: Optional[_LoadedArtifact] = None
+        self._retired: List[_LoadedArtifact] = []
+        self._checked_at = float("-inf")
+        self._manifest_mtime: Optional[int] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.released = 0
+
+    @property
+    def root(self) -> str:
+        return self._root or settings.MODEL_PATH
+
+    @property
+    def active_version(self) -> Optional[str]:
+        active = self._active
+        return active.artifact.version if active is not None and active.artifact is not None else None
+
+    @property
+    def reload_interval_s(self) -> float:
+        interval = self._reload_interval_s
+        return float(interval if interval is not None else settings.CF_ARTIFACT_RELOAD_INTERVAL_S)
+
+    def refresh(self, *, force: bool = False) -> None:
+        """Kiểm manifest (theo chu kỳ, hoặc ngay nếu force) và đổi sang version mới nếu có."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval_s:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return  # thread khác đang load
+        try:
+            self._checked_at = now
+            try:
+                mtime = (Path(self.root) / MANIFEST_FILE).stat().st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime == self._manifest_mtime:
+                return
+            self._manifest_mtime = mtime
+            manifest = read_manifest(self.root)
+            if manifest is None or manifest.get("version") == self.active_version:
+                return
+            path = Path(self.root) / str(manifest["version"])
+            try:
+                if not verify_artifact(path, manifest):
+                    raise ValueError("checksum mismatch")
+                artifact = load_cf_artifact(path)
+            except Exception as e:
+                self.failed_reloads += 1
+                print(f"⚠️ [CF Artifact] Bỏ qua version {manifest.get('version')}: {e}")
+                return
+            self._swap(_LoadedArtifact(artifact))
+            self.reloads += 1
+            print(f"📦 [CF Artifact] Đang phục vụ version {artifact.version}")
+        finally:
+            self._reload_lock.release()
+
+    def _swap(self, new: _LoadedArtifact) -> None:
+        with self._lock:
+            old, self._active = self._active, new
+            if old is not None:
+                old.retired = True
+                self._retired.append(old)
+                self._release_drained()
+
+    def _release_drained(self) -> None:
+        """Release các version đã retire không còn request nào giữ (gọi khi đang giữ _lock)."""
+        still = []
+        for loaded in self._retired:
+            if loaded.refs == 0:
+                loaded.artifact = None
+                self.released += 1
+            else:
+                still.append(loaded)
+        self._retired = still
+
+    def start(self) -> None:
+        """Thread nền: kiểm manifest mỗi reload_interval_s, load + verify version mới ngoài đường request."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="cf-artifact-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(timeout=self.reload_interval_s):
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                print(f"⚠️ [CF Artifact] Kiểm manifest lỗi: {e}")
+
+    @contextmanager
+    def acquire(self) -> Iterator[Optional[CFArtifact]]:
+        """
+        Artifact active (None nếu chưa có) – giữ nguyên version cho tới hết khối with. Chỉ lấy version đã
+        verify xong (refresh / thread nền), không đụng tới manifest.
+        """
+        with self._lock:
+            loaded = self._active
+            if loaded is not None:
+                loaded.refs += 1
+        if loaded is None:
+            yield None
+            return
+        try:
+            yield loaded.artifact
+        finally:
+            with self._lock:
+                loaded.refs -= 1
+                if loaded.retired and loaded.refs == 0:
+                    self._release_drained()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.active_version,
+                "in_flight": self._active.refs if self._active is not None else 0,
+                "retired_pending": len(self._retired),
+                "reloads": self.reloads,
+                "failed_reloads": self.failed_reloads,
+                "released": self.released,
+            }
+
+
+cf_artifacts = ArtifactRegistry()
+
+
+def acquire_artifact():
+    """`with acquire_artifact() as artifact:` – artifact CF đang phục vụ của process (ArtifactRegistry)."""
+    return cf_artifacts.acquire()
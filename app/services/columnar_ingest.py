@@ -0,0 +1,283 @@
+"""Columnar loader cho event dumps (CSV/Parquet) → `user_interaction_events` bằng binary COPY."""
+
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.services.bulk_ingest import COPY_COLUMNS, BulkLoadStats
+from app.services.constants import ALLOWED_EVENT_TYPES, EVENT_TYPE_CODES
+from app.services.daily_agg import rollup_frame, upsert_daily_rows
+from app.services.event_meta import allocate_event_ids, store_meta_enabled, write_event_meta
+from app.services.time_utils import utcnow
+
+REQUIRED_COLUMNS = ("actor_user_id", "target_user_id", "event_type", "timestamp")
+# Cột của frame sau validate: cột COPY + session_id/meta cho side table
+FRAME_COLUMNS: tuple[str, ...] = (*COPY_COLUMNS, "session_id", "meta")
+
+
+def iter_csv_chunks(path: str | Path, *, chunk_rows: int = 500_000) -> Iterator[pd.DataFrame]:
+    """Đọc CSV theo chunk cố định (bộ nhớ không phụ thuộc kích thước file)."""
+    yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False)
+
+
+def iter_parquet_chunks(path: str | Path, *, chunk_rows: int = 500_000) -> Iterator[pd.DataFrame]:
+    """Đọc Parquet theo record batch cố định (cần pyarrow)."""
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=chunk_rows):
+        yield batch.to_pandas()
+
+
+def iter_dump_chunks(path: str | Path, *, chunk_rows: int = 500_000) -> Iterator[pd.DataFrame]:
+    """Chọn reader theo đuôi file (.parquet/.pq → Parquet, còn lại → CSV)."""
+    suffix = Path(path).suffix.lower()
+    if suffix in (".parquet", ".pq"):
+        return iter_parquet_chunks(path, chunk_rows=chunk_rows)
+    return iter_csv_chunks(path, chunk_rows=chunk_rows)
+
+
+def _optional_column(df: pd.DataFrame, name: str) -> pd.Series:
+    if name in df.columns:
+        return df[name].replace("", None)
+    return pd.Series(None, index=df.index, dtype=object)
+
+
+def _parse_meta(m) -> dict | None:
+    """metadata: dict giữ nguyên, JSON string → dict, rỗng → {}; không hợp lệ → None."""
+    if isinstance(m, dict):
+        return m
+    if not isinstance(m, str):
+        return {} if m is None or m is pd.NA or (isinstance(m, float) and np.isnan(m)) else None
+    if not m:
+        return {}
+    try:
+        parsed = json.loads(m)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def validate_event_frame(df: pd.DataFrame, stats: BulkLoadStats, *, row_offset: int = 0) -> pd.DataFrame:
+    """
+    Validate + normalize 1 chunk theo cột (vectorized), cùng rule với `normalize_event`:
+    - actor/target là số nguyên >= 1, actor != target
+    - event_type lowercase, thuộc ALLOWED_EVENT_TYPES
+    - timestamp parse được, quy về UTC (naive → coi là UTC)
+
+    Trả về DataFrame các row hợp lệ với đúng cột FRAME_COLUMNS; row lỗi được ghi vào stats.
+    """
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"missing required columns: {missing}")
+
+    actor = pd.to_numeric(df["actor_user_id"], errors="coerce")
+    target = pd.to_numeric(df["target_user_id"], errors="coerce")
+    event_type = df["event_type"].astype(str).str.strip().str.lower()
+    occurred_at = pd.to_datetime(df["timestamp"], utc=True, errors="coerce", format="ISO8601")
+
+    value = _optional_column(df, "value")
+    if "value" not in df.columns and "count" in df.columns:
+        value = _optional_column(df, "count")
+    value = pd.to_numeric(value, errors="coerce")
+    content_id = pd.to_numeric(_optional_column(df, "content_id"), errors="coerce")
+
+    bad_ids = actor.isna() | target.isna() | (actor < 1) | (target < 1)
+    bad_ids |= (actor % 1 != 0) | (target % 1 != 0)
+    self_interaction = ~bad_ids & (actor == target)
+    bad_type = ~event_type.isin(ALLOWED_EVENT_TYPES)
+    bad_time = occurred_at.isna()
+    if "metadata" in df.columns:
+        meta = df["metadata"].map(_parse_meta)
+    else:
+        meta = pd.Series([{}] * len(df), index=df.index, dtype=object)
+    bad_meta = meta.isna()
+
+    invalid = bad_ids | self_interaction | bad_type | bad_time | bad_meta
+    n_invalid = int(invalid.sum())
+    if n_invalid:
+        reasons = np.select(
+            [bad_ids.to_numpy(), self_interaction.to_numpy(), bad_type.to_numpy(),
+             bad_time.to_numpy(), bad_meta.to_numpy()],
+            ["invalid actor_user_id/target_user_id", "self-interaction is not allowed",
+             "unsupported event_type", "invalid timestamp", "metadata is not a JSON object"],
+            default="",
+        )
+        for pos in np.flatnonzero(invalid.to_numpy()):
+            stats.add_error(row_offset + int(pos) + 1, str(reasons[pos]))
+
+    keep = ~invalid
+
+    out = pd.DataFrame(
+        {
+            "actor_user_id": actor[keep].astype("int64"),
+            "target_user_id": target[keep].astype("int64"),
+            "event_type": event_type[keep],
+            "event_value": value[keep],
+            "content_id": content_id[keep].astype("Int64"),
+            "session_id": _optional_column(df, "session_id")[keep],
+            "occurred_at": occurred_at[keep],
+            "created_at": utcnow(),
+            "meta": meta[keep],
+        }
+    )
+    return out[list(FRAME_COLUMNS)]
+
+
+def _copy_types(raw_conn, columns: tuple[str, ...]) -> dict[str, str]:
+    """Lấy tên kiểu Postgres của các cột COPY (binary COPY yêu cầu khớp chính xác int4/int8, json/jsonb...)."""
+    with raw_conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT a.attname, t.typname
+            FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+            WHERE a.attrelid = 'user_interaction_events'::regclass AND a.attnum > 0 AND NOT a.attisdropped
+            """
+        )
+        types = dict(cur.fetchall())
+    return {c: types[c] for c in columns}
+
+
+# Binary COPY: timestamp = số micro-giây tính từ 2000-01-01 UTC
+_PG_EPOCH_NS = 946_684_800 * 1_000_000_000
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00" * 8
+_FIXED_WIDTH = {"int2": ">i2", "int4": ">i4", "int8": ">i8", "float4": ">f4", "float8": ">f8"}
+
+
+def _encode_field(col: pd.Series, pg_type: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode 1 cột sang binary COPY → (lengths, data):
+    - lengths: độ dài payload từng row (-1 = NULL)
+    - data: payload của các row nối liền nhau (uint8)
+    """
+    null = col.isna().to_numpy()
+    if pg_type in _FIXED_WIDTH:
+        dt = np.dtype(_FIXED_WIDTH[pg_type])
+        values = col.to_numpy(dtype="float64" if dt.kind == "f" else "int64", na_value=0)
+        data = values[~null].astype(dt).view(np.uint8)
+        lengths = np.where(null, -1, dt.itemsize)
+        return lengths, data
+    if pg_type in ("timestamptz", "timestamp"):
+        ns = col.dt.tz_convert("UTC").dt.as_unit("ns").astype("int64").to_numpy()
+        data = ((ns[~null] - _PG_EPOCH_NS) // 1000).astype(">i8").view(np.uint8)
+        lengths = np.where(null, -1, 8)
+        return lengths, data
+
+    # text/varchar/json: UTF-8 nguyên văn; jsonb: thêm version byte 0x01
+    prefix = b"\x01" if pg_type == "jsonb" else b""
+    encoded = [prefix + v.encode() for v in col[~null]]
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    lengths = np.full(len(col), -1, dtype=np.int64)
+    lengths[~null] = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    return lengths, data
+
+
+def encode_pgcopy_binary(df: pd.DataFrame, pg_types: dict[str, str]) -> bytes:
+    """
+    Dựng toàn bộ stream `COPY ... (FORMAT BINARY)` cho 1 chunk bằng NumPy (không lặp theo row):
+    header | mỗi row: int16 số cột, rồi từng cột: int32 độ dài (-1 = NULL) + payload | trailer int16 -1.
+    """
+    n = len(df)
+    fields = [_encode_field(df[c], pg_types[c]) for c in df.columns]
+
+    # Kích thước từng row → vị trí bắt đầu của row trong buffer
+    row_sizes = np.full(n, 2, dtype=np.int64)
+    for lengths, _ in fields:
+        row_sizes += 4 + np.maximum(lengths, 0)
+    row_start = len(_PGCOPY_HEADER) + np.concatenate(([0], np.cumsum(row_sizes)[:-1]))
+
+    total = len(_PGCOPY_HEADER) + int(row_sizes.sum()) + 2
+    buf = np.zeros(total, dtype=np.uint8)
+    buf[: len(_PGCOPY_HEADER)] = np.frombuffer(_PGCOPY_HEADER, dtype=np.uint8)
+    buf[-2:] = 0xFF  # trailer: int16 -1
+
+    nfields = np.array([len(fields)], dtype=">i2").view(np.uint8)
+    buf[row_start[:, None] + np.arange(2)] = nfields
+
+    pos = row_start + 2
+    for lengths, data in fields:
+        len_bytes = lengths.astype(">i4").view(np.uint8).reshape(-1, 4)
+        buf[pos[:, None] + np.arange(4)] = len_bytes
+        payload = np.maximum(lengths, 0)
+        if data.size:
+            # byte thứ i của row r nằm ở pos[r] + 4 + (i - offset[r])
+            offsets = np.concatenate(([0], np.cumsum(payload)[:-1]))
+            buf[np.repeat(pos + 4 - offsets, payload) + np.arange(data.size)] = data
+        pos = pos + 4 + payload
+    return buf.tobytes()
+
+
+def copy_event_frame(db: Session, df: pd.DataFrame) -> int:
+    """
+    Ghi 1 DataFrame (cột = FRAME_COLUMNS) bằng COPY ... (FORMAT BINARY).
+
+    Stream binary được encode theo cột (encode_pgcopy_binary) rồi gửi 1 lần; event_type ghi
+    dạng mã smallint. Row có session_id/metadata → cấp trước id cho chunk để ghi side table.
+    Không commit – caller tự quyết định ranh giới transaction. Trả về số row đã ghi.
+    """
+    if df.empty:
+        return 0
+
+    raw_conn = db.connection().connection.driver_connection
+    out = df[list(COPY_COLUMNS)].copy()
+    out["event_type"] = out["event_type"].map(EVENT_TYPE_CODES).astype("int16")
+
+    side = pd.Series(False, index=df.index)
+    if store_meta_enabled():
+        side = df["session_id"].notna() | df["meta"].map(bool)
+    if side.any():
+        out.insert(0, "id", allocate_event_ids(db, len(out)))
+
+    columns = tuple(out.columns)
+    payload = encode_pgcopy_binary(out, _copy_types(raw_conn, columns))
+    sql = f"COPY user_interaction_events ({', '.join(columns)}) FROM STDIN (FORMAT BINARY)"
+    with raw_conn.cursor() as cur:
+        with cur.copy(sql) as copy:
+            copy.write(payload)
+
+    if side.any():
+        mask = side.to_numpy()
+        write_event_meta(
+            db,
+            [
+                {"event_id": int(i), "occurred_at": ts.to_pydatetime(), "session_id": sid, "meta": m or {}}
+                for i, ts, sid, m in zip(
+                    out["id"].to_numpy()[mask], df["occurred_at"][mask], df["session_id"][mask], df["meta"][mask]
+                )
+            ],
+        )
+    return len(out)
+
+
+def load_event_dump(
+    db: Session,
+    path: str | Path,
+    *,
+    chunk_rows: int = 500_000,
+    stats: BulkLoadStats | None = None,
+) -> BulkLoadStats:
+    """
+    Load 1 file dump (CSV/Parquet): đọc theo chunk → validate vectorized → binary COPY
+    + upsert rollup `user_interaction_daily` (groupby theo chunk) → commit mỗi chunk.
+    """
+    stats = stats or BulkLoadStats()
+    started = time.perf_counter()
+    row_offset = 0
+    for chunk in iter_dump_chunks(path, chunk_rows=chunk_rows):
+        valid = validate_event_frame(chunk, stats, row_offset=row_offset)
+        row_offset += len(chunk)
+        written = copy_event_frame(db, valid)
+        if written:
+            upsert_daily_rows(db, rollup_frame(valid))
+            db.commit()
+            stats.accepted += written
+            stats.chunks += 1
+    stats.elapsed_s += time.perf_counter() - started
+    return stats
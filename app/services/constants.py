@@ -8,6 +8,9 @@ ALLOWED_EVENT_TYPES = {
     "view_profile"
 }
 
+# View events: volume lớn nhất nhưng weight thấp → dedup/sampling ở ingest
+VIEW_EVENT_TYPES = {"view_post", "view_reel"}
+
 # Baseline implicit weights (tune later)
 EVENT_WEIGHTS: dict[str, float] = {
     "message": 2.0,
@@ -21,6 +24,33 @@ EVENT_WEIGHTS: dict[str, float] = {
     "view_reel": 0.1
 }
 
+# Mã smallint lưu trong DB (user_interaction_events / user_interaction_daily / bảng lookup event_types).
+# APPEND-ONLY: event type mới lấy mã kế tiếp, không đổi / tái sử dụng mã cũ (dữ liệu đã ghi dùng mã này).
+EVENT_TYPE_CODES: dict[str, int] = {
+    "message": 1,
+    "comment_post": 2,
+    "comment_reel": 3,
+    "share_post": 4,
+    "like_post": 5,
+    "like_reel": 6,
+    "view_profile": 7,
+    "view_post": 8,
+    "view_reel": 9,
+}
+EVENT_TYPE_NAMES: dict[int, str] = {code: et for et, code in EVENT_TYPE_CODES.items()}
+
+assert set(EVENT_TYPE_CODES) == set(EVENT_WEIGHTS) == ALLOWED_EVENT_TYPES, "event type chưa có mã smallint"
+
+
+def encode_event_type(event_type: str) -> int:
+    """Tên event type (đã normalize) → mã smallint lưu trong DB."""
+    return EVENT_TYPE_CODES[event_type]
+
+
+def decode_event_type(code: int) -> str:
+    """Mã smallint đọc từ DB → tên event type ("unknown" nếu mã mới hơn bản code đang chạy)."""
+    return EVENT_TYPE_NAMES.get(int(code), "unknown")
+
 
 def cap_for_event(event_type: str) -> int:
     """
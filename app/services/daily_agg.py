@@ -0,0 +1,169 @@
+"""Rollup `user_interaction_daily`: count + max(occurred_at) theo (actor, target, content, event_type, day)."""
+
+from __future__ import annotations
+
+from datetime import date, datetime, time, timezone
+from typing import Any, Iterable, Optional
+
+import pandas as pd
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.models import UserInteractionDaily
+from app.services.constants import EVENT_TYPE_CODES
+from app.services.pair_scores import apply_pair_deltas, lock_pair_rows, pair_scores_enabled
+
+DailyKey = tuple[int, int, int, str, date]  # (actor, target, content_id | 0, event_type, day UTC)
+
+
+class DailyRollup:
+    """
+    Gom các event đã normalize (dict như normalize_event) thành delta cho `user_interaction_daily`,
+    để mỗi batch/chunk chỉ cần 1 upsert / key thay vì 1 / event.
+
+    View đã qua sampling 1/N (row có `sample_n`, xem ViewEventFilter) được cộng N lần: count của rollup
+    là số view ước lượng, scoring đọc thẳng không nhân thêm.
+    """
+
+    def __init__(self) -> None:
+        self._acc: dict[DailyKey, list] = {}  # key -> [count, last_occurred_at]
+
+    def __len__(self) -> int:
+        return len(self._acc)
+
+    def add(self, row: dict[str, Any], n: int = 1) -> None:
+        n *= int(row.get("sample_n") or 1)
+        occurred_at: datetime = row["occurred_at"]
+        key = (
+            int(row["actor_user_id"]),
+            int(row["target_user_id"]),
+            int(row.get("content_id") or 0),
+            row["event_type"],
+            occurred_at.date(),
+        )
+        acc = self._acc.get(key)
+        if acc is None:
+            self._acc[key] = [n, occurred_at]
+        else:
+            acc[0] += n
+            if occurred_at > acc[1]:
+                acc[1] = occurred_at
+
+    def extend(self, rows: Iterable[dict[str, Any]]) -> "DailyRollup":
+        for row in rows:
+            self.add(row)
+        return self
+
+    def rows(self) -> list[dict[str, Any]]:
+        """Delta rows (sắp theo key để các upsert đồng thời luôn lock theo cùng thứ tự → tránh deadlock)."""
+        return [
+            {
+                "actor_user_id": k[0],
+                "target_user_id": k[1],
+                "content_id": k[2],
+                "event_type": k[3],
+                "day": k[4],
+                "event_count": acc[0],
+                "last_occurred_at": acc[1],
+            }
+            for k, acc in sorted(self._acc.items(), key=lambda kv: kv[0])
+        ]
+
+
+def rollup_frame(df: pd.DataFrame) -> list[dict[str, Any]]:
+    """Rollup cho 1 DataFrame đã validate (cột như COPY_COLUMNS) – groupby thay vì lặp theo row."""
+    if df.empty:
+        return []
+    keys = pd.DataFrame(
+        {
+            "actor_user_id": df["actor_user_id"].astype("int64"),
+            "target_user_id": df["target_user_id"].astype("int64"),
+            "content_id": df["content_id"].fillna(0).astype("int64"),
+            "event_type": df["event_type"],
+            "day": df["occurred_at"].dt.tz_convert("UTC").dt.date,
+            "occurred_at": df["occurred_at"],
+        }
+    )
+    agg = (
+        keys.groupby(["actor_user_id", "target_user_id", "content_id", "event_type", "day"], sort=True)
+        .agg(event_count=("occurred_at", "size"), last_occurred_at=("occurred_at", "max"))
+        .reset_index()
+    )
+    agg["last_occurred_at"] = agg["last_occurred_at"].map(lambda ts: ts.to_pydatetime())
+    return agg.to_dict("records")
+
+
+def upsert_daily_rows(db: Session, rows: list[dict[str, Any]]) -> None:
+    """
+    Cộng delta vào `user_interaction_daily` (event_count += delta, last_occurred_at = max, updated_at = now()).
+    Không commit.
+    `rows` mang tên event type (như DailyRollup.rows / rollup_frame), được đổi sang mã smallint khi ghi.
+    Khi PAIR_SCORES_ENABLED: cập nhật luôn user_pair_scores trong cùng transaction.
+    """
+    if not rows:
+        return
+    maintain_pairs = pair_scores_enabled()
+    if maintain_pairs:
+        lock_pair_rows(db, rows)
+    named_rows = rows
+    rows = [{**r, "event_type": EVENT_TYPE_CODES[r["event_type"]]} for r in rows]
+    stmt = pg_insert(UserInteractionDaily)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["actor_user_id", "target_user_id", "content_id", "event_type", "day"],
+        set_=dict(
+            event_count=UserInteractionDaily.event_count + stmt.excluded.event_count,
+            last_occurred_at=func.greatest(UserInteractionDaily.last_occurred_at, stmt.excluded.last_occurred_at),
+            updated_at=func.now(),
+        ),
+    )
+    db.execute(stmt, rows)
+    if maintain_pairs:
+        apply_pair_deltas(db, named_rows)
+
+
+def rebuild_daily_from_events(db: Session, *, since: date, until: Optional[date] = None) -> int:
+    """
+    Đồng bộ lại rollup từ raw events cho các ngày [since, until) (sửa lệch khi event được ghi
+    ngoài các đường ingest của service, hoặc lần đầu bật rollup trên DB cũ).
+    Không cập nhật user_pair_scores → chạy app/jobs/rebuild_pair_scores.py sau đó.
+
+    Dùng GREATEST với giá trị hiện có: count của event đã gộp bởi cap-aware ingest (không có raw row)
+    không bị ghi đè nhỏ đi; chạy lại nhiều lần cho cùng kết quả. updated_at chỉ đổi ở row thực sự tăng.
+    Commit, trả về số key đã ghi.
+    """
+    params: dict[str, Any] = {"since": datetime.combine(since, time(), tzinfo=timezone.utc)}
+    until_sql = ""
+    if until is not None:
+        params["until"] = datetime.combine(until, time(), tzinfo=timezone.utc)
+        until_sql = "AND occurred_at < :until"
+    result = db.execute(
+        text(
+            f"""
+            INSERT INTO user_interaction_daily
+                (actor_user_id, target_user_id, content_id, event_type, day, event_count, last_occurred_at)
+            SELECT actor_user_id, target_user_id, COALESCE(content_id, 0), event_type,
+                   (occurred_at AT TIME ZONE 'UTC')::date, count(*), max(occurred_at)
+            FROM user_interaction_events
+            WHERE occurred_at >= :since {until_sql}
+            GROUP BY 1, 2, 3, 4, 5
+            ON CONFLICT (actor_user_id, target_user_id, content_id, event_type, day) DO UPDATE SET
+                event_count = GREATEST(user_interaction_daily.event_count, EXCLUDED.event_count),
+                last_occurred_at = GREATEST(user_interaction_daily.last_occurred_at, EXCLUDED.last_occurred_at),
+                updated_at = CASE
+                    WHEN EXCLUDED.event_count > user_interaction_daily.event_count
+                      OR EXCLUDED.last_occurred_at > user_interaction_daily.last_occurred_at
+                    THEN now() ELSE user_interaction_daily.updated_at END
+            """
+        ),
+        params,
+    )
+    db.commit()
+    return int(result.rowcount or 0)
+
+
+def expire_daily_rows(db: Session, *, before: date) -> int:
+    """Xoá rollup của các ngày < before (retention giống raw events). Commit, trả về số row đã xoá."""
+    result = db.execute(text("DELETE FROM user_interaction_daily WHERE day < :before"), {"before": before})
+    db.commit()
+    return int(result.rowcount or 0)
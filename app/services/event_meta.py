@@ -0,0 +1,76 @@
+"""Side table `user_interaction_event_meta`: session_id / metadata tách khỏi raw events."""
+
+from __future__ import annotations
+
+from datetime import date, datetime, time, timezone
+from typing import Any, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+META_COLUMNS: tuple[str, ...] = ("event_id", "occurred_at", "session_id", "meta")
+
+
+def has_meta(row: dict[str, Any]) -> bool:
+    """Row cần ghi side table khi có session_id hoặc metadata khác rỗng."""
+    return bool(row.get("session_id")) or bool(row.get("meta"))
+
+
+def store_meta_enabled() -> bool:
+    from app.utils.config import settings
+
+    return settings.EVENTS_STORE_META
+
+
+def meta_rows(ids: Sequence[Optional[int]], rows: Sequence[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Ghép id đã ghi với các row có session_id / metadata (bỏ row không có id, vd. event vượt cap)."""
+    return [
+        {
+            "event_id": event_id,
+            "occurred_at": row["occurred_at"],
+            "session_id": row.get("session_id"),
+            "meta": row.get("meta") or {},
+        }
+        for event_id, row in zip(ids, rows)
+        if event_id is not None and has_meta(row)
+    ]
+
+
+def allocate_event_ids(db: Session, n: int) -> list[int]:
+    """
+    Cấp trước n id từ sequence của `user_interaction_events.id` (COPY không có RETURNING,
+    cần id trước để ghi side table trong cùng transaction).
+    """
+    if n <= 0:
+        return []
+    result = db.execute(
+        text(
+            "SELECT nextval(pg_get_serial_sequence('user_interaction_events', 'id')) "
+            "FROM generate_series(1, :n)"
+        ),
+        {"n": n},
+    )
+    return [int(i) for i in result.scalars().all()]
+
+
+def write_event_meta(db: Session, rows: Sequence[dict[str, Any]]) -> int:
+    """Ghi side rows (dict theo META_COLUMNS) bằng 1 lệnh COPY. Không commit, trả về số row."""
+    if not rows:
+        return 0
+    from psycopg.types.json import Jsonb
+
+    raw_conn = db.connection().connection.driver_connection
+    sql = f"COPY user_interaction_event_meta ({', '.join(META_COLUMNS)}) FROM STDIN"
+    with raw_conn.cursor() as cur:
+        with cur.copy(sql) as copy:
+            for row in rows:
+                copy.write_row([row["event_id"], row["occurred_at"], row["session_id"], Jsonb(row["meta"])])
+    return len(rows)
+
+
+def expire_event_meta(db: Session, *, before: date) -> int:
+    """Xoá side rows của event có occurred_at < before (đi cùng retention partitions). Commit."""
+    cutoff = datetime.combine(before, time(), tzinfo=timezone.utc)
+    result = db.execute(text("DELETE FROM user_interaction_event_meta WHERE occurred_at < :c"), {"c": cutoff})
+    db.commit()
+    return int(result.rowcount or 0)
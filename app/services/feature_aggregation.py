@@ -6,19 +6,127 @@ from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Optional
 
-from sqlalchemy import func, select
+from sqlalchemy import DateTime, func, literal, select
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from app.models.models import (
-    UserInteractionEvent,
+    EventType,
+    UserInteractionDaily,
     UserPostEngagement,
     UserReelEngagement,
     UserProfileFeatures,
     Reel,
 )
-from app.services.scoring import event_score_from_count
-from app.services.time_utils import days_ago, half_life_decay, utcnow
+from app.services.constants import decode_event_type
+from app.services.scoring import sql_days_ago, sql_event_score, sql_half_life_decay
+from app.services.time_utils import utcnow
+
+
+def _engagement_select(per_type, *, half_life_days: float, now: datetime):
+    """
+    Từ subquery `per_type` (actor_user_id, content_id, day, event_type, cnt, last_occurred_at)
+    dựng SELECT trả về đúng 1 row / (user, content) đã tính xong trong SQL:
+    score = sum_ngày(sum_type(event_score) * decay(last_occurred_at của ngày)),
+    chỉ tính các ngày có base score > 0; event_breakdown gồm mọi ngày trong window.
+    """
+    pt = per_type
+    per_day = (
+        select(
+            pt.c.actor_user_id,
+            pt.c.content_id,
+            pt.c.day,
+            func.sum(sql_event_score(pt.c.event_type, pt.c.cnt)).label("base_day"),
+            func.sum(pt.c.cnt).label("cnt_day"),
+            func.max(pt.c.last_occurred_at).label("last_day"),
+        )
+        .group_by(pt.c.actor_user_id, pt.c.content_id, pt.c.day)
+        .subquery("per_day")
+    )
+    named = (
+        select(
+            pt.c.actor_user_id,
+            pt.c.content_id,
+            func.coalesce(EventType.name, "unknown").label("event_type"),
+            pt.c.cnt,
+        )
+        .join(EventType, EventType.code == pt.c.event_type, isouter=True)
+        .subquery("named")
+    )
+    by_type = (
+        select(
+            named.c.actor_user_id,
+            named.c.content_id,
+            named.c.event_type,
+            func.sum(named.c.cnt).label("cnt"),
+        )
+        .group_by(named.c.actor_user_id, named.c.content_id, named.c.event_type)
+        .subquery("by_type")
+    )
+    breakdown = (
+        select(
+            by_type.c.actor_user_id,
+            by_type.c.content_id,
+            func.json_object_agg(by_type.c.event_type, by_type.c.cnt).label("event_breakdown"),
+        )
+        .group_by(by_type.c.actor_user_id, by_type.c.content_id)
+        .subquery("breakdown")
+    )
+
+    pd = per_day
+    positive = pd.c.base_day > 0
+    decay = sql_half_life_decay(sql_days_ago(pd.c.last_day, ref=now), half_life_days=half_life_days)
+    per_pair = (
+        select(
+            pd.c.actor_user_id,
+            pd.c.content_id,
+            func.coalesce(func.sum(pd.c.base_day * decay).filter(positive), 0.0).label("score"),
+            func.coalesce(func.sum(pd.c.cnt_day).filter(positive), 0).label("count"),
+            func.max(pd.c.last_day).filter(positive).label("last_at"),
+        )
+        .group_by(pd.c.actor_user_id, pd.c.content_id)
+        .subquery("per_pair")
+    )
+    pp = per_pair
+    return select(
+        pp.c.actor_user_id,
+        pp.c.content_id,
+        pp.c.score,
+        pp.c.count,
+        pp.c.last_at,
+        breakdown.c.event_breakdown,
+        literal(now, DateTime(timezone=True)),
+    ).join(
+        breakdown,
+        (breakdown.c.actor_user_id == pp.c.actor_user_id) & (breakdown.c.content_id == pp.c.content_id),
+    )
+
+
+def _upsert_engagement(db: Session, model, content_key: str, source) -> None:
+    """INSERT ... SELECT ... ON CONFLICT: kết quả đi thẳng từ SQL vào bảng engagement."""
+    stmt = insert(model).from_select(
+        [
+            "user_id",
+            content_key,
+            "engagement_score",
+            "interaction_count",
+            "last_interaction_at",
+            "event_breakdown",
+            "updated_at",
+        ],
+        source,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", content_key],
+        set_=dict(
+            engagement_score=stmt.excluded.engagement_score,
+            interaction_count=stmt.excluded.interaction_count,
+            last_interaction_at=stmt.excluded.last_interaction_at,
+            event_breakdown=stmt.excluded.event_breakdown,
+            updated_at=stmt.excluded.updated_at,
+        ),
+    )
+    db.execute(stmt)
 
 
 def compute_user_post_engagement(
@@ -32,7 +140,7 @@ def compute_user_post_engagement(
     """
     Tính toán và cập nhật bảng `user_post_engagement` từ events.
 
-    Logic:
+    Logic (toàn bộ chạy trong 1 câu SQL, Python chỉ dựng expression):
     1. Aggregate events theo (user_id, post_id, day, event_type) -> count
     2. Tính score cho mỗi ngày: sum(event_score_from_count(event_type, count))
     3. Áp dụng time-decay cho mỗi ngày
@@ -46,112 +154,31 @@ def compute_user_post_engagement(
     """
     cutoff = utcnow() - timedelta(days=window_days)
 
-    # Build query với filters
+    # Build query với filters (đọc rollup user_interaction_daily thay vì GROUP BY trên raw events)
+    d = UserInteractionDaily
     q = (
         select(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.content_id.label("post_id"),
-            func.date(UserInteractionEvent.occurred_at).label("day"),
-            UserInteractionEvent.event_type,
-            func.count().label("cnt"),
-            func.max(UserInteractionEvent.occurred_at).label("last_occurred_at"),
+            d.actor_user_id,
+            d.content_id,
+            d.day,
+            d.event_type,
+            func.sum(d.event_count).label("cnt"),
+            func.max(d.last_occurred_at).label("last_occurred_at"),
         )
         .where(
-            UserInteractionEvent.occurred_at >= cutoff,
-            UserInteractionEvent.content_id.isnot(None),  # Chỉ lấy events có post_id
-        )
-        .group_by(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.content_id,
-            func.date(UserInteractionEvent.occurred_at),
-            UserInteractionEvent.event_type,
+            d.day >= cutoff.date(),
+            d.content_id != 0,  # Chỉ lấy events có post_id
         )
+        .group_by(d.actor_user_id, d.content_id, d.day, d.event_type)
     )
 
     if user_id is not None:
-        q = q.where(UserInteractionEvent.actor_user_id == user_id)
+        q = q.where(d.actor_user_id == user_id)
     if post_id is not None:
-        q = q.where(UserInteractionEvent.content_id == post_id)
-
-    # Aggregate theo (user_id, post_id, day, event_type)
-    daily_data: dict[tuple[int, int, datetime.date], dict[str, int]] = defaultdict(
-        lambda: defaultdict(int)
-    )
-    last_occurred: dict[tuple[int, int, datetime.date], datetime] = {}
-
-    for row in db.execute(q).all():
-        actor_id = int(row.actor_user_id)
-        post_id_val = int(row.post_id)
-        day_val = row.day
-        event_type = str(row.event_type).strip().lower()
-        cnt = int(row.cnt)
-        last_at = row.last_occurred_at
-
-        key = (actor_id, post_id_val, day_val)
-        daily_data[key][event_type] += cnt
-        if last_at and (key not in last_occurred or last_at > last_occurred[key]):
-            last_occurred[key] = last_at
-
-    now = utcnow()
-
-    # Tính engagement score với time-decay
-    engagement_data: dict[tuple[int, int], dict] = defaultdict(
-        lambda: {
-            "score": 0.0,
-            "count": 0,
-            "last_interaction_at": None,
-            "event_breakdown": defaultdict(int),
-        }
-    )
-
-    for (user_id_val, post_id_val, d), counts_by_type in daily_data.items():
-        # Base score trong 1 ngày
-        base_day = 0.0
-        for et, c in counts_by_type.items():
-            base_day += event_score_from_count(et, c)
-            engagement_data[(user_id_val, post_id_val)]["event_breakdown"][et] += c
-
-        if base_day <= 0:
-            continue
-
-        # Time-decay
-        day_for_decay = last_occurred.get((user_id_val, post_id_val, d), d)
-        d_ago = days_ago(day_for_decay, ref=now)
-
-        decay = half_life_decay(d_ago, half_life_days=half_life_days)
-        engagement_data[(user_id_val, post_id_val)]["score"] += base_day * decay
-        engagement_data[(user_id_val, post_id_val)]["count"] += sum(counts_by_type.values())
-
-        # Update last_interaction_at
-        last_at = last_occurred.get((user_id_val, post_id_val, d))
-        if last_at:
-            current_last = engagement_data[(user_id_val, post_id_val)]["last_interaction_at"]
-            if current_last is None or last_at > current_last:
-                engagement_data[(user_id_val, post_id_val)]["last_interaction_at"] = last_at
-
-    # Upsert vào database
-    for (user_id_val, post_id_val), data in engagement_data.items():
-        stmt = insert(UserPostEngagement).values(
-            user_id=user_id_val,
-            post_id=post_id_val,
-            engagement_score=data["score"],
-            interaction_count=data["count"],
-            last_interaction_at=data["last_interaction_at"],
-            event_breakdown=dict(data["event_breakdown"]),
-            updated_at=now,
-        )
-        stmt = stmt.on_conflict_do_update(
-            index_elements=["user_id", "post_id"],
-            set_=dict(
-                engagement_score=stmt.excluded.engagement_score,
-                interaction_count=stmt.excluded.interaction_count,
-                last_interaction_at=stmt.excluded.last_interaction_at,
-                event_breakdown=stmt.excluded.event_breakdown,
-                updated_at=stmt.excluded.updated_at,
-            ),
-        )
-        db.execute(stmt)
+        q = q.where(d.content_id == post_id)
 
+    source = _engagement_select(q.subquery("per_type"), half_life_days=half_life_days, now=utcnow())
+    _upsert_engagement(db, UserPostEngagement, "post_id", source)
     db.commit()
 
 
@@ -169,104 +196,28 @@ def compute_user_reel_engagement(
     cutoff = utcnow() - timedelta(days=window_days)
 
     # Build query với filters - Join với Reel để đảm bảo content_id là reel_id
+    d = UserInteractionDaily
     q = (
         select(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.content_id.label("reel_id"),
-            func.date(UserInteractionEvent.occurred_at).label("day"),
-            UserInteractionEvent.event_type,
-            func.count().label("cnt"),
-            func.max(UserInteractionEvent.occurred_at).label("last_occurred_at"),
-        )
-        .join(Reel, UserInteractionEvent.content_id == Reel.id)
-        .where(
-            UserInteractionEvent.occurred_at >= cutoff,
-            UserInteractionEvent.content_id.isnot(None),
-        )
-        .group_by(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.content_id,
-            func.date(UserInteractionEvent.occurred_at),
-            UserInteractionEvent.event_type,
+            d.actor_user_id,
+            d.content_id,
+            d.day,
+            d.event_type,
+            func.sum(d.event_count).label("cnt"),
+            func.max(d.last_occurred_at).label("last_occurred_at"),
         )
+        .join(Reel, d.content_id == Reel.id)
+        .where(d.day >= cutoff.date())
+        .group_by(d.actor_user_id, d.content_id, d.day, d.event_type)
     )
 
     if user_id is not None:
-        q = q.where(UserInteractionEvent.actor_user_id == user_id)
+        q = q.where(d.actor_user_id == user_id)
     if reel_id is not None:
-        q = q.where(UserInteractionEvent.content_id == reel_id)
-
-    daily_data: dict[tuple[int, int, datetime.date], dict[str, int]] = defaultdict(
-        lambda: defaultdict(int)
-    )
-    last_occurred: dict[tuple[int, int, datetime.date], datetime] = {}
-
-    for row in db.execute(q).all():
-        actor_id = int(row.actor_user_id)
-        reel_id_val = int(row.reel_id)
-        day_val = row.day
-        event_type = str(row.event_type).strip().lower()
-        cnt = int(row.cnt)
-        last_at = row.last_occurred_at
-
-        key = (actor_id, reel_id_val, day_val)
-        daily_data[key][event_type] += cnt
-        if last_at and (key not in last_occurred or last_at > last_occurred[key]):
-            last_occurred[key] = last_at
-
-    now = utcnow()
-    engagement_data: dict[tuple[int, int], dict] = defaultdict(
-        lambda: {
-            "score": 0.0,
-            "count": 0,
-            "last_interaction_at": None,
-            "event_breakdown": defaultdict(int),
-        }
-    )
-
-    for (u_id, r_id, d), counts_by_type in daily_data.items():
-        base_day = 0.0
-        for et, c in counts_by_type.items():
-            base_day += event_score_from_count(et, c)
-            engagement_data[(u_id, r_id)]["event_breakdown"][et] += c
-
-        if base_day <= 0:
-            continue
-
-        day_for_decay = last_occurred.get((u_id, r_id, d), d)
-        d_ago = days_ago(day_for_decay, ref=now)
-        decay = half_life_decay(d_ago, half_life_days=half_life_days)
-        engagement_data[(u_id, r_id)]["score"] += base_day * decay
-        engagement_data[(u_id, r_id)]["count"] += sum(counts_by_type.values())
-
-        last_at = last_occurred.get((u_id, r_id, d))
-        if last_at:
-            curr_last = engagement_data[(u_id, r_id)]["last_interaction_at"]
-            if curr_last is None or last_at > curr_last:
-                engagement_data[(u_id, r_id)]["last_interaction_at"] = last_at
-
-    for (u_id, r_id), data in engagement_data.items():
-        stmt = insert(UserReelEngagement).values(
-            user_id=u_id,
-            reel_id=r_id,
-            engagement_score=data["score"],
-            interaction_count=data["count"],
-            last_interaction_at=data["last_interaction_at"],
-            event_breakdown=dict(data["event_breakdown"]),
-            updated_at=now,
-        )
-        stmt = stmt.on_conflict_do_update(
-            index_elements=["user_id", "reel_id"],
-            set_=dict(
-                engagement_score=stmt.excluded.engagement_score,
-                interaction_count=stmt.excluded.interaction_count,
-                last_interaction_at=stmt.excluded.last_interaction_at,
-                event_breakdown=stmt.excluded.event_breakdown,
-                updated_at=stmt.excluded.updated_at,
-            ),
-        )
-        db.execute(stmt)
+        q = q.where(d.content_id == reel_id)
 
+    source = _engagement_select(q.subquery("per_type"), half_life_days=half_life_days, now=utcnow())
+    _upsert_engagement(db, UserReelEngagement, "reel_id", source)
     db.commit()
 
 
@@ -293,30 +244,26 @@ def compute_user_profile_features(
 
     # Query events của user, join với Post và Reel để phân loại
     from app.models.models import Post
+    d = UserInteractionDaily
     q = (
         select(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.event_type,
-            UserInteractionEvent.target_user_id,
-            UserInteractionEvent.content_id,
-            func.max(UserInteractionEvent.occurred_at).label("last_occurred_at"),
-            func.count().label("cnt"),
+            d.actor_user_id,
+            d.event_type,
+            d.target_user_id,
+            d.content_id,
+            func.max(d.last_occurred_at).label("last_occurred_at"),
+            func.sum(d.event_count).label("cnt"),
             func.max(Post.id).label("is_post"),
             func.max(Reel.id).label("is_reel"),
         )
-        .join(Post, UserInteractionEvent.content_id == Post.id, isouter=True)
-        .join(Reel, UserInteractionEvent.content_id == Reel.id, isouter=True)
-        .where(UserInteractionEvent.occurred_at >= cutoff)
-        .group_by(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.event_type,
-            UserInteractionEvent.target_user_id,
-            UserInteractionEvent.content_id,
-        )
+        .join(Post, d.content_id == Post.id, isouter=True)
+        .join(Reel, d.content_id == Reel.id, isouter=True)
+        .where(d.day >= cutoff.date())
+        .group_by(d.actor_user_id, d.event_type, d.target_user_id, d.content_id)
     )
 
     if user_id is not None:
-        q = q.where(UserInteractionEvent.actor_user_id == user_id)
+        q = q.where(d.actor_user_id == user_id)
 
     # Aggregate theo user
     user_data: dict[int, dict] = defaultdict(
@@ -332,7 +279,7 @@ def compute_user_profile_features(
 
     for row in db.execute(q).all():
         actor_id = int(row.actor_user_id)
-        event_type = str(row.event_type).strip().lower()
+        event_type = decode_event_type(row.event_type)
         target_id = row.target_user_id
         content_id = row.content_id
         last_at = row.last_occurred_at
@@ -0,0 +1,289 @@
+"""
+Cache đồ thị bạn bè dùng chung cho process: mọi lookup bạn bè (recommend users, social graph posts / reels)
+đi qua get_friend_ids thay vì 2 query `friends` (2 chiều) mỗi lần.
+
+- Bảng friends lưu 1 chiều → nạp nguyên bảng 1 lần, đối xứng hoá thành CSR (user_ids tăng dần, indptr,
+  friend_ids tăng dần trong từng hàng, int64).
+- Change feed: trigger của sql/008_friends_change_feed.sql gửi NOTIFY `friends_changed` khi thêm / xoá
+  quan hệ; thread nền LISTEN và đánh dấu 2 user liên quan là invalid → lần đọc sau của họ query lại DB
+  (miss) rồi nhớ kết quả. TRUNCATE / kết nối lại LISTEN → nạp lại cả bảng.
+- Nạp lại toàn bộ mỗi FRIEND_CACHE_TTL_S giây (kể cả khi chưa cài trigger → cache trễ tối đa TTL).
+- Đếm hit / miss (stats() / GET /health/friends).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set
+
+import numpy as np
+from sqlalchemy import select, union
+from sqlalchemy.orm import Session
+
+from app.models.models import Friend
+from app.utils.config import settings
+
+NOTIFY_CHANNEL = "friends_changed"
+
+_FRIEND_EDGES_SQL = "SELECT user_id, friend_id FROM friends"
+
+
+@dataclass(frozen=True)
+class FriendCSR:
+    """Quan hệ bạn bè đã đối xứng hoá: bạn của user_ids[i] = friend_ids[indptr[i]:indptr[i+1]] (tăng dần)."""
+
+    user_ids: np.ndarray
+    indptr: np.ndarray
+    friend_ids: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.user_ids.nbytes + self.indptr.nbytes + self.friend_ids.nbytes)
+
+    def friends_of(self, user_id: int) -> np.ndarray:
+        at = int(np.searchsorted(self.user_ids, user_id))
+        if at < len(self.user_ids) and int(self.user_ids[at]) == user_id:
+            return self.friend_ids[self.indptr[at] : self.indptr[at + 1]]
+        return self.friend_ids[:0]
+
+
+def build_friend_csr(user_ids: np.ndarray, friend_ids: np.ndarray) -> FriendCSR:
+    """FriendCSR từ các row (user_id, friend_id) của bảng friends (mỗi row → 2 chiều, bỏ trùng)."""
+    a = np.asarray(user_ids, dtype=np.int64)
+    b = np.asarray(friend_ids, dtype=np.int64)
+    src, dst = np.concatenate([a, b]), np.concatenate([b, a])
+    order = np.lexsort((dst, src))
+    src, dst = src[order], dst[order]
+    keep = np.r_[True, (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])] if len(src) else np.zeros(0, dtype=bool)
+    src, dst = src[keep], dst[keep]
+    users, rows = np.unique(src, return_inverse=True)
+    indptr = np.zeros(len(users) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(users)), out=indptr[1:])
+    return FriendCSR(user_ids=users, indptr=indptr, friend_ids=dst)
+
+
+def load_friend_csr(db: Session) -> FriendCSR:
+    raw_conn = db.connection().connection.driver_connection
+    with raw_conn.cursor() as cur:
+        cur.execute(_FRIEND_EDGES_SQL)
+        rows = cur.fetchall()
+    data = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    return build_friend_csr(data[:, 0], data[:, 1])
+
+
+def query_friend_ids(db: Session, user_id: int) -> set[int]:
+    """Bạn bè của user_id đọc thẳng từ DB (bảng friends lưu 1 chiều → cả 2 chiều, 1 câu UNION)."""
+    q = union(
+        select(Friend.friend_id).where(Friend.user_id == user_id),
+        select(Friend.user_id).where(Friend.friend_id == user_id),
+    )
+    return {int(r[0]) for r in db.execute(q).all()}
+
+
+class FriendGraphCache:
+    """
+    FriendCSR (đổi nguyên khối khi nạp lại) + các hàng đã query lại sau khi bị invalidate.
+
+    Mỗi user có 1 version tăng khi bị invalidate; kết quả query lại chỉ được nhớ nếu version không đổi trong
+    lúc query (NOTIFY tới giữa chừng → lần sau query lại). User bị invalidate trong lúc đang nạp cả bảng
+    vẫn invalid sau khi đổi sang bảng mới.
+    """
+
+    def __init__(self, *, ttl_s: Optional[float] = None) -> None:
+        self._ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._csr: Optional[FriendCSR] = None
+        self._rows: Dict[int, np.ndarray] = {}
+        self._invalid: Set[int] = set()
+        self._invalid_during_reload: Optional[Set[int]] = None
+        self._versions: Dict[int, int] = {}
+        self._loaded_mono = float("-inf")
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.listening = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.notifications = 0
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.load_ms = 0.0
+
+    @property
+    def ttl_s(self) -> float:
+        return float(self._ttl_s if self._ttl_s is not None else settings.FRIEND_CACHE_TTL_S)
+
+    @property
+    def ready(self) -> bool:
+        return self._csr is not None
+
+    # ---- đọc ----
+
+    def peek(self, user_id: int) -> Optional[np.ndarray]:
+        """Bạn bè của user_id nếu cache trả lời được (hit), None nếu không (miss – caller tự đọc DB)."""
+        with self._lock:
+            csr = self._csr
+            if csr is None or user_id in self._invalid:
+                self.misses += 1
+                return None
+            self.hits += 1
+            row = self._rows.get(user_id)
+            return row if row is not None else csr.friends_of(user_id)
+
+    def get(self, db: Session, user_id: int) -> set[int]:
+        """Bạn bè của user_id: từ cache, miss → query DB (và nhớ lại nếu không bị invalidate giữa chừng)."""
+        row = self.peek(user_id)
+        if row is not None:
+            return set(row.tolist())
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+        friend_ids = query_friend_ids(db, user_id)
+        with self._lock:
+            if self._csr is not None and self._versions.get(user_id, 0) == version:
+                self._rows[user_id] = np.array(sorted(friend_ids), dtype=np.int64)
+                self._invalid.discard(user_id)
+        return friend_ids
+
+    # ---- cập nhật ----
+
+    def invalidate(self, *user_ids: int) -> None:
+        with self._lock:
+            for uid in user_ids:
+                self._versions[uid] = self._versions.get(uid, 0) + 1
+                self._invalid.add(uid)
+                self._rows.pop(uid, None)
+                if self._invalid_during_reload is not None:
+                    self._invalid_during_reload.add(uid)
+            self.invalidations += len(user_ids)
+
+    def reload(self) -> None:
+        """Nạp lại cả bảng friends (chỉ 1 thread nạp cùng lúc)."""
+        from app.utils.database import SessionLocal
+
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        db = SessionLocal()
+        try:
+            with self._lock:
+                self._invalid_during_reload = set()
+            t0 = time.perf_counter()
+            csr = load_friend_csr(db)
+            with self._lock:
+                self._csr = csr
+                self._rows.clear()
+                self._invalid = self._invalid_during_reload
+                self._invalid_during_reload = None
+            self._loaded_mono = time.monotonic()
+            self.load_ms = (time.perf_counter() - t0) * 1000.0
+            self.reloads += 1
+        except Exception as e:
+            with self._lock:
+                if self._invalid_during_reload is not None:
+                    self._invalid |= self._invalid_during_reload
+                self._invalid_during_reload = None
+            self.failed_reloads += 1
+            print(f"⚠️ [Friend Cache] Nạp bảng friends lỗi: {e}")
+        finally:
+            db.close()
+            self._reload_lock.release()
+
+    def handle_notification(self, payload: str) -> None:
+        """Payload của trigger: "I,<user_id>,<friend_id>" / "D,<user_id>,<friend_id>" / "T" (truncate)."""
+        self.notifications += 1
+        op, _, rest = payload.partition(",")
+        if op == "T" or not rest:
+            self.reload()
+            return
+        a, _, b = rest.partition(",")
+        self.invalidate(int(a), int(b))
+
+    def start(self) -> None:
+        """Thread nền: nạp lần đầu, LISTEN change feed, nạp lại mỗi FRIEND_CACHE_TTL_S giây."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="friend-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _reload_if_due(self) -> None:
+        if time.monotonic() - self._loaded_mono >= self.ttl_s:
+            self.reload()
+
+    def _run(self) -> None:
+        from app.utils.database import engine
+
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                raw = engine.raw_connection()
+                conn = raw.driver_connection
+                raw.detach()  # connection riêng cho LISTEN, không trả về pool
+                conn.autocommit = True
+                conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                self.listening = True
+                # Nạp lại sau khi LISTEN → không lọt thay đổi nào trong lúc chưa nghe
+                self.reload()
+                while not self._stopping.is_set():
+                    for notify in conn.notifies(timeout=1.0):
+                        self.handle_notification(notify.payload)
+                    self._reload_if_due()
+            except Exception as e:
+                print(f"⚠️ [Friend Cache] LISTEN {NOTIFY_CHANNEL} lỗi, chỉ nạp lại theo TTL: {e}")
+                self._reload_if_due()
+                self._stopping.wait(timeout=5.0)
+            finally:
+                self.listening = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            csr = self._csr
+            lookups = self.hits + self.misses
+            return {
+                "ready": csr is not None,
+                "listening": self.listening,
+                "users": len(csr.user_ids) if csr is not None else 0,
+                "edges": len(csr.friend_ids) if csr is not None else 0,
+                "memory_bytes": csr.nbytes if csr is not None else 0,
+                "reloaded_rows": len(self._rows),
+                "invalid_users": len(self._invalid),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "invalidations": self.invalidations,
+                "notifications": self.notifications,
+                "reloads": self.reloads,
+                "failed_reloads": self.failed_reloads,
+                "load_ms": round(self.load_ms, 3),
+            }
+
+
+# Cache dùng chung của process (thread nền chạy khi FRIEND_CACHE_ENABLED, xem app/utils/main.py)
+friend_cache = FriendGraphCache()
+
+
+def get_friend_ids(db: Session, user_id: int) -> set[int]:
+    """Bạn bè của user_id (cả 2 chiều): qua friend_cache nếu bật, ngược lại query DB."""
+    if settings.FRIEND_CACHE_ENABLED:
+        return friend_cache.get(db, user_id)
+    return query_friend_ids(db, user_id)
+
+
+def cached_friend_ids(user_id: int) -> Optional[np.ndarray]:
+    """Bạn bè của user_id nếu cache trả lời được mà không cần DB (mảng int64 tăng dần); None → caller tự đọc."""
+    if not settings.FRIEND_CACHE_ENABLED:
+        return None
+    return friend_cache.peek(user_id)
@@ -2,19 +2,35 @@
 
 from __future__ import annotations
 
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Optional
+from typing import Any, Optional, Sequence
 
 from fastapi import HTTPException
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
 from app.models.models import UserInteractionEvent
-from app.services.constants import ALLOWED_EVENT_TYPES
+from app.models.schemas import InteractionEventIn
+from app.services.cap_counter import get_cap_counter
+from app.services.constants import ALLOWED_EVENT_TYPES, encode_event_type
+from app.services.daily_agg import DailyRollup, upsert_daily_rows
+from app.services.event_meta import meta_rows, store_meta_enabled, write_event_meta
 from app.services.time_utils import utcnow
+from app.services.view_filter import get_view_filter
+from app.utils.config import settings
 
 
-def ingest_event(
-    db: Session,
+@dataclass(frozen=True)
+class IngestResultRow:
+    index: int
+    status: str  # "inserted" | "rejected" | "filtered" | "capped" | "spooled"
+    inserted_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+def normalize_event(
     *,
     actor_user_id: int,
     target_user_id: int,
@@ -24,30 +40,275 @@ def ingest_event(
     content_id: Optional[int] = None,
     session_id: Optional[str] = None,
     metadata: Optional[dict[str, Any]] = None,
-) -> int:
+) -> dict[str, Any]:
+    """
+    Validate + chuẩn hoá 1 event thành dict (cột của `user_interaction_events` + session_id/meta
+    cho side table `user_interaction_event_meta`):
+    - chặn self-interaction
+    - event_type lowercase, phải thuộc ALLOWED_EVENT_TYPES
+    - timestamp quy về UTC (naive → coi là UTC)
+
+    Raise ValueError nếu event không hợp lệ.
+    """
     if actor_user_id == target_user_id:
-        raise HTTPException(status_code=400, detail="self-interaction is not allowed")
+        raise ValueError("self-interaction is not allowed")
 
     et = event_type.strip().lower()
     if et not in ALLOWED_EVENT_TYPES:
-        raise HTTPException(status_code=400, detail=f"unsupported event_type: {event_type}")
+        raise ValueError(f"unsupported event_type: {event_type}")
 
     occurred_at = timestamp
     if occurred_at.tzinfo is None:
         occurred_at = occurred_at.replace(tzinfo=timezone.utc)
     occurred_at = occurred_at.astimezone(timezone.utc)
-    row = UserInteractionEvent(
-        actor_user_id=actor_user_id,
-        target_user_id=target_user_id,
-        event_type=et,
-        event_value=value,
-        content_id=content_id,
-        session_id=session_id,
-        occurred_at=occurred_at,
-        created_at=utcnow(),
-        meta=metadata or {},
+    return {
+        "actor_user_id": actor_user_id,
+        "target_user_id": target_user_id,
+        "event_type": et,
+        "event_value": value,
+        "content_id": content_id,
+        "session_id": session_id,
+        "occurred_at": occurred_at,
+        "created_at": utcnow(),
+        "meta": metadata or {},
+    }
+
+
+def event_db_values(row: dict[str, Any]) -> dict[str, Any]:
+    """Row đã normalize → giá trị cột của `user_interaction_events` (event_type → mã smallint)."""
+    return {
+        "actor_user_id": row["actor_user_id"],
+        "target_user_id": row["target_user_id"],
+        "event_type": encode_event_type(row["event_type"]),
+        "event_value": row["event_value"],
+        "content_id": row["content_id"],
+        "occurred_at": row["occurred_at"],
+        "created_at": row["created_at"],
+    }
+
+
+def insert_event_rows(db: Session, rows: Sequence[dict[str, Any]]) -> list[int]:
+    """
+    Ghi nhiều event (đã normalize) bằng multi-row INSERT ... RETURNING id,
+    kèm side rows session_id/metadata (nếu có và EVENTS_STORE_META bật).
+
+    Không commit – caller tự quyết định ranh giới transaction.
+    Trả về list id theo đúng thứ tự `rows`.
+    """
+    if not rows:
+        return []
+    stmt = insert(UserInteractionEvent).returning(UserInteractionEvent.id, sort_by_parameter_order=True)
+    ids = [int(i) for i in db.scalars(stmt, [event_db_values(r) for r in rows]).all()]
+    if store_meta_enabled():
+        write_event_meta(db, meta_rows(ids, rows))
+    return ids
+
+
+def admit_rows(rows: Sequence[dict[str, Any]]) -> list[bool]:
+    """
+    Cap-aware ingest: với mỗi row trả về True nếu đã vượt cap trong ngày (chỉ cần cộng rollup),
+    False nếu cần lưu raw. Khi INGEST_CAP_ENABLED tắt → luôn False.
+    """
+    counter = get_cap_counter()
+    if counter is None:
+        return [False] * len(rows)
+    return [not counter.admit(row) for row in rows]
+
+
+def release_rows(rows: Sequence[dict[str, Any]], capped: Sequence[bool]) -> None:
+    """
+    Hoàn lại những gì các row ghi thất bại đã giữ chỗ: slot cap của raw row đã admit và dedup key
+    của view (client retry không bị báo "filtered").
+    """
+    view_filter = get_view_filter()
+    for row in rows:
+        view_filter.release(row)
+    counter = get_cap_counter()
+    if counter is None:
+        return
+    for row, is_capped in zip(rows, capped):
+        if not is_capped:
+            counter.release(row)
+
+
+def write_event_rows(db: Session, rows: Sequence[dict[str, Any]], capped: Sequence[bool]) -> list[Optional[int]]:
+    """
+    Ghi chung cho mọi đường ingest:
+    - row trong cap → multi-row INSERT raw
+    - mọi row (kể cả vượt cap) → cộng vào rollup `user_interaction_daily`
+
+    Không commit. Trả về id theo thứ tự `rows` (None = row vượt cap, chỉ có trong rollup).
+    """
+    ids = iter(insert_event_rows(db, [r for r, c in zip(rows, capped) if not c]))
+    upsert_daily_rows(db, DailyRollup().extend(rows).rows())
+    return [None if c else next(ids) for c in capped]
+
+
+def ingest_event(
+    db: Session,
+    *,
+    actor_user_id: int,
+    target_user_id: int,
+    event_type: str,
+    timestamp: datetime,
+    value: Optional[float] = None,
+    content_id: Optional[int] = None,
+    session_id: Optional[str] = None,
+    metadata: Optional[dict[str, Any]] = None,
+) -> IngestResultRow:
+    """
+    Validate + ghi 1 event. Kết quả:
+    - "inserted" kèm id
+    - "filtered": view bị view filter bỏ qua (trùng trong session / không nằm trong mẫu 1/N)
+    - "capped": đã đủ cap scoring trong ngày, chỉ tăng counter ở `user_interaction_daily`
+    - "spooled": INGEST_MODE="spool", event đã fsync vào spool local, drainer ghi DB sau
+    """
+    try:
+        row = normalize_event(
+            actor_user_id=actor_user_id,
+            target_user_id=target_user_id,
+            event_type=event_type,
+            timestamp=timestamp,
+            value=value,
+            content_id=content_id,
+            session_id=session_id,
+            metadata=metadata,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if get_view_filter().should_drop(row):
+        return IngestResultRow(index=0, status="filtered")
+
+    capped = admit_rows([row])
+    if settings.INGEST_MODE == "spool":
+        _ingest_spooled([row], capped)
+        return IngestResultRow(index=0, status="spooled")
+    if settings.INGEST_MODE == "buffered":
+        inserted_id = _ingest_buffered(row, capped=capped[0])
+    else:
+        try:
+            (inserted_id,) = write_event_rows(db, [row], capped)
+            db.commit()
+        except Exception:
+            db.rollback()
+            release_rows([row], capped)
+            raise
+
+    if inserted_id is None:
+        return IngestResultRow(index=0, status="capped")
+    return IngestResultRow(index=0, status="inserted", inserted_id=inserted_id)
+
+
+def _ingest_buffered(row: dict[str, Any], *, capped: bool = False) -> Optional[int]:
+    """Đẩy event qua GroupCommitWriter và chờ tới khi nhóm chứa nó đã commit."""
+    from app.services.ingest_buffer import (
+        IngestBufferFullError,
+        IngestWriterStoppedError,
+        get_ingest_writer,
     )
-    db.add(row)
-    db.commit()
-    db.refresh(row)
-    return int(row.id)
+
+    writer = get_ingest_writer()
+    if writer is None:
+        release_rows([row], [capped])
+        raise HTTPException(status_code=503, detail="ingest writer is not running")
+    try:
+        future = writer.submit(row, capped=capped)
+    except IngestBufferFullError:
+        release_rows([row], [capped])
+        raise HTTPException(status_code=429, detail="ingest buffer is full, retry later")
+    except IngestWriterStoppedError:
+        release_rows([row], [capped])
+        raise HTTPException(status_code=503, detail="ingest writer is shutting down")
+
+    try:
+        return future.result(timeout=settings.INGEST_COMMIT_TIMEOUT_S)
+    except FutureTimeoutError:
+        raise HTTPException(status_code=503, detail="timed out waiting for ingest commit")
+    except IngestWriterStoppedError:
+        release_rows([row], [capped])
+        raise HTTPException(status_code=503, detail="ingest writer is shutting down")
+    except Exception:
+        release_rows([row], [capped])
+        raise
+
+
+def _ingest_spooled(rows: Sequence[dict[str, Any]], capped: Sequence[bool]) -> None:
+    """Append các event vào spool local (1 lần write + fsync cho cả nhóm); trả về khi đã bền trên disk."""
+    from app.services.ingest_spool import SpoolFullError, SpoolStoppedError, encode_record, get_spool_writer
+
+    writer = get_spool_writer()
+    if writer is None:
+        release_rows(rows, capped)
+        raise HTTPException(status_code=503, detail="ingest spool is not running")
+    try:
+        writer.append([encode_record(r, capped=c) for r, c in zip(rows, capped)])
+    except SpoolFullError:
+        release_rows(rows, capped)
+        raise HTTPException(status_code=429, detail="ingest spool is full, retry later")
+    except SpoolStoppedError:
+        release_rows(rows, capped)
+        raise HTTPException(status_code=503, detail="ingest spool is shutting down")
+    except OSError as e:
+        release_rows(rows, capped)
+        raise HTTPException(status_code=503, detail=f"ingest spool write failed: {e.strerror or e}")
+
+
+def ingest_events_batch(db: Session, events: Sequence[InteractionEventIn]) -> list[IngestResultRow]:
+    """
+    Ghi 1 batch events trong 1 transaction (thay vì 1 commit / event).
+
+    - Validate toàn bộ batch trong 1 lượt; event lỗi → status "rejected" kèm error,
+      không làm hỏng các event hợp lệ còn lại.
+    - View bị dedup/sampling → status "filtered" (không ghi).
+    - Event đã vượt cap scoring trong ngày → status "capped" (chỉ cộng rollup ngày).
+    - Event hợp lệ được ghi bằng multi-row INSERT, commit 1 lần cho cả batch
+      (INGEST_MODE="spool": append 1 lần vào spool local → status "spooled").
+    - Trả về kết quả theo đúng thứ tự input.
+    """
+    results: list[Optional[IngestResultRow]] = [None] * len(events)
+    valid_rows: list[dict[str, Any]] = []
+    valid_idx: list[int] = []
+    view_filter = get_view_filter()
+
+    for i, evt in enumerate(events):
+        try:
+            row = normalize_event(
+                actor_user_id=evt.actor_user_id,
+                target_user_id=evt.target_user_id,
+                event_type=evt.event_type,
+                timestamp=evt.timestamp,
+                value=evt.value,
+                content_id=evt.content_id,
+                session_id=evt.session_id,
+                metadata=evt.metadata,
+            )
+        except ValueError as e:
+            results[i] = IngestResultRow(index=i, status="rejected", error=str(e))
+            continue
+        if view_filter.should_drop(row):
+            results[i] = IngestResultRow(index=i, status="filtered")
+            continue
+        valid_rows.append(row)
+        valid_idx.append(i)
+
+    if valid_rows and settings.INGEST_MODE == "spool":
+        _ingest_spooled(valid_rows, admit_rows(valid_rows))
+        for i in valid_idx:
+            results[i] = IngestResultRow(index=i, status="spooled")
+    elif valid_rows:
+        capped = admit_rows(valid_rows)
+        try:
+            ids = write_event_rows(db, valid_rows, capped)
+            db.commit()
+        except Exception:
+            db.rollback()
+            release_rows(valid_rows, capped)
+            raise
+        for i, inserted_id in zip(valid_idx, ids):
+            if inserted_id is None:
+                results[i] = IngestResultRow(index=i, status="capped")
+            else:
+                results[i] = IngestResultRow(index=i, status="inserted", inserted_id=inserted_id)
+
+    return [r for r in results if r is not None]
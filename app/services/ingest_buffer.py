@@ -0,0 +1,171 @@
+"""Buffered ingest: gom nhiều event vào 1 transaction (group commit)."""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from app.services.ingest import write_event_rows
+
+
+class IngestBufferFullError(Exception):
+    """Buffer đã đầy – caller nên trả 429 để BE retry/backoff."""
+
+
+class IngestWriterStoppedError(Exception):
+    """Writer đã dừng (đang shutdown) – không nhận thêm event."""
+
+
+@dataclass
+class _PendingEvent:
+    row: dict[str, Any]
+    capped: bool = False
+    future: Future = field(default_factory=Future)
+
+
+class GroupCommitWriter:
+    """
+    Background writer cho ingest: request chỉ đẩy event vào queue, 1 thread riêng
+    gom event và ghi bằng multi-row insert + 1 commit cho cả nhóm.
+
+    - Flush khi đủ `max_batch` events hoặc event đầu tiên trong nhóm đã chờ `flush_interval_ms`.
+    - Queue bị chặn ở `max_pending` events → submit() raise IngestBufferFullError (backpressure).
+    - Future của mỗi event chỉ resolve (trả id) sau khi nhóm chứa nó đã commit.
+    - stop() ghi nốt các event còn trong queue rồi mới dừng.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        *,
+        max_batch: int = 500,
+        flush_interval_ms: int = 10,
+        max_pending: int = 10000,
+    ) -> None:
+        self._session_factory = session_factory
+        self._max_batch = max(1, max_batch)
+        self._flush_interval = max(0, flush_interval_ms) / 1000.0
+        self._queue: queue.Queue[_PendingEvent] = queue.Queue(maxsize=max(1, max_pending))
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ingest-group-commit", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def submit(self, row: dict[str, Any], *, capped: bool = False) -> Future:
+        """
+        Đẩy 1 event (đã normalize) vào buffer, trả về Future[Optional[int]]
+        (id sau khi commit; None nếu `capped` – event chỉ được cộng vào rollup ngày).
+        """
+        if self._stopping.is_set():
+            raise IngestWriterStoppedError("ingest writer is stopped")
+        pending = _PendingEvent(row=row, capped=capped)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            raise IngestBufferFullError("ingest buffer is full")
+        return pending.future
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Ngừng nhận event mới, flush phần còn lại trong queue rồi dừng thread."""
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        # Event lọt vào queue sau khi thread đã thoát: báo lỗi thay vì để caller chờ mãi
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.future.set_exception(IngestWriterStoppedError("ingest writer is stopped"))
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: list[_PendingEvent]) -> None:
+        db = self._session_factory()
+        try:
+            try:
+                ids = write_event_rows(db, [p.row for p in batch], [p.capped for p in batch])
+                db.commit()
+            except Exception:
+                db.rollback()
+                # Nhóm lỗi: ghi lại từng event để chỉ event hỏng bị fail, không kéo theo cả nhóm
+                self._flush_one_by_one(db, batch)
+                return
+            for p, inserted_id in zip(batch, ids):
+                p.future.set_result(inserted_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _flush_one_by_one(db: Session, batch: list[_PendingEvent]) -> None:
+        for p in batch:
+            try:
+                (inserted_id,) = write_event_rows(db, [p.row], [p.capped])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                p.future.set_exception(e)
+                continue
+            p.future.set_result(inserted_id)
+
+
+_writer: Optional[GroupCommitWriter] = None
+
+
+def get_ingest_writer() -> Optional[GroupCommitWriter]:
+    return _writer
+
+
+def start_ingest_writer() -> GroupCommitWriter:
+    """Khởi động writer dùng chung cho process (gọi ở startup của app)."""
+    global _writer
+    if _writer is None:
+        from app.utils.config import settings
+        from app.utils.database import SessionLocal
+
+        _writer = GroupCommitWriter(
+            SessionLocal,
+            max_batch=settings.INGEST_FLUSH_MAX_EVENTS,
+            flush_interval_ms=settings.INGEST_FLUSH_INTERVAL_MS,
+            max_pending=settings.INGEST_BUFFER_MAX_EVENTS,
+        )
+        _writer.start()
+    return _writer
+
+
+def stop_ingest_writer(timeout: Optional[float] = 30.0) -> None:
+    """Flush buffer và dừng writer (gọi ở shutdown của app)."""
+    global _writer
+    if _writer is not None:
+        _writer.stop(timeout=timeout)
+        _writer = None
@@ -0,0 +1,446 @@
+"""Spool ingest: ghi event vào segment file local (append-only, fsync) rồi drain vào Postgres bằng COPY."""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.models import IngestSpoolOffset
+from app.services.bulk_ingest import copy_event_rows
+from app.services.daily_agg import DailyRollup, upsert_daily_rows
+from app.services.time_utils import utcnow
+
+try:  # flock chỉ có trên POSIX; Windows (dev) → coi như 1 process duy nhất
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+SEGMENT_SUFFIX = ".seg"
+# Thư mục con chứa các dòng COPY từ chối (FK, sai kiểu...), cùng tên segment gốc
+DEAD_LETTER_DIR = "dead"
+# Counter bytes của writer được đối chiếu lại với đĩa (segment đã drain bị xoá, worker khác ghi) tối đa 1 lần / N giây
+_SPOOL_BYTES_RESCAN_S = 1.0
+
+
+class SpoolFullError(Exception):
+    """Spool vượt INGEST_SPOOL_MAX_BYTES – caller nên trả 429."""
+
+
+class SpoolStoppedError(Exception):
+    """Spool đã dừng (đang shutdown) – không nhận thêm event."""
+
+
+def _try_lock(f, *, shared: bool = False) -> bool:
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def encode_record(row: dict[str, Any], *, capped: bool = False) -> bytes:
+    """1 record = 1 dòng `<crc32 hex> <json>\\n` (crc phát hiện dòng ghi dở khi crash)."""
+    payload = json.dumps(
+        {**row, "occurred_at": row["occurred_at"].isoformat(), "created_at": row["created_at"].isoformat(), "_capped": capped},
+        separators=(",", ":"),
+    ).encode()
+    return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+
+def decode_record(line: bytes) -> Optional[tuple[dict[str, Any], bool]]:
+    """Ngược lại của encode_record → (row, capped); None nếu dòng hỏng."""
+    if len(line) < 10 or line[8:9] != b" ":
+        return None
+    payload = line[9:].rstrip(b"\n")
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        row = json.loads(payload)
+    except ValueError:
+        return None
+    capped = bool(row.pop("_capped", False))
+    row["occurred_at"] = datetime.fromisoformat(row["occurred_at"])
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return row, capped
+
+
+def _is_data_error(e: Exception) -> bool:
+    """Lỗi do chính dữ liệu (FK, CHECK, sai kiểu...) → thử lại vô ích; lỗi kết nối / DB down thì không phải."""
+    import psycopg
+
+    orig = getattr(e, "orig", e)
+    return isinstance(orig, (psycopg.IntegrityError, psycopg.DataError))
+
+
+class SpoolWriter:
+    """
+    Append-only segment writer cho ingest.
+
+    - append() ghi + flush (+ fsync nếu bật) trước khi trả về → event đã ack thì sống sót qua crash.
+    - Segment được rotate khi vượt `segment_bytes`; tên segment chứa timestamp + pid nên nhiều
+      worker dùng chung 1 thư mục không đụng nhau. Writer giữ flock shared trên segment đang ghi
+      để drainer biết segment nào còn đang active (segment chỉ xuất hiện dưới tên *.seg khi đã có lock).
+    - Giới hạn `max_bytes` dùng counter chạy (cộng mỗi lần append), đối chiếu lại với đĩa mỗi
+      _SPOOL_BYTES_RESCAN_S giây thay vì stat mọi segment ở mỗi append.
+    - Sau restart luôn mở segment mới (không append tiếp vào segment cũ có thể có dòng ghi dở).
+    """
+
+    def __init__(self, spool_dir: str | Path, *, segment_bytes: int, max_bytes: int, fsync: bool = True) -> None:
+        self._dir = Path(spool_dir)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._segment_bytes = max(1, segment_bytes)
+        self._max_bytes = max_bytes
+        self._fsync = fsync
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._file = None
+        self._size = 0
+        self._stopped = False
+        self._bytes = self.spool_bytes()
+        self._bytes_scanned_at = time.monotonic()
+
+    def _open_segment(self) -> None:
+        """
+        Tạo segment dưới tên tạm, lấy flock shared rồi mới rename sang *.seg: drainer không bao giờ thấy
+        segment chưa có lock (nếu thấy, nó có thể xoá file rỗng ngay trước khi writer ghi event đã ack vào).
+        """
+        self._seq += 1
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self._seq:06d}{SEGMENT_SUFFIX}"
+        tmp = self._dir / f"{name}.tmp"
+        f = open(tmp, "ab")
+        if not _try_lock(f, shared=True):
+            f.close()
+            tmp.unlink(missing_ok=True)
+            raise OSError(f"cannot lock spool segment {name}")
+        os.rename(tmp, self._dir / name)
+        if self._file is not None:
+            self._file.close()  # đóng file → nhả flock → drainer được phép xoá khi đã drain hết
+        self._file = f
+        self._size = 0
+
+    def spool_bytes(self) -> int:
+        """Tổng kích thước các segment trên đĩa (mọi worker dùng chung thư mục)."""
+        total = 0
+        for p in self._dir.glob(f"*{SEGMENT_SUFFIX}"):
+            try:
+                total += p.stat().st_size
+            except FileNotFoundError:
+                pass  # drainer vừa xoá
+        return total
+
+    def append(self, records: list[bytes]) -> None:
+        data = b"".join(records)
+        with self._lock:
+            if self._stopped:
+                raise SpoolStoppedError("ingest spool is stopped")
+            if self._max_bytes > 0:
+                now = time.monotonic()
+                if now - self._bytes_scanned_at >= _SPOOL_BYTES_RESCAN_S:
+                    self._bytes, self._bytes_scanned_at = self.spool_bytes(), now
+                if self._bytes + len(data) > self._max_bytes:
+                    raise SpoolFullError("ingest spool is full")
+            if self._file is None or self._size >= self._segment_bytes:
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+            self._size += len(data)
+            self._bytes += len(data)
+
+    def close(self) -> None:
+        with self._lock:
+            self._stopped = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+@dataclass
+class DrainStats:
+    rows: int = 0
+    bad_lines: int = 0
+    dead_lines: int = 0
+    segments_done: int = 0
+
+
+class SpoolDrainer:
+    """
+    Background thread replay segments vào Postgres.
+
+    - Mỗi lượt: đọc tối đa `max_rows` dòng hoàn chỉnh từ offset đã commit → COPY raw rows
+      + upsert rollup + cập nhật `ingest_spool_offsets` trong CÙNG 1 transaction
+      → crash ở bất kỳ đâu cũng không mất / không ghi trùng event.
+    - Segment không còn writer (flock được) và đã drain hết → xoá file rồi xoá offset.
+    - DB lỗi → giữ nguyên offset, backoff rồi thử lại (event vẫn nằm an toàn trên đĩa).
+    - COPY từ chối vì dữ liệu (FK, CHECK, sai kiểu) → ghi lại từng row trong savepoint, dòng bị từ chối
+      chuyển sang `dead/<segment>` (fsync trước khi commit offset) để không chặn các segment sau.
+    - Chỉ 1 drainer / thư mục (flock `drain.lock`), worker khác đứng chờ làm dự phòng.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str | Path,
+        session_factory: Callable[[], Session],
+        *,
+        spool_id: str,
+        max_rows: int = 50_000,
+        idle_interval_s: float = 0.2,
+    ) -> None:
+        self._dir = Path(spool_dir)
+        self._session_factory = session_factory
+        self._spool_id = spool_id
+        self._max_rows = max(1, max_rows)
+        self._idle = idle_interval_s
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ingest-spool-drainer", daemon=True)
+        self._dir_lock = None
+        self.stats = DrainStats()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        if self._dir_lock is not None:
+            self._dir_lock.close()
+            self._dir_lock = None
+
+    def _acquire_dir_lock(self) -> bool:
+        if self._dir_lock is None:
+            f = open(self._dir / "drain.lock", "ab")
+            if not _try_lock(f):
+                f.close()
+                return False
+            self._dir_lock = f
+        return True
+
+    def _run(self) -> None:
+        backoff = self._idle
+        while not self._stopping.is_set():
+            if not self._acquire_dir_lock():
+                self._stopping.wait(1.0)
+                continue
+            try:
+                drained = self.drain_once()
+                backoff = self._idle
+            except Exception as e:
+                print(f"⚠️ [Spool] Drain lỗi, thử lại sau {backoff:.1f}s: {e}")
+                drained = 0
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            if drained == 0:
+                self._stopping.wait(self._idle)
+        # Shutdown: cố drain nốt phần còn lại (lỗi → để trên đĩa cho lần start sau)
+        try:
+            if self._acquire_dir_lock():
+                while self.drain_once() > 0:
+                    pass
+        except Exception as e:
+            print(f"⚠️ [Spool] Drain lúc shutdown lỗi, dữ liệu còn trên đĩa: {e}")
+
+    def _segments(self) -> list[Path]:
+        return sorted(self._dir.glob(f"*{SEGMENT_SUFFIX}"))
+
+    @staticmethod
+    def _read_lines(path: Path, offset: int, max_rows: int) -> tuple[list[bytes], int, bool]:
+        """Đọc các dòng hoàn chỉnh từ offset → (lines, offset mới, đã tới EOF)."""
+        lines: list[bytes] = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while len(lines) < max_rows:
+                line = f.readline()
+                if not line:
+                    return lines, offset, True
+                if not line.endswith(b"\n"):
+                    return lines, offset, True  # dòng đang ghi dở (active) hoặc bị cắt (crash)
+                lines.append(line)
+                offset += len(line)
+        return lines, offset, False
+
+    def drain_once(self) -> int:
+        """1 lượt drain qua các segment; trả về số row đã ghi."""
+        total = 0
+        db = self._session_factory()
+        try:
+            for path in self._segments():
+                if self._stopping.is_set() and total:
+                    break
+                total += self._drain_segment(db, path)
+        finally:
+            db.close()
+        return total
+
+    def _drain_segment(self, db: Session, path: Path) -> int:
+        offset = db.execute(
+            select(IngestSpoolOffset.byte_offset).where(
+                IngestSpoolOffset.spool_id == self._spool_id,
+                IngestSpoolOffset.segment == path.name,
+            )
+        ).scalar() or 0
+
+        written = 0
+        while True:
+            lines, new_offset, eof = self._read_lines(path, offset, self._max_rows)
+            if lines:
+                records = []
+                for line in lines:
+                    decoded = decode_record(line)
+                    if decoded is None:
+                        self.stats.bad_lines += 1
+                        continue
+                    records.append((line, *decoded))
+                try:
+                    self._write_records(db, records)
+                    self._save_offset(db, path, new_offset)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    if not _is_data_error(e):
+                        raise
+                    print(f"⚠️ [Spool] COPY {path.name} bị từ chối, tách dòng lỗi sang {DEAD_LETTER_DIR}/: {e}")
+                    self._drain_isolating(db, path, records, new_offset)
+                written += len(lines)
+                self.stats.rows += len(lines)
+                offset = new_offset
+            if eof:
+                break
+
+        self._retire_if_sealed(db, path, offset)
+        return written
+
+    @staticmethod
+    def _write_records(db: Session, records: list[tuple[bytes, dict[str, Any], bool]]) -> None:
+        rollup = DailyRollup()
+        for _, row, _ in records:
+            rollup.add(row)
+        copy_event_rows(db, [row for _, row, capped in records if not capped])
+        upsert_daily_rows(db, rollup.rows())
+
+    def _save_offset(self, db: Session, path: Path, offset: int) -> None:
+        stmt = pg_insert(IngestSpoolOffset).values(
+            spool_id=self._spool_id, segment=path.name, byte_offset=offset, updated_at=utcnow()
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["spool_id", "segment"],
+            set_=dict(byte_offset=stmt.excluded.byte_offset, updated_at=stmt.excluded.updated_at),
+        )
+        db.execute(stmt)
+
+    def _drain_isolating(
+        self, db: Session, path: Path, records: list[tuple[bytes, dict[str, Any], bool]], offset: int
+    ) -> None:
+        """Ghi từng record trong savepoint riêng; record bị từ chối vì dữ liệu → dead letter, còn lại commit cùng offset."""
+        dead: list[bytes] = []
+        for record in records:
+            try:
+                with db.begin_nested():
+                    self._write_records(db, [record])
+            except Exception as e:
+                if not _is_data_error(e):
+                    raise
+                dead.append(record[0])
+        if dead:
+            # Bền trên đĩa trước khi commit offset (crash giữa 2 bước → lần replay ghi trùng vào dead letter, không mất)
+            dead_dir = self._dir / DEAD_LETTER_DIR
+            dead_dir.mkdir(exist_ok=True)
+            with open(dead_dir / path.name, "ab") as f:
+                f.write(b"".join(dead))
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats.dead_lines += len(dead)
+        self._save_offset(db, path, offset)
+        db.commit()
+
+    def _retire_if_sealed(self, db: Session, path: Path, offset: int) -> None:
+        """Segment không còn writer và đã drain hết → xoá file, sau đó mới xoá offset."""
+        with open(path, "rb") as f:
+            if not _try_lock(f):
+                return  # writer vẫn đang giữ segment
+            f.seek(offset)
+            tail = f.read()
+            if b"\n" in tail:
+                return  # writer ghi thêm trước khi đóng → lượt sau drain tiếp
+            if tail:
+                # Đuôi không có '\n' = record ghi dở lúc crash (chưa ack) → bỏ
+                self.stats.bad_lines += 1
+        # Xoá file trước: nếu crash ngay sau đây, offset row thừa vô hại;
+        # ngược lại (xoá offset trước) thì file sẽ bị replay lại từ 0.
+        path.unlink(missing_ok=True)
+        db.execute(
+            delete(IngestSpoolOffset).where(
+                IngestSpoolOffset.spool_id == self._spool_id,
+                IngestSpoolOffset.segment == path.name,
+            )
+        )
+        db.commit()
+        self.stats.segments_done += 1
+
+
+_writer: Optional[SpoolWriter] = None
+_drainer: Optional[SpoolDrainer] = None
+
+
+def get_spool_writer() -> Optional[SpoolWriter]:
+    return _writer
+
+
+def start_ingest_spool() -> SpoolWriter:
+    """Khởi động writer + drainer cho process (gọi ở startup khi INGEST_MODE="spool")."""
+    global _writer, _drainer
+    if _writer is None:
+        from app.utils.config import settings
+        from app.utils.database import SessionLocal
+
+        _writer = SpoolWriter(
+            settings.INGEST_SPOOL_DIR,
+            segment_bytes=settings.INGEST_SPOOL_SEGMENT_BYTES,
+            max_bytes=settings.INGEST_SPOOL_MAX_BYTES,
+            fsync=settings.INGEST_SPOOL_FSYNC,
+        )
+        _drainer = SpoolDrainer(
+            settings.INGEST_SPOOL_DIR,
+            SessionLocal,
+            spool_id=settings.INGEST_SPOOL_ID or socket.gethostname(),
+            max_rows=settings.INGEST_SPOOL_DRAIN_MAX_ROWS,
+        )
+        _drainer.start()
+    return _writer
+
+
+def stop_ingest_spool(timeout: Optional[float] = 30.0) -> None:
+    """Ngừng nhận event, đóng segment hiện tại, drain nốt rồi dừng drainer (gọi ở shutdown)."""
+    global _writer, _drainer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+    if _drainer is not None:
+        _drainer.stop(timeout=timeout)
+        _drainer = None
+
+
+def iter_spool_rows(spool_dir: str | Path) -> Iterator[tuple[str, dict[str, Any], bool]]:
+    """Đọc toàn bộ record còn trong spool (debug/kiểm tra) → (segment, row, capped)."""
+    for path in sorted(Path(spool_dir).glob(f"*{SEGMENT_SUFFIX}")):
+        with open(path, "rb") as f:
+            for line in f:
+                decoded = decode_record(line)
+                if decoded is not None:
+                    yield path.name, decoded[0], decoded[1]
@@ -0,0 +1,431 @@
+"""
+Đồ thị tương tác 2 phía (actor → targets, target → actors) dạng CSR trong bộ nhớ của process, để đếm số target
+chung (get_similar_users_shared_targets, neighbors của get_cf_posts / get_cf_reels) không cần query SQL.
+
+- Build từ user_interaction_daily trong window (CF_GRAPH_WINDOW_DAYS): cạnh (actor, target), trọng số = tổng
+  event_count trong window. 2 CSR trên cùng tập cạnh: actor → cột target (tăng dần), target → hàng actor (tăng dần).
+- Cập nhật dần: thread nền đọc lại trọng số của các cặp (actor, target) có event mới (last_occurred_at) kể từ
+  lần đọc trước – rollup được ingest ghi ngay nên mọi worker đều thấy – và ghi vào overlay. Overlay vượt
+  CF_GRAPH_COMPACT_EDGES cạnh → gộp vào CSR (không cần DB); build lại toàn bộ mỗi CF_GRAPH_REBUILD_INTERVAL_S
+  để bỏ dữ liệu rơi khỏi window.
+- Số target chung của user u = gom actor của từng target của u (gather trên CSR target → actors) rồi bincount:
+  vài chục µs thay vì 1 subquery COUNT(DISTINCT target) trên cả window.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.services.time_utils import utcnow
+from app.utils.config import settings
+
+_GRAPH_EDGES_SQL = """
+SELECT actor_user_id, target_user_id, SUM(event_count)
+FROM user_interaction_daily
+WHERE day >= %(cutoff)s
+GROUP BY actor_user_id, target_user_id
+"""
+
+_GRAPH_DELTA_SQL = """
+WITH touched AS (
+    SELECT DISTINCT actor_user_id, target_user_id
+    FROM user_interaction_daily
+    WHERE day >= %(since_day)s AND last_occurred_at >= %(since)s
+)
+SELECT d.actor_user_id, d.target_user_id, SUM(d.event_count)
+FROM user_interaction_daily d
+JOIN touched t ON t.actor_user_id = d.actor_user_id AND t.target_user_id = d.target_user_id
+WHERE d.day >= %(cutoff)s
+GROUP BY d.actor_user_id, d.target_user_id
+"""
+
+# Mỗi lần đọc delta lùi lại 1 khoảng so với lần trước (event có thể commit sau occurred_at của nó);
+# đọc trùng vô hại vì delta là trọng số tuyệt đối trong window
+_DELTA_OVERLAP = timedelta(seconds=60)
+
+_ARRAY_FIELDS = ("actor_ids", "a_indptr", "a_cols", "a_weights", "target_ids", "t_indptr", "t_rows", "t_weights")
+
+
+@dataclass(frozen=True)
+class GraphCSR:
+    """
+    Đồ thị tại 1 thời điểm (không đổi sau khi build):
+    - actor_ids (n,) / target_ids (m,) int64 tăng dần
+    - a_indptr (n+1,), a_cols (nnz,) int32 = cột target của từng actor (tăng dần), a_weights (nnz,) float32
+    - t_indptr (m+1,), t_rows (nnz,) int32 = hàng actor của từng target (tăng dần), t_weights (nnz,) float32
+    """
+
+    actor_ids: np.ndarray
+    a_indptr: np.ndarray
+    a_cols: np.ndarray
+    a_weights: np.ndarray
+    target_ids: np.ndarray
+    t_indptr: np.ndarray
+    t_rows: np.ndarray
+    t_weights: np.ndarray
+
+    @property
+    def edges(self) -> int:
+        return len(self.a_cols)
+
+    @property
+    def nbytes(self) -> Dict[str, int]:
+        return {name: int(getattr(self, name).nbytes) for name in _ARRAY_FIELDS}
+
+    def row_of(self, actor_id: int) -> Optional[int]:
+        return _index_of(self.actor_ids, actor_id)
+
+    def col_of(self, target_id: int) -> Optional[int]:
+        return _index_of(self.target_ids, target_id)
+
+    def has_edge(self, actor_id: int, target_id: int) -> bool:
+        row, col = self.row_of(actor_id), self.col_of(target_id)
+        if row is None or col is None:
+            return False
+        cols = self.a_cols[self.a_indptr[row] : self.a_indptr[row + 1]]
+        at = int(np.searchsorted(cols, col))
+        return at < len(cols) and int(cols[at]) == col
+
+    def edge_list(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(actor_ids, target_ids, weights) của mọi cạnh, theo thứ tự actor → target."""
+        actors = np.repeat(self.actor_ids, np.diff(self.a_indptr))
+        return actors, self.target_ids[self.a_cols], self.a_weights
+
+
+def _index_of(sorted_ids: np.ndarray, value: int) -> Optional[int]:
+    at = int(np.searchsorted(sorted_ids, value))
+    if at < len(sorted_ids) and int(sorted_ids[at]) == value:
+        return at
+    return None
+
+
+def _indptr(groups: np.ndarray, n: int) -> np.ndarray:
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(groups, minlength=n), out=indptr[1:])
+    return indptr
+
+
+def build_graph_csr(actors: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> GraphCSR:
+    """GraphCSR từ danh sách cạnh (mỗi cặp (actor, target) xuất hiện 1 lần)."""
+    actor_ids, rows = np.unique(np.asarray(actors, dtype=np.int64), return_inverse=True)
+    target_ids, cols = np.unique(np.asarray(targets, dtype=np.int64), return_inverse=True)
+    rows, cols = rows.astype(np.int32), cols.astype(np.int32)
+    weights = np.asarray(weights, dtype=np.float32)
+
+    by_actor = np.lexsort((cols, rows))
+    by_target = np.lexsort((rows, cols))
+    return GraphCSR(
+        actor_ids=actor_ids,
+        a_indptr=_indptr(rows, len(actor_ids)),
+        a_cols=cols[by_actor],
+        a_weights=weights[by_actor],
+        target_ids=target_ids,
+        t_indptr=_indptr(cols, len(target_ids)),
+        t_rows=rows[by_target],
+        t_weights=weights[by_target],
+    )
+
+
+def _fetch_edges(db: Session, sql: str, params: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    raw_conn = db.connection().connection.driver_connection
+    with raw_conn.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), np.empty(0, dtype=np.float32)
+    data = np.array(rows, dtype=np.int64)
+    return data[:, 0].copy(), data[:, 1].copy(), data[:, 2].astype(np.float32)
+
+
+def load_graph(db: Session, *, window_days: int) -> GraphCSR:
+    """Build GraphCSR từ rollup ngày trong window (cùng mốc cutoff.date() với get_similar_users_shared_targets)."""
+    cutoff = (utcnow() - timedelta(days=window_days)).date()
+    return build_graph_csr(*_fetch_edges(db, _GRAPH_EDGES_SQL, {"cutoff": cutoff}))
+
+
+def _gather(indptr: np.ndarray, values: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """Nối các đoạn values[indptr[i]:indptr[i+1]] với i thuộc idx."""
+    starts = indptr[idx]
+    lengths = indptr[idx + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return values[offsets + np.arange(int(lengths.sum()))]
+
+
+class InteractionGraph:
+    """
+    Đồ thị tương tác của 1 process: GraphCSR (đổi nguyên khối khi build lại / compact) + overlay các cạnh
+    đổi sau lần build. Chỉ thread refresh ghi; query đọc dưới lock (overlay nhỏ, giới hạn bởi compact_edges).
+    """
+
+    def __init__(
+        self,
+        *,
+        window_days: Optional[int] = None,
+        delta_interval_s: Optional[float] = None,
+        rebuild_interval_s: Optional[float] = None,
+        compact_edges: Optional[int] = None,
+    ) -> None:
+        self._window_days = window_days
+        self._delta_interval_s = delta_interval_s
+        self._rebuild_interval_s = rebuild_interval_s
+        self._compact_edges = compact_edges
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._csr: Optional[GraphCSR] = None
+        self._built_window: Optional[int] = None
+        self._built_at: Optional[datetime] = None
+        self._built_mono = float("-inf")
+        self._since: Optional[datetime] = None
+        # Overlay: actor → {target: trọng số mới} của mọi cạnh đổi sau lần build; cạnh chưa có trong CSR
+        # còn được index 2 chiều (_new_by_actor / _new_by_target) cho shared_targets
+        self._delta: Dict[int, Dict[int, float]] = {}
+        self._delta_edges = 0
+        self._new_by_actor: Dict[int, Set[int]] = {}
+        self._new_by_target: Dict[int, Set[int]] = {}
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.rebuilds = 0
+        self.deltas = 0
+        self.compactions = 0
+        self.failed_refreshes = 0
+        self.queries = 0
+        self.build_ms = 0.0
+        self.delta_ms = 0.0
+        self.compact_ms = 0.0
+
+    @property
+    def window_days(self) -> int:
+        return int(self._window_days or settings.CF_GRAPH_WINDOW_DAYS)
+
+    @property
+    def ready_window(self) -> Optional[int]:
+        """Window của đồ thị đang phục vụ (None nếu chưa build xong lần đầu)."""
+        return self._built_window if self._csr is not None else None
+
+    # ---- cập nhật ----
+
+    def rebuild(self, db: Session) -> None:
+        """Build lại toàn bộ từ DB rồi đổi nguyên khối (overlay bị bỏ – CSR mới đã gồm các cạnh đó)."""
+        window_days = self.window_days
+        started_at = utcnow()
+        t0 = time.perf_counter()
+        csr = load_graph(db, window_days=window_days)
+        with self._lock:
+            self._csr = csr
+            self._built_window = window_days
+            self._built_at = started_at
+            self._built_mono = time.monotonic()
+            self._since = started_at
+            self._clear_overlay()
+        self.build_ms = (time.perf_counter() - t0) * 1000.0
+        self.rebuilds += 1
+
+    def apply_delta(self, db: Session) -> int:
+        """Đọc trọng số mới của các cạnh có event từ lần đọc trước → overlay (compact nếu quá lớn). Trả về số cạnh."""
+        if self._csr is None or self._since is None:
+            return 0
+        started_at = utcnow()
+        since = self._since - _DELTA_OVERLAP
+        cutoff = (started_at - timedelta(days=self._built_window or self.window_days)).date()
+        t0 = time.perf_counter()
+        actors, targets, weights = _fetch_edges(
+            db, _GRAPH_DELTA_SQL, {"since": since, "since_day": since.date(), "cutoff": cutoff}
+        )
+        csr = self._csr
+        edges = list(zip(actors.tolist(), targets.tolist(), weights.tolist()))
+        new_edges = [(a, t) for a, t, _ in edges if not csr.has_edge(a, t)]
+        with self._lock:
+            for a, t, w in edges:
+                row = self._delta.setdefault(a, {})
+                self._delta_edges += t not in row
+                row[t] = w
+            for a, t in new_edges:
+                self._new_by_actor.setdefault(a, set()).add(t)
+                self._new_by_target.setdefault(t, set()).add(a)
+            self._since = started_at
+        self.delta_ms = (time.perf_counter() - t0) * 1000.0
+        self.deltas += 1
+
+        compact_edges = self._compact_edges
+        if compact_edges is None:
+            compact_edges = settings.CF_GRAPH_COMPACT_EDGES
+        if self._delta_edges > compact_edges:
+            self.compact()
+        return len(actors)
+
+    def compact(self) -> None:
+        """
+        Gộp overlay vào CSR mới (trọng số overlay thắng), không đọc DB. Chỉ thread refresh gọi (cùng thread
+        với apply_delta) nên overlay không đổi trong lúc gộp.
+        """
+        csr = self._csr
+        if csr is None or not self._delta:
+            return
+        t0 = time.perf_counter()
+        base_a, base_t, base_w = csr.edge_list()
+        delta_a = [a for a, row in self._delta.items() for _ in row]
+        delta_t = [t for row in self._delta.values() for t in row]
+        delta_w = [w for row in self._delta.values() for w in row.values()]
+        actors = np.concatenate([np.array(delta_a, dtype=np.int64), base_a])
+        targets = np.concatenate([np.array(delta_t, dtype=np.int64), base_t])
+        weights = np.concatenate([np.array(delta_w, dtype=np.float32), base_w])
+        # id là int32 → (actor << 32) | target là khoá duy nhất; np.unique giữ lần xuất hiện đầu (= overlay)
+        _, first = np.unique((actors << 32) | targets, return_index=True)
+        merged = build_graph_csr(actors[first], targets[first], weights[first])
+        with self._lock:
+            self._csr = merged
+            self._clear_overlay()
+        self.compact_ms = (time.perf_counter() - t0) * 1000.0
+        self.compactions += 1
+
+    def _clear_overlay(self) -> None:
+        self._delta.clear()
+        self._delta_edges = 0
+        self._new_by_actor.clear()
+        self._new_by_target.clear()
+
+    def refresh(self, *, force_rebuild: bool = False) -> None:
+        """1 chu kỳ của thread refresh: build lại nếu tới hạn (hoặc chưa có / đổi window), ngược lại đọc delta."""
+        from app.utils.database import SessionLocal
+
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        db = SessionLocal()
+        try:
+            rebuild_interval = self._rebuild_interval_s
+            if rebuild_interval is None:
+                rebuild_interval = settings.CF_GRAPH_REBUILD_INTERVAL_S
+            due = time.monotonic() - self._built_mono >= rebuild_interval
+            if force_rebuild or due or self._csr is None or self._built_window != self.window_days:
+                self.rebuild(db)
+            else:
+                self.apply_delta(db)
+        except Exception as e:
+            self.failed_refreshes += 1
+            print(f"⚠️ [Interaction Graph] Refresh lỗi: {e}")
+        finally:
+            db.close()
+            self._refresh_lock.release()
+
+    def start(self) -> None:
+        """Thread nền: build lần đầu ngay, sau đó refresh mỗi CF_GRAPH_DELTA_INTERVAL_S giây."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="interaction-graph", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            self.refresh()
+            interval = self._delta_interval_s
+            if interval is None:
+                interval = settings.CF_GRAPH_DELTA_INTERVAL_S
+            if self._stopping.wait(timeout=interval):
+                return
+
+    # ---- truy vấn ----
+
+    def shared_targets(self, user_id: int, *, k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top-k actor khác theo số target chung với user_id → (neighbor_ids int64, shared_targets int64),
+        giảm dần (hoà → user_id tăng dần). None nếu đồ thị chưa sẵn sàng hoặc user_id không có cạnh nào.
+        """
+        with self._lock:
+            csr = self._csr
+            if csr is None:
+                return None
+            self.queries += 1
+            row = csr.row_of(user_id)
+            new_targets = self._new_by_actor.get(user_id, set())
+            if row is None and not new_targets:
+                return None
+
+            own_cols = csr.a_cols[csr.a_indptr[row] : csr.a_indptr[row + 1]] if row is not None else csr.a_cols[:0]
+            own_targets = set(csr.target_ids[own_cols].tolist()) | new_targets
+            extra_cols = [c for c in (csr.col_of(t) for t in new_targets) if c is not None]
+            cols = np.concatenate([own_cols, np.array(extra_cols, dtype=own_cols.dtype)]) if extra_cols else own_cols
+            counts = np.bincount(_gather(csr.t_indptr, csr.t_rows, cols.astype(np.int64)), minlength=len(csr.actor_ids))
+
+            extra: Dict[int, int] = {}
+            for t in own_targets:
+                for a in self._new_by_target.get(t, ()):
+                    extra[a] = extra.get(a, 0) + 1
+
+        rows = np.flatnonzero(counts)
+        ids, shared = csr.actor_ids[rows], counts[rows].astype(np.int64)
+        if extra:
+            extra_ids = np.fromiter(extra.keys(), dtype=np.int64, count=len(extra))
+            extra_counts = np.fromiter(extra.values(), dtype=np.int64, count=len(extra))
+            ids, inverse = np.unique(np.concatenate([ids, extra_ids]), return_inverse=True)
+            shared = np.bincount(inverse, weights=np.concatenate([shared, extra_counts]), minlength=len(ids)).astype(np.int64)
+        keep = ids != user_id
+        ids, shared = ids[keep], shared[keep]
+        order = np.lexsort((ids, -shared))[:k]
+        return ids[order], shared[order]
+
+    def targets_of(self, user_id: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(target_ids, trọng số = số event trong window) của user_id, gồm cả overlay; None nếu chưa sẵn sàng."""
+        with self._lock:
+            csr = self._csr
+            if csr is None:
+                return None
+            row = csr.row_of(user_id)
+            weights: Dict[int, float] = {}
+            if row is not None:
+                lo, hi = csr.a_indptr[row], csr.a_indptr[row + 1]
+                weights = dict(zip(csr.target_ids[csr.a_cols[lo:hi]].tolist(), csr.a_weights[lo:hi].tolist()))
+            weights.update(self._delta.get(user_id, {}))
+        targets = np.array(sorted(weights), dtype=np.int64)
+        return targets, np.array([weights[t] for t in targets.tolist()], dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        """Kích thước, bộ nhớ (bytes của từng mảng CSR) và thời gian build / delta / compact gần nhất."""
+        with self._lock:
+            csr = self._csr
+            nbytes = csr.nbytes if csr is not None else {}
+            return {
+                "ready": csr is not None,
+                "window_days": self._built_window,
+                "built_at": self._built_at.isoformat() if self._built_at is not None else None,
+                "actors": len(csr.actor_ids) if csr is not None else 0,
+                "targets": len(csr.target_ids) if csr is not None else 0,
+                "edges": csr.edges if csr is not None else 0,
+                "overlay_edges": self._delta_edges,
+                "overlay_new_edges": sum(len(v) for v in self._new_by_actor.values()),
+                "memory_bytes": sum(nbytes.values()),
+                "array_bytes": nbytes,
+                "build_ms": round(self.build_ms, 3),
+                "delta_ms": round(self.delta_ms, 3),
+                "compact_ms": round(self.compact_ms, 3),
+                "rebuilds": self.rebuilds,
+                "deltas": self.deltas,
+                "compactions": self.compactions,
+                "failed_refreshes": self.failed_refreshes,
+                "queries": self.queries,
+            }
+
+
+# Đồ thị dùng chung của process (thread refresh chạy khi CF_GRAPH_ENABLED, xem app/utils/main.py)
+interaction_graph = InteractionGraph()
+
+
+def graph_shared_targets(user_id: int, *, k: int, window_days: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Neighbors theo số target chung từ đồ thị trong bộ nhớ; None → caller query SQL (tắt / khác window / user mới)."""
+    if not settings.CF_GRAPH_ENABLED or interaction_graph.ready_window != window_days:
+        return None
+    return interaction_graph.shared_targets(user_id, k=k)
@@ -1,13 +1,15 @@
 from __future__ import annotations
 
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Sequence, Tuple
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity
 
-from app.services.preprocess import PairScore
+from app.services.preprocess import PairScore, PairScoreBatch, cap_outliers_iqr
 
 
 @dataclass(frozen=True)
@@ -27,29 +29,63 @@ class UserNeighbor:
     score: float
 
 
-def prune_topk_per_actor(pairs: Iterable[PairScore], k: int) -> List[PairScore]:
-    """
-    Edge pruning: với mỗi actor chỉ giữ top-k target có score cao nhất.
-    """
-    from collections import defaultdict
+@dataclass(frozen=True)
+class NeighborBatch:
+    """Kết quả top-k neighbors dạng mảng (user_id / neighbor_id int64, score float32); iterate ra UserNeighbor."""
+
+    user_ids: np.ndarray
+    neighbor_ids: np.ndarray
+    scores: np.ndarray
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "user_ids", np.ascontiguousarray(self.user_ids, dtype=np.int64))
+        object.__setattr__(self, "neighbor_ids", np.ascontiguousarray(self.neighbor_ids, dtype=np.int64))
+        object.__setattr__(self, "scores", np.ascontiguousarray(self.scores, dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __iter__(self) -> Iterator[UserNeighbor]:
+        for u, nb, sc in zip(self.user_ids.tolist(), self.neighbor_ids.tolist(), self.scores.tolist()):
+            yield UserNeighbor(user_id=u, neighbor_id=nb, score=sc)
 
-    by_actor: Dict[int, List[PairScore]] = defaultdict(list)
-    for p in pairs:
-        if p.score <= 0:
-            continue
-        by_actor[p.actor_user_id].append(p)
+    @classmethod
+    def empty(cls) -> "NeighborBatch":
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
 
-    pruned: List[PairScore] = []
-    for actor, lst in by_actor.items():
-        # sort desc theo score và cắt top-k
-        lst_sorted = sorted(lst, key=lambda x: x.score, reverse=True)[:k]
-        pruned.extend(lst_sorted)
-    return pruned
 
+# Ước lượng bytes / phần tử của 1 block similarity (data float32 + index + workspace của phép nhân sparse)
+_SIM_BYTES_PER_ENTRY = 16
 
-def build_actor_target_index(pairs: Iterable[PairScore]) -> ActorTargetIndex:
-    actor_ids = sorted({p.actor_user_id for p in pairs})
-    target_ids = sorted({p.target_user_id for p in pairs})
+
+def prune_topk_per_actor(pairs: PairScoreBatch | Iterable[PairScore], k: int) -> PairScoreBatch:
+    """
+    Edge pruning: với mỗi actor chỉ giữ top-k target có score cao nhất (bỏ score <= 0).
+
+    Chọn bằng sort ổn định theo (actor, -score) → cùng score thì giữ cặp đứng trước trong input;
+    output giữ nguyên thứ tự của input (batch đã sắp theo (actor, target) vẫn sắp).
+    """
+    batch = PairScoreBatch.from_pairs(pairs)
+    positive = batch.scores > 0
+    if not positive.all():
+        batch = batch.take(np.flatnonzero(positive))
+    if len(batch) == 0:
+        return batch
+
+    order = np.lexsort((-batch.scores, batch.actors))
+    sorted_actors = batch.actors[order]
+    starts = np.flatnonzero(np.r_[True, sorted_actors[1:] != sorted_actors[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    keep = (np.arange(len(order)) - group_start) < k
+    if keep.all():
+        return batch  # không actor nào vượt k → giữ nguyên batch (không copy)
+    return batch.take(np.sort(order[keep]))
+
+
+def build_actor_target_index(pairs: PairScoreBatch | Iterable[PairScore]) -> ActorTargetIndex:
+    batch = PairScoreBatch.from_pairs(pairs)
+    actor_ids = np.unique(batch.actors).tolist()
+    target_ids = np.unique(batch.targets).tolist()
 
     actor_to_row = {uid: i for i, uid in enumerate(actor_ids)}
     target_to_col = {uid: j for j, uid in enumerate(target_ids)}
@@ -62,95 +98,398 @@ def build_actor_target_index(pairs: Iterable[PairScore]) -> ActorTargetIndex:
     )
 
 
+def _row_ids(M: csr_matrix) -> np.ndarray:
+    """Chỉ số hàng của từng phần tử trong M.data."""
+    return np.repeat(np.arange(M.shape[0], dtype=M.indices.dtype), np.diff(M.indptr))
+
+
+def _csr_keep(M: csr_matrix, keep: np.ndarray) -> csr_matrix:
+    """CSR con chỉ giữ các phần tử có keep = True (giữ thứ tự cột trong hàng)."""
+    indptr = np.zeros_like(M.indptr)
+    np.cumsum(np.bincount(_row_ids(M)[keep], minlength=M.shape[0]), out=indptr[1:])
+    out = csr_matrix((M.data[keep], M.indices[keep], indptr), shape=M.shape, copy=False)
+    out.has_sorted_indices = M.has_sorted_indices
+    return out
+
+
+def _drop_empty(
+    M: csr_matrix, actor_ids: np.ndarray, target_ids: np.ndarray
+) -> Tuple[csr_matrix, np.ndarray, np.ndarray]:
+    """Bỏ hàng không còn phần tử và cột không còn được dùng (đánh lại chỉ số cột)."""
+    row_keep = np.diff(M.indptr) > 0
+    col_used = np.zeros(M.shape[1], dtype=bool)
+    col_used[M.indices] = True
+    if row_keep.all() and col_used.all():
+        return M, actor_ids, target_ids
+    new_col = (np.cumsum(col_used) - 1).astype(M.indices.dtype)
+    indptr = np.zeros(int(row_keep.sum()) + 1, dtype=M.indptr.dtype)
+    np.cumsum(np.diff(M.indptr)[row_keep], out=indptr[1:])
+    out = csr_matrix(
+        (M.data, new_col[M.indices], indptr), shape=(len(indptr) - 1, int(col_used.sum())), copy=False
+    )
+    out.has_sorted_indices = M.has_sorted_indices
+    return out, actor_ids[row_keep], target_ids[col_used]
+
+
+def prune_topk_rows(M: csr_matrix, k: int) -> csr_matrix:
+    """
+    Edge pruning trên CSR: mỗi hàng chỉ giữ k phần tử lớn nhất (và > 0).
+
+    1 lần lexsort theo (hàng, -giá trị) trên toàn bộ data; cùng giá trị thì giữ cột nhỏ hơn
+    (M có sorted indices). Trả lại chính M (không copy) nếu không có gì để bỏ.
+    """
+    positive = M.data > 0
+    if M.nnz == 0 or (positive.all() and np.diff(M.indptr).max() <= k):
+        return M
+    rows = _row_ids(M)
+    order = np.lexsort((-M.data, rows))
+    starts = M.indptr[:-1][rows[order]]  # data đã nhóm theo hàng → vị trí đầu hàng trong order
+    keep = np.zeros(M.nnz, dtype=bool)
+    keep[order] = (np.arange(M.nnz) - starts) < k
+    return _csr_keep(M, keep & positive)
+
+
+def clip_outliers_iqr(M: csr_matrix, *, factor: float = 1.5) -> csr_matrix:
+    """Cap outliers: clip toàn bộ data của M vào [Q1 - factor*IQR, Q3 + factor*IQR] (cap_outliers_iqr)."""
+    if M.nnz == 0:
+        return M
+    lower, upper = cap_outliers_iqr(M.data, factor=factor)
+    return csr_matrix((np.clip(M.data, lower, upper).astype(M.dtype), M.indices, M.indptr), shape=M.shape)
+
+
+def normalize_rows_l2(M: csr_matrix) -> csr_matrix:
+    """L2 row-normalize (như normalize_by_actor_l2): norm tính bằng float64, hàng norm = 0 giữ nguyên."""
+    if M.nnz == 0:
+        return M
+    sq = M.data.astype(np.float64) ** 2
+    lengths = np.diff(M.indptr)
+    norms = np.zeros(M.shape[0], dtype=np.float64)
+    nonempty = lengths > 0
+    norms[nonempty] = np.sqrt(np.add.reduceat(sq, M.indptr[:-1][nonempty]))
+    inv = np.ones_like(norms)
+    np.divide(1.0, norms, out=inv, where=norms > 0)
+    data = (M.data * np.repeat(inv, lengths)).astype(M.dtype)
+    out = csr_matrix((data, M.indices, M.indptr), shape=M.shape, copy=False)
+    out.has_sorted_indices = M.has_sorted_indices
+    return out
+
+
+def preprocess_matrix(
+    M: csr_matrix,
+    *,
+    topk_per_actor: int = 0,
+    iqr_factor: Optional[float] = None,
+    l2_normalize: bool = False,
+) -> csr_matrix:
+    """Pipeline preprocess trên CSR: prune top-k / hàng → cap IQR → L2 normalize (bước nào tắt thì bỏ qua)."""
+    if topk_per_actor > 0:
+        M = prune_topk_rows(M, topk_per_actor)
+    if iqr_factor is not None:
+        M = clip_outliers_iqr(M, factor=iqr_factor)
+    if l2_normalize:
+        M = normalize_rows_l2(M)
+    return M
+
+
 def build_sparse_matrix(
-    pairs: Sequence[PairScore],
+    pairs: PairScoreBatch | Sequence[PairScore],
     *,
     topk_per_actor: int = 1000,
+    iqr_factor: Optional[float] = None,
+    l2_normalize: bool = False,
 ) -> Tuple[csr_matrix, ActorTargetIndex]:
     """
-    Bước 5: xây ma trận thưa M (actor x target) từ danh sách PairScore.
+    Bước 5: xây ma trận thưa M (actor x target) từ PairScoreBatch (hoặc danh sách PairScore).
 
-    - Áp dụng edge pruning (top-k per actor) để giảm kích thước.
+    - Dựng CSR trực tiếp (indptr / indices / data) không qua COO: batch đã sắp theo (actor, target)
+      thì mảng scores float32 được dùng làm `data` của ma trận không copy.
+    - Preprocess trên CSR (preprocess_matrix): edge pruning top-k / actor, tuỳ chọn cap outliers IQR
+      (iqr_factor) và L2 normalize theo actor (l2_normalize).
+    - Index gồm mọi actor / target của batch (kể cả hàng bị prune hết).
     - Trả về:
         - M: csr_matrix với shape = (num_actors, num_targets)
         - index: mapping giữa user_id <-> row/col index
     """
-    if not pairs:
+    batch = PairScoreBatch.from_pairs(pairs)
+    if len(batch) == 0:
         # empty matrix
         empty = csr_matrix((0, 0), dtype=np.float32)
         return empty, ActorTargetIndex({}, [], {}, [])
 
-    if topk_per_actor > 0:
-        pairs = prune_topk_per_actor(pairs, topk_per_actor)
-
-    index = build_actor_target_index(pairs)
-
-    rows: List[int] = []
-    cols: List[int] = []
-    data: List[float] = []
-
-    for p in pairs:
-        r = index.actor_to_row[p.actor_user_id]
-        c = index.target_to_col[p.target_user_id]
-        rows.append(r)
-        cols.append(c)
-        data.append(float(p.score))
+    batch = batch.sorted()
+    actor_ids = np.unique(batch.actors)
+    target_ids = np.unique(batch.targets)
+    rows = np.searchsorted(actor_ids, batch.actors)
+    cols = np.searchsorted(target_ids, batch.targets)
+    index_dtype = np.int32 if len(batch) < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(len(actor_ids) + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(rows, minlength=len(actor_ids)), out=indptr[1:])
 
     M = csr_matrix(
-        (np.array(data, dtype=np.float32), (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
-        shape=(len(index.row_to_actor), len(index.col_to_target)),
+        (batch.scores, cols.astype(index_dtype), indptr), shape=(len(actor_ids), len(target_ids)), copy=False
+    )
+    M.has_sorted_indices = True
+
+    if topk_per_actor > 0:
+        pruned = prune_topk_rows(M, topk_per_actor)
+        if pruned is not M:
+            # Bỏ hàng / cột rỗng sau prune → index chỉ gồm actor / target còn cạnh
+            M, actor_ids, target_ids = _drop_empty(pruned, actor_ids, target_ids)
+    M = preprocess_matrix(M, iqr_factor=iqr_factor, l2_normalize=l2_normalize)
+
+    row_to_actor = actor_ids.tolist()
+    col_to_target = target_ids.tolist()
+    index = ActorTargetIndex(
+        actor_to_row={uid: i for i, uid in enumerate(row_to_actor)},
+        row_to_actor=row_to_actor,
+        target_to_col={uid: j for j, uid in enumerate(col_to_target)},
+        col_to_target=col_to_target,
     )
     return M, index
 
 
-def topk_user_neighbors(
-    M: csr_matrix,
-    index: ActorTargetIndex,
+def _sim_row_blocks(
+    X: csr_matrix,
     *,
-    k: int = 100,
-) -> List[UserNeighbor]:
+    budget_bytes: int,
+    max_rows: Optional[int] = None,
+    against: Optional[csr_matrix] = None,
+) -> Iterator[Tuple[int, int]]:
     """
-    Bước 6: user-based CF với cosine similarity.
-
-    - Tính cosine similarity giữa các hàng của M.
-    - Với mỗi user (row), lấy top-k neighbors (loại bỏ self).
-    - Trả về list UserNeighbor(user_id, neighbor_id, score).
+    Chia hàng của X thành block [start, end) sao cho X[start:end] @ against.T (mặc định against = X)
+    ước lượng không vượt budget (và không quá max_rows hàng nếu có – để chia việc đều cho nhiều worker).
 
-    Lưu ý: hiện tại dùng cosine_similarity toàn cục, phù hợp cho scale vừa.
-    Khi dữ liệu rất lớn nên chuyển sang ANN / block-wise.
+    Số phần tử tối đa của hàng r trong tích = min(số hàng của against, tổng số hàng của against chứa
+    từng cột của r), mỗi phần tử ~_SIM_BYTES_PER_ENTRY bytes; block luôn có ít nhất 1 hàng.
     """
-    if M.shape[0] == 0:
-        return []
-
-    # sklearn sẽ tự normalize L2 theo hàng trước khi tính cosine nếu cần.
-    sim = cosine_similarity(M, dense_output=False)
+    if against is None:
+        against = X
+    n = X.shape[0]
+    col_counts = np.bincount(against.indices, minlength=X.shape[1]).astype(np.int64)
+    per_entry = col_counts[X.indices]
+    lengths = np.diff(X.indptr)
+    bound = np.zeros(n, dtype=np.int64)
+    nonempty = lengths > 0
+    bound[nonempty] = np.add.reduceat(per_entry, X.indptr[:-1][nonempty])
+    cum = np.cumsum(np.minimum(bound, against.shape[0]) * _SIM_BYTES_PER_ENTRY)
+
+    start = 0
+    while start < n:
+        base = cum[start - 1] if start > 0 else 0
+        end = int(np.searchsorted(cum, base + budget_bytes, side="right"))
+        end = max(end, start + 1)
+        if max_rows is not None:
+            end = min(end, start + max_rows)
+        yield start, end
+        start = end
+
+
+def _kth_largest_per_row(rows: np.ndarray, vals: np.ndarray, n_rows: int, k: int) -> np.ndarray:
+    """
+    Giá trị lớn thứ k của mỗi hàng (-inf nếu hàng có <= k phần tử). rows đã nhóm liên tục theo hàng.
+    Hàng dài được rải vào mảng dense (-inf) theo từng chunk rồi np.partition theo trục 1.
+    """
+    lengths = np.bincount(rows, minlength=n_rows)
+    kth = np.full(n_rows, -np.inf, dtype=vals.dtype)
+    long_rows = np.flatnonzero(lengths > k)
+    if long_rows.size == 0:
+        return kth
+    starts = np.zeros(n_rows, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    max_len = int(lengths[long_rows].max())
+    chunk = max(1, len(vals) // max_len)  # dense buffer không lớn hơn ~ số phần tử của block
+    pos = np.arange(len(vals)) - starts[rows]  # vị trí trong hàng
+    for i in range(0, long_rows.size, chunk):
+        part = long_rows[i : i + chunk]
+        lo, hi = starts[part[0]], starts[part[-1]] + lengths[part[-1]]  # các hàng của chunk nằm liền nhau
+        seg_rows = rows[lo:hi]
+        is_long = lengths[seg_rows] > k
+        dense = np.full((part.size, max_len), -np.inf, dtype=vals.dtype)
+        dense[np.searchsorted(part, seg_rows[is_long]), pos[lo:hi][is_long]] = vals[lo:hi][is_long]
+        kth[part] = np.partition(dense, max_len - k, axis=1)[:, max_len - k]
+    return kth
+
+
+def _topk_block(
+    S: csr_matrix, row_offset: int, k: int, row_ids: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Top-k mỗi hàng của 1 block similarity (bỏ self) → (row, col, score), sắp theo hàng, score giảm dần,
+    cùng score thì col nhỏ trước (không phụ thuộc cách chia block).
 
-    neighbors: List[UserNeighbor] = []
-    n_users = M.shape[0]
+    Hàng i của S là hàng row_offset + i của X, hoặc row_ids[i] nếu có (block gồm các hàng rời rạc);
+    row trả về là chỉ số của X. Lọc trước bằng ngưỡng = giá trị lớn thứ k của hàng (partition),
+    chỉ sort phần còn lại.
+    """
+    local = _row_ids(S)
+    global_rows = local + row_offset if row_ids is None else row_ids[local]
+    not_self = S.indices != global_rows
+    rows, cols, vals = local[not_self], S.indices[not_self], S.data[not_self]
+    if rows.size == 0:
+        return rows, cols, vals
+    candidate = vals >= _kth_largest_per_row(rows, vals, S.shape[0], k)[rows]
+    rows, cols, vals = rows[candidate], cols[candidate], vals[candidate]
+
+    order = np.lexsort((cols, -vals, rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    rank = np.arange(rows.size) - np.repeat(starts, np.diff(np.r_[starts, rows.size]))
+    keep = rank < k
+    rows = rows[keep]
+    return (rows + row_offset if row_ids is None else row_ids[rows]), cols[keep], vals[keep]
+
+
+# ---- Chế độ nhiều process: CSR đã normalize + output nằm trong shared memory ----
+
+_SHARED: dict = {}  # state của worker process (gắn 1 lần ở _attach_shared)
+
+
+def _to_shared(arr: np.ndarray, blocks: List[shared_memory.SharedMemory]) -> Tuple[str, Tuple[int, ...], str]:
+    """Copy arr vào 1 block shared memory mới (giữ ở `blocks` để close/unlink), trả về spec để worker gắn lại."""
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    blocks.append(shm)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm.name, arr.shape, arr.dtype.str
+
+
+def _from_shared(spec: Tuple[str, Tuple[int, ...], str], blocks: list) -> np.ndarray:
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    blocks.append(shm)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _attach_shared(specs: dict, shape: Tuple[int, int], k: int) -> None:
+    """Initializer của worker: dựng X / X.T (view, không copy) và mảng output từ shared memory."""
+    blocks: list = []
+    arrays = {key: _from_shared(spec, blocks) for key, spec in specs.items()}
+    n_rows, n_cols = shape
+    _SHARED.update(
+        blocks=blocks,
+        X=csr_matrix((arrays["x_data"], arrays["x_indices"], arrays["x_indptr"]), shape=shape, copy=False),
+        XT=csr_matrix(
+            (arrays["xt_data"], arrays["xt_indices"], arrays["xt_indptr"]), shape=(n_cols, n_rows), copy=False
+        ),
+        out_cols=arrays["out_cols"],
+        out_vals=arrays["out_vals"],
+        k=k,
+    )
 
-    for row in range(n_users):
-        row_vec = sim.getrow(row)
-        idx = row_vec.indices
-        vals = row_vec.data
 
-        # loại self
-        mask = idx != row
-        idx = idx[mask]
-        vals = vals[mask]
+def _shared_block_task(start: int, end: int) -> int:
+    """Tính top-k cho hàng [start, end) và ghi vào slot cố định row * k + rank của output chung."""
+    X, XT, k = _SHARED["X"], _SHARED["XT"], _SHARED["k"]
+    rows, cols, vals = _topk_block(X[start:end] @ XT, start, k)
+    if rows.size:
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        rank = np.arange(rows.size) - np.repeat(starts, np.diff(np.r_[starts, rows.size]))
+        slots = rows.astype(np.int64) * k + rank
+        _SHARED["out_cols"][slots] = cols
+        _SHARED["out_vals"][slots] = vals
+    return end - start
 
-        if idx.size == 0:
-            continue
 
-        # sort desc theo similarity và lấy top-k
-        order = np.argsort(-vals)
-        top = order[:k]
+def _topk_neighbors_parallel(
+    X: csr_matrix, *, k: int, budget_bytes: int, workers: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Bản nhiều process của vòng lặp block: data / indices / indptr của X và X.T đặt trong shared memory,
+    mỗi block hàng là 1 task của process pool, kết quả ghi vào mảng output chung (n x k, cột = -1 là trống).
+    Mỗi hàng chỉ phụ thuộc dữ liệu của chính nó → kết quả giống hệt bản 1 process với mọi số worker.
+    """
+    n = X.shape[0]
+    XT = X.T.tocsr()
+    blocks: List[shared_memory.SharedMemory] = []
+    try:
+        specs = {
+            "x_data": _to_shared(X.data, blocks),
+            "x_indices": _to_shared(X.indices, blocks),
+            "x_indptr": _to_shared(X.indptr, blocks),
+            "xt_data": _to_shared(XT.data, blocks),
+            "xt_indices": _to_shared(XT.indices, blocks),
+            "xt_indptr": _to_shared(XT.indptr, blocks),
+            "out_cols": _to_shared(np.full(n * k, -1, dtype=np.int64), blocks),
+            "out_vals": _to_shared(np.zeros(n * k, dtype=np.float32), blocks),
+        }
+        del XT
+        max_rows = max(1, -(-n // (4 * workers)))  # ~4 task / worker để cân tải
+        tasks = list(_sim_row_blocks(X, budget_bytes=budget_bytes, max_rows=max_rows))
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=ctx, initializer=_attach_shared, initargs=(specs, X.shape, k)
+        ) as pool:
+            for _ in pool.map(_shared_block_task, *zip(*tasks)):
+                pass
+
+        shm_by_key = dict(zip(specs, blocks))
+        out_cols = np.ndarray((n * k,), dtype=np.int64, buffer=shm_by_key["out_cols"].buf)
+        out_vals = np.ndarray((n * k,), dtype=np.float32, buffer=shm_by_key["out_vals"].buf)
+        filled = np.flatnonzero(out_cols >= 0)
+        rows = filled // k
+        return rows, out_cols[filled].copy(), out_vals[filled].copy()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
 
-        user_id = index.row_to_actor[row]
-        for pos in top:
-            neighbor_row = int(idx[pos])
-            neighbor_id = index.row_to_actor[neighbor_row]
-            score = float(vals[pos])
-            neighbors.append(UserNeighbor(user_id=user_id, neighbor_id=neighbor_id, score=score))
 
-    return neighbors
+def topk_user_neighbors(
+    M: csr_matrix,
+    index: ActorTargetIndex,
+    *,
+    k: int = 100,
+    memory_budget_mb: Optional[int] = None,
+    workers: Optional[int] = None,
+    rows: Optional[np.ndarray] = None,
+) -> NeighborBatch:
+    """
+    Bước 6: user-based CF với cosine similarity.
 
+    - L2-normalize các hàng của M 1 lần (cosine = tích vô hướng).
+    - Tính theo block hàng: X[block] @ X.T, block chọn theo memory_budget_mb
+      (mặc định settings.CF_SIM_BLOCK_MEMORY_MB) → không bao giờ giữ cả ma trận n x n.
+    - Với mỗi user (row), lấy top-k neighbors (loại bỏ self) trên data CSR của block.
+    - workers > 1 (mặc định settings.CF_SIM_WORKERS): chia block cho process pool qua shared memory,
+      budget bộ nhớ tính cho từng worker; kết quả giống hệt bản 1 process.
+    - rows (chỉ số hàng của M): chỉ tính top-k cho các hàng này (so với mọi hàng), trong process hiện tại –
+      dùng khi cập nhật dần; kết quả của từng hàng giống hệt khi tính toàn bộ.
+    - Trả về NeighborBatch (mảng user_id, neighbor_id, score), sắp theo user, score giảm dần.
+    """
+    if M.shape[0] == 0 or k <= 0:
+        return NeighborBatch.empty()
+    from app.utils.config import settings
+
+    if memory_budget_mb is None:
+        memory_budget_mb = settings.CF_SIM_BLOCK_MEMORY_MB
+    if workers is None:
+        workers = settings.CF_SIM_WORKERS
+    budget_bytes = int(memory_budget_mb) * 1024 * 1024
+
+    X = normalize_rows_l2(csr_matrix(M, dtype=np.float32))
+    if rows is not None:
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if rows.size == 0:
+            return NeighborBatch.empty()
+        XT = X.T.tocsr()
+        X_rows = X[rows]
+        out_rows, out_cols, out_vals = [], [], []
+        for start, end in _sim_row_blocks(X_rows, budget_bytes=budget_bytes, against=X):
+            r, c, v = _topk_block(X_rows[start:end] @ XT, 0, k, row_ids=rows[start:end])
+            out_rows.append(r)
+            out_cols.append(c)
+            out_vals.append(v)
+        rows, cols, vals = np.concatenate(out_rows), np.concatenate(out_cols), np.concatenate(out_vals)
+    elif workers > 1 and X.shape[0] > 1:
+        rows, cols, vals = _topk_neighbors_parallel(X, k=k, budget_bytes=budget_bytes, workers=workers)
+    else:
+        XT = X.T.tocsr()
+        out_rows, out_cols, out_vals = [], [], []
+        for start, end in _sim_row_blocks(X, budget_bytes=budget_bytes):
+            r, c, v = _topk_block(X[start:end] @ XT, start, k)
+            out_rows.append(r)
+            out_cols.append(c)
+            out_vals.append(v)
+        rows, cols, vals = np.concatenate(out_rows), np.concatenate(out_cols), np.concatenate(out_vals)
+
+    users = np.asarray(index.row_to_actor, dtype=np.int64)
+    return NeighborBatch(users[rows], users[cols], vals)
@@ -0,0 +1,386 @@
+"""
+MinHash + banded LSH index cho neighbors theo số target chung (engine của /api/similar-users).
+
+- Tập target của mỗi actor (distinct target trong window của user_interaction_daily) → chữ ký MinHash
+  `num_perm` giá trị uint32 (hash multiply-shift (a*x + b) mod 2^64 >> 32, a lẻ, sinh từ seed).
+- Chữ ký chia `bands` băng × `rows_per_band`; mỗi băng hash về 1 key uint64, bucket = các actor cùng key
+  (lưu dạng mảng key đã sort + row tương ứng → tra bằng searchsorted, không dict).
+- Query: gom actor chung bucket ở ít nhất 1 băng (P ≈ 1 - (1 - J^r)^b với J = Jaccard), rồi chấm lại
+  CHÍNH XÁC số target chung trên các candidate này → cùng score với SQL get_similar_users_shared_targets.
+- recall_report: so top-k LSH với top-k chính xác (nhân sparse trên cùng dữ liệu) trên 1 mẫu actor.
+
+Index build offline (app/jobs/build_minhash_index.py), lưu thành thư mục .npy + meta.json (đọc lại bằng mmap).
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy.orm import Session
+
+from app.services.array_store import meta_mtime_ns, read_array_dir, write_array_dir
+from app.services.time_utils import utcnow
+from app.utils.config import settings
+
+_ACTOR_TARGET_SETS_SQL = """
+SELECT DISTINCT actor_user_id, target_user_id
+FROM user_interaction_daily
+WHERE day >= %(cutoff)s
+ORDER BY actor_user_id, target_user_id
+"""
+
+# Hằng số trộn khi gộp các giá trị của 1 băng thành key (golden ratio 64-bit)
+_BAND_MIX = np.uint64(0x9E3779B97F4A7C15)
+# Số cạnh (actor, target) tối đa hash cùng lúc khi tính chữ ký
+_SIGNATURE_CHUNK_EDGES = 4_000_000
+
+_ARRAY_FIELDS = (
+    "actor_ids",
+    "indptr",
+    "targets",
+    "signatures",
+    "row_keys",
+    "bucket_keys",
+    "bucket_rows",
+    "coeff_a",
+    "coeff_b",
+)
+
+
+@dataclass(frozen=True)
+class MinHashLSHIndex:
+    """
+    Index MinHash/LSH (mọi field là mảng NumPy, có thể là memmap):
+    - actor_ids (n,) int64 tăng dần; indptr (n+1,) / targets (nnz,) = tập target của từng actor (CSR, target sort)
+    - signatures (n, num_perm) uint32; row_keys (n, bands) uint64 = key băng của từng actor
+    - bucket_keys / bucket_rows (bands, n): key của băng đã sort + row tương ứng
+    - coeff_a / coeff_b (num_perm,) uint64: hệ số hash (cần để ký actor mới)
+    """
+
+    actor_ids: np.ndarray
+    indptr: np.ndarray
+    targets: np.ndarray
+    signatures: np.ndarray
+    row_keys: np.ndarray
+    bucket_keys: np.ndarray
+    bucket_rows: np.ndarray
+    coeff_a: np.ndarray
+    coeff_b: np.ndarray
+    window_days: int
+    built_at: str
+
+    @property
+    def num_perm(self) -> int:
+        return int(self.signatures.shape[1])
+
+    @property
+    def bands(self) -> int:
+        return int(self.row_keys.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.actor_ids)
+
+    def row_of(self, user_id: int) -> Optional[int]:
+        row = int(np.searchsorted(self.actor_ids, user_id))
+        if row < len(self.actor_ids) and int(self.actor_ids[row]) == int(user_id):
+            return row
+        return None
+
+
+@dataclass(frozen=True)
+class RecallReport:
+    k: int
+    sampled: int
+    recall: float  # trung bình |top-k LSH đúng| / |top-k chính xác| (hoà điểm ở hạng k tính là đúng)
+    mean_candidates: float  # số candidate chấm lại trung bình / query
+    candidate_fraction: float  # mean_candidates / số actor trong index
+    lsh_ms_per_query: float
+    exact_ms_per_query: float
+
+
+def load_actor_target_sets(db: Session, *, window_days: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Đọc tập distinct target của mọi actor trong window → (actor_ids, indptr, targets) dạng CSR."""
+    cutoff = (utcnow() - timedelta(days=window_days)).date()
+    raw_conn = db.connection().connection.driver_connection
+    with raw_conn.cursor() as cur:
+        cur.execute(_ACTOR_TARGET_SETS_SQL, {"cutoff": cutoff})
+        rows = cur.fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, np.zeros(1, dtype=np.int64), empty.copy()
+
+    data = np.array(rows, dtype=np.int64)
+    actors, targets = data[:, 0], np.ascontiguousarray(data[:, 1])
+    starts = np.flatnonzero(np.r_[True, actors[1:] != actors[:-1]])
+    indptr = np.r_[starts, len(actors)].astype(np.int64)
+    return actors[starts].copy(), indptr, targets
+
+
+def hash_coefficients(num_perm: int, *, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Hệ số (a lẻ, b) uint64 cho num_perm hàm hash multiply-shift."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+    b = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True)
+    return a, b
+
+
+def minhash_signatures(
+    indptr: np.ndarray,
+    targets: np.ndarray,
+    coeff_a: np.ndarray,
+    coeff_b: np.ndarray,
+) -> np.ndarray:
+    """
+    Chữ ký MinHash (n, num_perm) uint32: min theo target của ((a*x + b) mod 2^64) >> 32.
+
+    Mỗi actor phải có >= 1 target. Tính theo từng đoạn actor (~_SIGNATURE_CHUNK_EDGES cạnh),
+    min theo row bằng np.minimum.reduceat.
+    """
+    n = len(indptr) - 1
+    num_perm = len(coeff_a)
+    sig = np.empty((n, num_perm), dtype=np.uint32)
+    if n == 0:
+        return sig
+    x = targets.astype(np.uint64)
+    shift = np.uint64(32)
+
+    row = 0
+    while row < n:
+        end = int(np.searchsorted(indptr, indptr[row] + _SIGNATURE_CHUNK_EDGES, side="right")) - 1
+        end = min(max(end, row + 1), n)
+        lo, hi = int(indptr[row]), int(indptr[end])
+        xs = x[lo:hi]
+        offsets = indptr[row:end] - lo
+        for p in range(num_perm):
+            h = (xs * coeff_a[p] + coeff_b[p]) >> shift
+            sig[row:end, p] = np.minimum.reduceat(h, offsets)
+        row = end
+    return sig
+
+
+def band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """Key uint64 của từng băng (n, bands): gộp rows_per_band giá trị liên tiếp của chữ ký."""
+    n, num_perm = signatures.shape
+    if bands < 1 or num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) phải chia hết cho bands ({bands})")
+    r = num_perm // bands
+    chunks = signatures.reshape(n, bands, r).astype(np.uint64)
+    keys = chunks[:, :, 0].copy()
+    for j in range(1, r):
+        keys = keys * _BAND_MIX + chunks[:, :, j]
+    return keys
+
+
+def build_minhash_index(
+    actor_ids: np.ndarray,
+    indptr: np.ndarray,
+    targets: np.ndarray,
+    *,
+    num_perm: int = 128,
+    bands: int = 64,
+    seed: int = 0,
+    window_days: int = 30,
+) -> MinHashLSHIndex:
+    """Ký mọi actor rồi dựng bucket của từng băng (key sort ổn định → row trong cùng bucket tăng dần)."""
+    coeff_a, coeff_b = hash_coefficients(num_perm, seed=seed)
+    signatures = minhash_signatures(indptr, targets, coeff_a, coeff_b)
+    row_keys = band_keys(signatures, bands)
+
+    n = len(actor_ids)
+    bucket_keys = np.empty((bands, n), dtype=np.uint64)
+    bucket_rows = np.empty((bands, n), dtype=np.int64)
+    for j in range(bands):
+        order = np.argsort(row_keys[:, j], kind="stable")
+        bucket_keys[j] = row_keys[order, j]
+        bucket_rows[j] = order
+
+    return MinHashLSHIndex(
+        actor_ids=np.ascontiguousarray(actor_ids, dtype=np.int64),
+        indptr=np.ascontiguousarray(indptr, dtype=np.int64),
+        targets=np.ascontiguousarray(targets, dtype=np.int64),
+        signatures=signatures,
+        row_keys=row_keys,
+        bucket_keys=bucket_keys,
+        bucket_rows=bucket_rows,
+        coeff_a=coeff_a,
+        coeff_b=coeff_b,
+        window_days=int(window_days),
+        built_at=utcnow().isoformat(),
+    )
+
+
+def build_minhash_index_from_db(
+    db: Session,
+    *,
+    window_days: int = 30,
+    num_perm: int = 128,
+    bands: int = 64,
+    seed: int = 0,
+) -> MinHashLSHIndex:
+    actor_ids, indptr, targets = load_actor_target_sets(db, window_days=window_days)
+    return build_minhash_index(
+        actor_ids, indptr, targets, num_perm=num_perm, bands=bands, seed=seed, window_days=window_days
+    )
+
+
+def candidate_rows(index: MinHashLSHIndex, row: int) -> np.ndarray:
+    """Các row chung bucket với `row` ở ít nhất 1 băng (đã unique, bỏ chính nó)."""
+    keys = index.row_keys[row]
+    parts = []
+    for j in range(index.bands):
+        lo = int(np.searchsorted(index.bucket_keys[j], keys[j], side="left"))
+        hi = int(np.searchsorted(index.bucket_keys[j], keys[j], side="right"))
+        if hi - lo > 1:
+            parts.append(index.bucket_rows[j, lo:hi])
+    if not parts:
+        return np.empty(0, dtype=np.int64)
+    cands = np.unique(np.concatenate(parts))
+    return cands[cands != row]
+
+
+def _shared_target_counts(index: MinHashLSHIndex, row: int, cands: np.ndarray) -> np.ndarray:
+    """Số target chung (chính xác) giữa `row` và từng candidate."""
+    own = index.targets[index.indptr[row] : index.indptr[row + 1]]
+    starts = index.indptr[cands]
+    lengths = index.indptr[cands + 1] - starts
+    owner = np.repeat(np.arange(len(cands)), lengths)
+    pos = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    gathered = index.targets[pos]
+    at = np.minimum(np.searchsorted(own, gathered), len(own) - 1)
+    hit = own[at] == gathered
+    return np.bincount(owner[hit], minlength=len(cands))
+
+
+def _rank_topk(user_ids: np.ndarray, shared: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k theo số target chung giảm dần (hoà → user_id tăng dần), bỏ candidate không có target chung."""
+    keep = shared > 0
+    user_ids, shared = user_ids[keep], shared[keep]
+    order = np.lexsort((user_ids, -shared))[:k]
+    return user_ids[order], shared[order]
+
+
+def query_shared_targets(
+    index: MinHashLSHIndex,
+    user_id: int,
+    *,
+    k: int,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Top-k neighbors của user_id qua LSH → (neighbor_ids int64, shared_targets int64).
+
+    Trả về None nếu user_id không có trong index (caller fallback sang SQL).
+    """
+    row = index.row_of(user_id)
+    if row is None:
+        return None
+    cands = candidate_rows(index, row)
+    if len(cands) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy()
+    shared = _shared_target_counts(index, row, cands)
+    return _rank_topk(index.actor_ids[cands], shared, k)
+
+
+def _binary_target_matrix(index: MinHashLSHIndex) -> csr_matrix:
+    cols_u, cols = np.unique(index.targets, return_inverse=True)
+    data = np.ones(len(cols), dtype=np.float32)
+    return csr_matrix((data, cols.astype(np.int64), index.indptr), shape=(len(index), len(cols_u)))
+
+
+def recall_report(
+    index: MinHashLSHIndex,
+    *,
+    k: int = 20,
+    sample_size: int = 200,
+    seed: int = 0,
+) -> RecallReport:
+    """
+    Recall@k của LSH so với top-k chính xác (B[sample] @ B.T trên cùng tập target) cho sample_size actor ngẫu nhiên.
+
+    Vì score LSH là số target chung chính xác, 1 kết quả LSH được tính là đúng nếu score >= score hạng k
+    của kết quả chính xác (không phạt thứ tự khác nhau khi hoà điểm).
+    """
+    n = len(index)
+    if n == 0:
+        return RecallReport(k, 0, 1.0, 0.0, 0.0, 0.0, 0.0)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+
+    B = _binary_target_matrix(index)
+    t0 = time.perf_counter()
+    S = (B[sample] @ B.T).tocsr()
+    exact_s = time.perf_counter() - t0
+
+    recalls, n_cands = [], []
+    lsh_s = 0.0
+    for i, row in enumerate(sample.tolist()):
+        lo, hi = S.indptr[i], S.indptr[i + 1]
+        cols, vals = S.indices[lo:hi], S.data[lo:hi]
+        other = cols != row
+        _, exact_shared = _rank_topk(index.actor_ids[cols[other]], vals[other].astype(np.int64), k)
+
+        t0 = time.perf_counter()
+        cands = candidate_rows(index, row)
+        got_shared = (
+            _rank_topk(index.actor_ids[cands], _shared_target_counts(index, row, cands), k)[1]
+            if len(cands)
+            else np.empty(0, dtype=np.int64)
+        )
+        lsh_s += time.perf_counter() - t0
+
+        n_cands.append(len(cands))
+        if len(exact_shared) == 0:
+            recalls.append(1.0)
+            continue
+        kth = exact_shared[-1]
+        recalls.append(min(int((got_shared >= kth).sum()), len(exact_shared)) / len(exact_shared))
+
+    m = len(sample)
+    mean_cands = float(np.mean(n_cands))
+    return RecallReport(
+        k=k,
+        sampled=m,
+        recall=float(np.mean(recalls)),
+        mean_candidates=mean_cands,
+        candidate_fraction=mean_cands / n,
+        lsh_ms_per_query=1000.0 * lsh_s / m,
+        exact_ms_per_query=1000.0 * exact_s / m,
+    )
+
+
+def save_minhash_index(index: MinHashLSHIndex, path: str | os.PathLike) -> Path:
+    """Ghi index thành thư mục `path` (mỗi mảng 1 file .npy + meta.json, ghi đè nguyên tử)."""
+    meta = {"window_days": index.window_days, "built_at": index.built_at, "num_perm": index.num_perm, "bands": index.bands}
+    return write_array_dir(path, {name: getattr(index, name) for name in _ARRAY_FIELDS}, meta)
+
+
+def load_minhash_index(path: str | os.PathLike, *, mmap: bool = True) -> MinHashLSHIndex:
+    arrays, meta = read_array_dir(path, _ARRAY_FIELDS, mmap=mmap)
+    return MinHashLSHIndex(window_days=int(meta["window_days"]), built_at=str(meta["built_at"]), **arrays)
+
+
+_SERVING: Dict[str, object] = {}  # index đang phục vụ của process: path, mtime của meta.json, index
+
+
+def serving_index() -> Optional[MinHashLSHIndex]:
+    """
+    Index cho /api/similar-users (CF_MINHASH_INDEX_PATH); None nếu chưa cấu hình / chưa build.
+
+    Load lazily bằng mmap, load lại khi meta.json đổi (job build ghi đè thư mục).
+    """
+    path = settings.CF_MINHASH_INDEX_PATH
+    if not path:
+        return None
+    mtime = meta_mtime_ns(path)
+    if mtime is None:
+        return None
+    if _SERVING.get("path") != path or _SERVING.get("mtime") != mtime:
+        _SERVING.update(path=path, mtime=mtime, index=load_minhash_index(path))
+    return _SERVING["index"]  # type: ignore[return-value]
@@ -0,0 +1,386 @@
+"""
+Materialized `user_pair_scores`: score (actor, target) đã time-decay, cập nhật dần lúc ingest.
+
+Decay half-life có tính nhân: score lưu dạng (score, as_of) và tại t > as_of bằng
+score * 2^(-(t - as_of) / half_life), nên thêm event chỉ cần dời mốc + cộng phần mới
+thay vì aggregate lại cả window (O(event mới) thay vì O(window)).
+
+Phần mới của 1 (actor, target, event_type, day) là hiệu log-scale
+event_score_from_count(count_mới) - event_score_from_count(count_cũ), decay tính từ đầu ngày (UTC)
+của `day` – như tuổi theo ngày của aggregate_pair_scores – nên cộng dần theo batch cho đúng kết quả
+của rebuild_pair_scores (tính 1 lần từ rollup).
+
+Store chỉ gồm các ngày trong window (watermark: window_days + window_start = ngày đầu của window). Ngày
+trước window_start không được cộng lúc ingest; mỗi ngày slide_pair_window trừ phần của các ngày vừa rơi
+khỏi window, nên store luôn bằng aggregate của đúng window_days ngày gần nhất như bản quét rollup.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta, timezone
+from time import monotonic
+from typing import Any, Optional
+
+import numpy as np
+from sqlalchemy import DateTime, Float, Select, cast, delete, func, literal, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.models.models import UserInteractionDaily, UserPairScore
+from app.services.constants import EVENT_TYPE_CODES, decode_event_type
+from app.services.scoring import event_score_from_count, sql_days_ago, sql_event_score, sql_half_life_decay
+from app.services.time_utils import days_ago, half_life_decay, utcnow
+from app.services.watermarks import get_watermark, set_watermark
+from app.utils.config import settings
+
+WATERMARK_NAME = "user_pair_scores"
+
+# Kết quả "sẵn sàng" của pair_store_ready được nhớ _READY_TTL_S giây trong cùng ngày UTC
+# ((half-life, window) → (monotonic lúc kiểm, ngày)), để reader không đọc watermark mỗi lần
+_READY_TTL_S = 60.0
+_READY_CHECKED_AT: dict[tuple[float, int], tuple[float, date]] = {}
+
+PairDayKey = tuple[int, int, str, date]  # (actor, target, event_type, day UTC)
+
+# Count hiện tại (đã gồm delta của batch vừa upsert) của các (actor, target, event_type, day) trong batch,
+# bỏ các ngày trước window_start của store. Chạy sau lock_pair_rows (chờ slide / rebuild đang giữ khoá bảng)
+# nên đọc được window_start mới nhất.
+_PAIR_DAY_TOTALS_SQL = text(
+    """
+    SELECT k.actor_user_id, k.target_user_id, k.event_type, k.day, sum(d.event_count) AS cnt
+    FROM unnest(CAST(:actors AS bigint[]), CAST(:targets AS bigint[]),
+                CAST(:codes AS smallint[]), CAST(:days AS date[]))
+         AS k(actor_user_id, target_user_id, event_type, day)
+    JOIN user_interaction_daily d
+      ON d.actor_user_id = k.actor_user_id AND d.target_user_id = k.target_user_id
+     AND d.event_type = k.event_type AND d.day = k.day
+    WHERE k.day >= coalesce(
+        (SELECT CAST(params->>'window_start' AS date) FROM cf_watermarks WHERE name = :watermark),
+        CAST('-infinity' AS date))
+    GROUP BY 1, 2, 3, 4
+    """
+)
+
+# Dời score cũ tới mốc mới rồi cộng phần mới (phần mới đã decay về mốc :as_of của nó).
+# Mọi biểu thức SET đọc giá trị cũ của row → as_of cũ.
+_APPLY_PAIR_DELTA_SQL = text(
+    """
+    UPDATE user_pair_scores SET
+        score = score * power(2.0, -extract(epoch FROM greatest(as_of, :as_of) - as_of)::float8 / 86400.0 / :hl)
+              + :delta * power(2.0, -extract(epoch FROM greatest(as_of, :as_of) - :as_of)::float8 / 86400.0 / :hl),
+        as_of = greatest(as_of, :as_of),
+        last_interaction_at = greatest(last_interaction_at, :last_at),
+        updated_at = :now
+    WHERE actor_user_id = :actor AND target_user_id = :target
+    """
+)
+
+# Đọc cả store cho CF (chạy qua cursor psycopg trực tiếp như preprocess → placeholder %(name)s;
+# ORM Row cho vài trăm nghìn cặp chậm gấp ~2 lần)
+_READ_PAIR_SCORES_SQL = """
+    SELECT actor_user_id,
+           target_user_id,
+           score * power(2.0, -greatest(extract(epoch FROM %(ref)s - as_of)::float8, 0) / 86400.0 / %(hl)s)
+    FROM user_pair_scores
+    WHERE last_interaction_at >= %(cutoff)s AND score > 0 {actor_filter}
+    ORDER BY actor_user_id, target_user_id
+"""
+
+
+def pair_scores_enabled() -> bool:
+    return settings.PAIR_SCORES_ENABLED and settings.PAIR_SCORES_HALF_LIFE_DAYS > 0
+
+
+def pair_store_ready(db: Session, *, half_life_days: float, window_days: int) -> bool:
+    """
+    Reader chỉ dùng store khi: đang được duy trì, half-life khớp với reader, và watermark (rebuild / slide)
+    có cùng half-life, cùng window_days và window_start = hôm nay - window_days (đã slide tới hôm nay).
+    Ngược lại reader quét rollup như cũ.
+    """
+    if not pair_scores_enabled() or float(half_life_days) != float(settings.PAIR_SCORES_HALF_LIFE_DAYS):
+        return False
+    key = (float(half_life_days), int(window_days))
+    today = utcnow().date()
+    checked = _READY_CHECKED_AT.get(key)
+    if checked is not None and checked[1] == today and monotonic() - checked[0] < _READY_TTL_S:
+        return True
+    wm = get_watermark(db, WATERMARK_NAME)
+    params = (wm.params or {}) if wm is not None else {}
+    ready = (
+        params.get("half_life_days") == float(half_life_days)
+        and params.get("window_days") == int(window_days)
+        and params.get("window_start") == (today - timedelta(days=window_days)).isoformat()
+    )
+    if ready:
+        _READY_CHECKED_AT[key] = (monotonic(), today)
+    return ready
+
+
+def day_start(day: date) -> datetime:
+    """Mốc decay của 1 ngày rollup: 00:00 UTC."""
+    return datetime.combine(day, time(), tzinfo=timezone.utc)
+
+
+def lock_pair_rows(db: Session, rows: list[dict[str, Any]]) -> None:
+    """
+    Tạo / khoá row (actor, target) của batch (theo thứ tự key) trước khi cộng rollup, để 2 transaction
+    cùng cặp không đọc count cũ của nhau (hiệu log-scale không cộng được). Không commit.
+    `rows` như upsert_daily_rows (tên event type, có day / event_count / last_occurred_at).
+    """
+    latest: dict[tuple[int, int], tuple[date, datetime]] = {}  # cặp -> (day lớn nhất, last_occurred_at lớn nhất)
+    for r in rows:
+        key = (int(r["actor_user_id"]), int(r["target_user_id"]))
+        cur = latest.get(key)
+        if cur is None:
+            latest[key] = (r["day"], r["last_occurred_at"])
+        else:
+            latest[key] = (max(cur[0], r["day"]), max(cur[1], r["last_occurred_at"]))
+    now = utcnow()
+    stmt = pg_insert(UserPairScore)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["actor_user_id", "target_user_id"],
+        set_=dict(updated_at=stmt.excluded.updated_at),
+    )
+    db.execute(
+        stmt,
+        [
+            {
+                "actor_user_id": a,
+                "target_user_id": t,
+                "score": 0.0,
+                "as_of": day_start(day),
+                "last_interaction_at": at,
+                "updated_at": now,
+            }
+            for (a, t), (day, at) in sorted(latest.items())
+        ],
+    )
+
+
+def apply_pair_deltas(db: Session, rows: list[dict[str, Any]]) -> int:
+    """
+    Cộng phần score mới của batch vào user_pair_scores (sau khi rows đã được upsert vào rollup,
+    row cặp đã khoá bởi lock_pair_rows). Không commit, trả về số cặp đã cập nhật.
+    """
+    acc: dict[PairDayKey, list] = {}  # key -> [count của batch, last_occurred_at]
+    for r in rows:
+        key = (int(r["actor_user_id"]), int(r["target_user_id"]), r["event_type"], r["day"])
+        a = acc.get(key)
+        if a is None:
+            acc[key] = [int(r["event_count"]), r["last_occurred_at"]]
+        else:
+            a[0] += int(r["event_count"])
+            if r["last_occurred_at"] > a[1]:
+                a[1] = r["last_occurred_at"]
+    if not acc:
+        return 0
+
+    keys = sorted(acc)
+    result = db.execute(
+        _PAIR_DAY_TOTALS_SQL,
+        {
+            "actors": [k[0] for k in keys],
+            "targets": [k[1] for k in keys],
+            "codes": [EVENT_TYPE_CODES[k[2]] for k in keys],
+            "days": [k[3] for k in keys],
+            "watermark": WATERMARK_NAME,
+        },
+    )
+    totals = {
+        (int(a), int(t), decode_event_type(code), day): int(cnt) for a, t, code, day, cnt in result.all()
+    }
+
+    hl = settings.PAIR_SCORES_HALF_LIFE_DAYS
+    per_pair: dict[tuple[int, int], list[tuple[float, datetime, datetime]]] = {}
+    for key in keys:
+        if key not in totals:  # ngày trước window của store
+            continue
+        n, last_at = acc[key]
+        total = totals[key]
+        et = key[2]
+        delta = event_score_from_count(et, total) - event_score_from_count(et, total - n)
+        per_pair.setdefault((key[0], key[1]), []).append((delta, day_start(key[3]), last_at))
+    if not per_pair:
+        return 0
+
+    now = utcnow()
+    params = []
+    for (a, t), parts in per_pair.items():
+        anchor = max(p[1] for p in parts)
+        delta = sum(d * half_life_decay(days_ago(at, ref=anchor), half_life_days=hl) for d, at, _ in parts)
+        params.append(
+            {
+                "actor": a,
+                "target": t,
+                "delta": delta,
+                "as_of": anchor,
+                "last_at": max(p[2] for p in parts),
+                "hl": hl,
+                "now": now,
+            }
+        )
+    db.execute(_APPLY_PAIR_DELTA_SQL, params)
+    return len(params)
+
+
+def _day_contributions(*, since: date, until: Optional[date], as_of: datetime, hl: float) -> Select:
+    """
+    (actor_user_id, target_user_id, score, last_occurred_at): tổng phần score của các ngày rollup
+    [since, until) theo từng cặp, mỗi ngày decay từ 00:00 UTC của ngày đó tới `as_of`.
+    """
+    d = UserInteractionDaily
+    pt = select(
+        d.actor_user_id,
+        d.target_user_id,
+        d.event_type,
+        d.day,
+        func.sum(d.event_count).label("cnt"),
+        func.max(d.last_occurred_at).label("last_occurred_at"),
+    ).where(d.day >= since)
+    if until is not None:
+        pt = pt.where(d.day < until)
+    pt = pt.group_by(d.actor_user_id, d.target_user_id, d.event_type, d.day).subquery("per_type")
+    day_start_col = func.timezone("UTC", cast(pt.c.day, DateTime()))  # 00:00 UTC của day (timestamptz)
+    contrib = sql_event_score(pt.c.event_type, pt.c.cnt) * sql_half_life_decay(
+        sql_days_ago(day_start_col, ref=as_of), half_life_days=hl
+    )
+    return select(
+        pt.c.actor_user_id,
+        pt.c.target_user_id,
+        func.sum(contrib).label("score"),
+        func.max(pt.c.last_occurred_at).label("last_occurred_at"),
+    ).group_by(pt.c.actor_user_id, pt.c.target_user_id)
+
+
+def _watermark_params(window_days: int, window_start: date) -> dict[str, Any]:
+    return {
+        "half_life_days": float(settings.PAIR_SCORES_HALF_LIFE_DAYS),
+        "window_days": int(window_days),
+        "window_start": window_start.isoformat(),
+    }
+
+
+def rebuild_pair_scores(db: Session, *, window_days: Optional[int] = None) -> int:
+    """
+    Tính lại toàn bộ user_pair_scores từ rollup (window_days ngày gần nhất, mặc định
+    PAIR_SCORES_WINDOW_DAYS) trong SQL rồi ghi watermark (window_days, window_start).
+    Khoá bảng EXCLUSIVE trong lúc rebuild: ingest đồng thời chờ rồi cộng delta lên bản mới.
+    Commit, trả về số cặp.
+    """
+    if window_days is None:
+        window_days = settings.PAIR_SCORES_WINDOW_DAYS
+    now = utcnow()
+    as_of = day_start(now.date())
+    since = now.date() - timedelta(days=window_days)
+    hl = settings.PAIR_SCORES_HALF_LIFE_DAYS
+    c = _day_contributions(since=since, until=None, as_of=as_of, hl=hl).subquery("contrib")
+    source = select(
+        c.c.actor_user_id,
+        c.c.target_user_id,
+        c.c.score,
+        literal(as_of, DateTime(timezone=True)),
+        c.c.last_occurred_at,
+        literal(now, DateTime(timezone=True)),
+    )
+
+    db.execute(text("LOCK TABLE user_pair_scores IN EXCLUSIVE MODE"))
+    db.execute(delete(UserPairScore))
+    db.execute(
+        pg_insert(UserPairScore).from_select(
+            ["actor_user_id", "target_user_id", "score", "as_of", "last_interaction_at", "updated_at"],
+            source,
+        )
+    )
+    written = db.execute(select(func.count()).select_from(UserPairScore)).scalar_one()
+    set_watermark(db, WATERMARK_NAME, now, _watermark_params(window_days, since))
+    db.commit()
+    _READY_CHECKED_AT.clear()
+    return int(written)
+
+
+def slide_pair_window(db: Session, *, today: Optional[date] = None) -> int:
+    """
+    Dời window của store tới `today` (mặc định hôm nay UTC): trừ phần score của các ngày
+    [window_start, today - window_days) – đúng phần ingest / rebuild đã cộng (cap theo ngày, decay từ
+    00:00 UTC) – rồi ghi window_start mới. Chạy hằng ngày (app/jobs/maintain_partitions.py); chưa slide
+    thì reader quét rollup. Chưa rebuild → bỏ qua; trễ cả 1 window → rebuild lại.
+    Commit, trả về số ngày đã rơi khỏi window.
+    """
+    db.execute(text("LOCK TABLE user_pair_scores IN EXCLUSIVE MODE"))
+    wm = get_watermark(db, WATERMARK_NAME)
+    params = (wm.params or {}) if wm is not None else {}
+    if "window_start" not in params:
+        db.rollback()
+        return 0
+    window_days = int(params["window_days"])
+    start = date.fromisoformat(params["window_start"])
+    until = (today or utcnow().date()) - timedelta(days=window_days)
+    if until <= start:
+        db.rollback()
+        return 0
+    if (until - start).days >= window_days:
+        rebuild_pair_scores(db, window_days=window_days)
+        return (until - start).days
+
+    now = utcnow()
+    ref = day_start(until)
+    hl = float(params["half_life_days"])
+    gone = _day_contributions(since=start, until=until, as_of=ref, hl=hl).subquery("gone")
+    p = UserPairScore
+    as_of = func.greatest(p.as_of, literal(ref, DateTime(timezone=True)))
+
+    def shift(when: ColumnElement) -> ColumnElement:
+        return sql_half_life_decay(cast(func.extract("epoch", as_of - when), Float) / 86400.0, half_life_days=hl)
+
+    db.execute(
+        update(p)
+        .where(p.actor_user_id == gone.c.actor_user_id, p.target_user_id == gone.c.target_user_id)
+        .values(
+            score=p.score * shift(p.as_of) - gone.c.score * shift(literal(ref, DateTime(timezone=True))),
+            as_of=as_of,
+            updated_at=now,
+        )
+    )
+    set_watermark(db, WATERMARK_NAME, wm.value, {**params, "window_start": until.isoformat()})
+    db.commit()
+    _READY_CHECKED_AT.clear()
+    return (until - start).days
+
+
+def read_pair_score_arrays(
+    db: Session, *, window_days: int, ref: Optional[datetime] = None, actor_ids: Optional[np.ndarray] = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (actors, targets, scores) của các cặp có tương tác trong window_days gần nhất (như rollup reader:
+    ngày UTC >= hôm nay - window_days), score > 0, sắp theo (actor, target).
+    Score dời tới `ref` (mặc định 00:00 UTC hôm nay → tuổi tính theo ngày như bản quét rollup).
+    actor_ids: chỉ đọc các actor này.
+    """
+    ref = ref or day_start(utcnow().date())
+    cutoff = day_start(ref.date() - timedelta(days=window_days))
+    params: dict[str, object] = {"ref": ref, "cutoff": cutoff, "hl": float(settings.PAIR_SCORES_HALF_LIFE_DAYS)}
+    actor_filter = ""
+    if actor_ids is not None:
+        params["actors"] = [int(a) for a in actor_ids]
+        actor_filter = "AND actor_user_id = ANY(%(actors)s)"
+    raw_conn = db.connection().connection.driver_connection
+    with raw_conn.cursor() as cur:
+        cur.execute(_READ_PAIR_SCORES_SQL.format(actor_filter=actor_filter), params)
+        rows = cur.fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), np.empty(0, dtype=np.float64)
+    actors, targets, scores = zip(*rows)
+    return (
+        np.array(actors, dtype=np.int64),
+        np.array(targets, dtype=np.int64),
+        np.array(scores, dtype=np.float64),
+    )
+
+
+def expire_pair_scores(db: Session, *, before: date) -> int:
+    """Xoá cặp không còn tương tác từ trước `before` (cùng retention với rollup). Commit."""
+    result = db.execute(delete(UserPairScore).where(UserPairScore.last_interaction_at < day_start(before)))
+    db.commit()
+    return int(result.rowcount or 0)
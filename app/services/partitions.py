@@ -0,0 +1,189 @@
+"""Quản lý range partitions (theo tháng/tuần) của `user_interaction_events`."""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services.time_utils import utcnow
+
+EVENTS_TABLE = "user_interaction_events"
+DEFAULT_PARTITION = f"{EVENTS_TABLE}_default"
+
+# Khoá advisory (transaction-level) cho DDL partition: nhiều worker khởi động cùng lúc không tạo trùng partition
+_PARTITION_LOCK_KEY = f"{EVENTS_TABLE}:partitions"
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+@dataclass(frozen=True)
+class PartitionRow:
+    name: str
+    start: date  # inclusive (00:00 UTC)
+    end: date  # exclusive (00:00 UTC)
+
+
+def partition_start(day: date, interval: str = "month") -> date:
+    """Ngày bắt đầu của partition chứa `day` (đầu tháng, hoặc thứ Hai với interval="week")."""
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    raise ValueError(f"unsupported partition interval: {interval}")
+
+
+def next_partition_start(start: date, interval: str = "month") -> date:
+    if interval == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_name(start: date, interval: str = "month") -> str:
+    """VD: user_interaction_events_p202610 (tháng), user_interaction_events_p20261012 (tuần)."""
+    suffix = start.strftime("%Y%m") if interval == "month" else start.strftime("%Y%m%d")
+    return f"{EVENTS_TABLE}_p{suffix}"
+
+
+def is_partitioned(db: Session) -> bool:
+    """True nếu bảng events đã là partitioned table (bảng cũ dạng heap cần chạy sql/003 để migrate)."""
+    return bool(
+        db.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"),
+            {"t": EVENTS_TABLE},
+        ).scalar()
+    )
+
+
+def list_event_partitions(db: Session) -> list[PartitionRow]:
+    """Các range partition hiện có (không gồm partition DEFAULT), sắp theo thời gian."""
+    rows = db.execute(
+        text(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:t)
+            """
+        ),
+        {"t": EVENTS_TABLE},
+    ).all()
+
+    partitions = []
+    for name, bound in rows:
+        m = _BOUND_RE.search(bound or "")
+        if m is None:
+            continue  # DEFAULT
+        start = datetime.fromisoformat(m.group(1)).date()
+        end = datetime.fromisoformat(m.group(2)).date()
+        partitions.append(PartitionRow(name=name, start=start, end=end))
+    return sorted(partitions, key=lambda p: p.start)
+
+
+def lock_partitions(db: Session) -> None:
+    """Chờ khoá advisory DDL partition, giữ tới hết transaction hiện tại (commit / rollback tự nhả)."""
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"), {"k": _PARTITION_LOCK_KEY})
+
+
+def ensure_default_partition(db: Session) -> None:
+    """Partition DEFAULT hứng event nằm ngoài mọi range (timestamp lệch/quá xa) thay vì lỗi insert."""
+    db.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {EVENTS_TABLE} DEFAULT"))
+
+
+def ensure_partition(db: Session, start: date, *, interval: str = "month") -> Optional[str]:
+    """
+    Tạo partition [start, next_start) nếu chưa có. Trả về tên partition mới (None nếu đã tồn tại).
+
+    Row của range này đang nằm trong DEFAULT được chuyển sang partition mới trong cùng transaction
+    (CREATE ... PARTITION OF sẽ lỗi nếu DEFAULT còn row thuộc range). Không commit; caller gọi
+    lock_partitions trước để bước kiểm tra → CREATE không bị process khác chen vào.
+    """
+    name = partition_name(start, interval)
+    if db.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar() is not None:
+        return None
+
+    end = next_partition_start(start, interval)
+    bounds = {"s": f"{start.isoformat()} 00:00:00+00", "e": f"{end.isoformat()} 00:00:00+00"}
+    db.execute(text(f"CREATE TABLE {name} (LIKE {EVENTS_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if db.execute(text("SELECT to_regclass(:n)"), {"n": DEFAULT_PARTITION}).scalar() is not None:
+        db.execute(
+            text(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {DEFAULT_PARTITION}
+                    WHERE occurred_at >= CAST(:s AS timestamptz) AND occurred_at < CAST(:e AS timestamptz)
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+                """
+            ),
+            bounds,
+        )
+    db.execute(
+        text(
+            f"ALTER TABLE {EVENTS_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['s']}') TO ('{bounds['e']}')"
+        )
+    )
+    return name
+
+
+def ensure_future_partitions(
+    db: Session,
+    *,
+    ahead: int = 3,
+    interval: str = "month",
+    today: Optional[date] = None,
+) -> list[str]:
+    """
+    Đảm bảo có partition cho kỳ hiện tại + `ahead` kỳ tiếp theo. Commit, trả về partitions mới tạo.
+
+    Chạy dưới lock_partitions: worker khởi động sau chờ worker trước commit rồi thấy partition đã có.
+    """
+    today = today or utcnow().date()
+    lock_partitions(db)
+    ensure_default_partition(db)
+    created = []
+    start = partition_start(today, interval)
+    for _ in range(ahead + 1):
+        name = ensure_partition(db, start, interval=interval)
+        if name:
+            created.append(name)
+        start = next_partition_start(start, interval)
+    db.commit()
+    return created
+
+
+def expire_partitions(
+    db: Session,
+    *,
+    retention_days: int = 365,
+    detach: bool = False,
+    dry_run: bool = False,
+    today: Optional[date] = None,
+) -> list[str]:
+    """
+    Xử lý partitions nằm hoàn toàn ngoài retention (end <= today - retention_days):
+    - mặc định DROP
+    - detach=True: DETACH thành bảng độc lập (archive/pg_dump rồi tự drop sau)
+
+    Trả về tên các partitions đã (hoặc sẽ, với dry_run) bị xử lý.
+    """
+    today = today or utcnow().date()
+    cutoff = today - timedelta(days=retention_days)
+    if not dry_run:
+        lock_partitions(db)
+    expired = [p.name for p in list_event_partitions(db) if p.end <= cutoff]
+    if dry_run:
+        return expired
+    for name in expired:
+        if detach:
+            db.execute(text(f"ALTER TABLE {EVENTS_TABLE} DETACH PARTITION {name}"))
+        else:
+            db.execute(text(f"DROP TABLE {name}"))
+    db.commit()
+    return expired
@@ -1,16 +1,15 @@
 from __future__ import annotations
 
-from collections import defaultdict
 from dataclasses import dataclass
-from datetime import date, timedelta
-from typing import Dict, Iterable, Tuple
+from datetime import timedelta
+from typing import Iterable, Iterator, Optional
 
-from sqlalchemy import func, select
+import numpy as np
 from sqlalchemy.orm import Session
 
-from app.services.time_utils import days_ago, half_life_decay, utcnow
-from app.models import UserInteractionEvent
-from app.services.scoring import event_score_from_count
+from app.services.pair_scores import pair_store_ready, read_pair_score_arrays
+from app.services.time_utils import half_life_decay, utcnow
+from app.services.scoring import event_scores_from_counts
 
 
 @dataclass(frozen=True)
@@ -20,81 +19,200 @@ class PairScore:
     score: float
 
 
-def aggregate_pair_scores(
+@dataclass(frozen=True)
+class PairScoreBatch:
+    """
+    Struct-of-arrays cho nhiều PairScore: actors / targets int64, scores float32, cùng độ dài, liên tục
+    trong bộ nhớ (~20 bytes / cặp thay vì 1 object Python / cặp). Mỗi (actor, target) xuất hiện tối đa 1 lần.
+
+    Iterate ra PairScore để tương thích code cũ; các hàm preprocess / matrix làm việc thẳng trên mảng.
+    """
+
+    actors: np.ndarray
+    targets: np.ndarray
+    scores: np.ndarray
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "actors", np.ascontiguousarray(self.actors, dtype=np.int64))
+        object.__setattr__(self, "targets", np.ascontiguousarray(self.targets, dtype=np.int64))
+        object.__setattr__(self, "scores", np.ascontiguousarray(self.scores, dtype=np.float32))
+        if not (len(self.actors) == len(self.targets) == len(self.scores)):
+            raise ValueError("actors, targets và scores phải cùng độ dài")
+
+    def __len__(self) -> int:
+        return len(self.actors)
+
+    def __iter__(self) -> Iterator[PairScore]:
+        for a, t, sc in zip(self.actors.tolist(), self.targets.tolist(), self.scores.tolist()):
+            yield PairScore(actor_user_id=a, target_user_id=t, score=sc)
+
+    @classmethod
+    def empty(cls) -> "PairScoreBatch":
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+
+    @classmethod
+    def from_pairs(cls, pairs: "Iterable[PairScore] | PairScoreBatch") -> "PairScoreBatch":
+        """Nhận PairScoreBatch (trả lại nguyên) hoặc iterable PairScore."""
+        if isinstance(pairs, PairScoreBatch):
+            return pairs
+        pairs = list(pairs)
+        if not pairs:
+            return cls.empty()
+        return cls(
+            np.fromiter((p.actor_user_id for p in pairs), dtype=np.int64, count=len(pairs)),
+            np.fromiter((p.target_user_id for p in pairs), dtype=np.int64, count=len(pairs)),
+            np.fromiter((p.score for p in pairs), dtype=np.float32, count=len(pairs)),
+        )
+
+    def take(self, idx: np.ndarray) -> "PairScoreBatch":
+        """Batch con theo index / mask (giữ thứ tự của idx)."""
+        return PairScoreBatch(self.actors[idx], self.targets[idx], self.scores[idx])
+
+    def is_sorted(self) -> bool:
+        """True nếu đã sắp theo (actor, target) tăng dần."""
+        a, t = self.actors, self.targets
+        return bool(np.all((a[1:] > a[:-1]) | ((a[1:] == a[:-1]) & (t[1:] > t[:-1]))))
+
+    def sorted(self) -> "PairScoreBatch":
+        """Sắp theo (actor, target); trả lại chính nó (không copy) nếu đã sắp."""
+        if self.is_sorted():
+            return self
+        return self.take(np.lexsort((self.targets, self.actors)))
+
+
+# Aggregate theo (actor, target, day, event_type) trên rollup user_interaction_daily, trả về toàn số nguyên
+# để fetch thẳng thành 1 mảng NumPy: day / last_day tính bằng số ngày kể từ cutoff.
+# (chạy qua cursor psycopg trực tiếp → placeholder kiểu %(name)s)
+# last_day = ngày (theo TimeZone của session) của max(last_occurred_at), giống last_occurred_at.date() phía Python.
+# {actor_filter}: rỗng, hoặc _ACTOR_FILTER_SQL khi chỉ đọc 1 tập actor (cập nhật dần artifact CF).
+_PAIR_DAY_COUNTS_SQL = """
+    SELECT actor_user_id,
+           target_user_id,
+           day - CAST(%(cutoff)s AS date) AS day_idx,
+           event_type,
+           sum(event_count) AS cnt,
+           CAST(max(last_occurred_at) AS date) - CAST(%(cutoff)s AS date) AS last_day_idx
+    FROM user_interaction_daily
+    WHERE day >= %(cutoff)s {actor_filter}
+    GROUP BY actor_user_id, target_user_id, day, event_type
+"""
+_ACTOR_FILTER_SQL = "AND actor_user_id = ANY(%(actors)s)"
+
+
+def _first_seen_groups(*keys: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gom nhóm theo các mảng key (sorted-key: lexsort ổn định + so sánh phần tử kề nhau).
+
+    Trả về (group_of_row, first_row, last_row) với nhóm được đánh số theo thứ tự xuất hiện đầu tiên
+    trong input – giống thứ tự chèn của dict ở bản Python thuần.
+    """
+    order = np.lexsort(keys[::-1])
+    sorted_keys = [k[order] for k in keys]
+    boundary = np.ones(len(order), dtype=bool)
+    boundary[1:] = np.any([k[1:] != k[:-1] for k in sorted_keys], axis=0)
+    starts = np.flatnonzero(boundary)
+    ends = np.append(starts[1:], len(order))
+
+    first_row = order[starts]  # lexsort ổn định → phần tử đầu của mỗi run là row xuất hiện sớm nhất
+    last_row = order[ends - 1]
+    group_sorted = np.cumsum(boundary) - 1
+
+    rank = np.empty(len(starts), dtype=np.int64)
+    by_first = np.argsort(first_row, kind="stable")
+    rank[by_first] = np.arange(len(starts))
+    group_of_row = np.empty(len(order), dtype=np.int64)
+    group_of_row[order] = rank[group_sorted]
+    return group_of_row, first_row[by_first], last_row[by_first]
+
+
+def aggregate_pair_score_arrays(
     db: Session,
     *,
     window_days: int = 30,
     half_life_days: float = 30.0,
-) -> list[PairScore]:
+    actor_ids: Optional[np.ndarray] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Bước 4: Preprocess (dedup/aggregate + time-decay + outlier cap/normalize input cho CF).
+    Bản cột của aggregate_pair_scores → (actors int64, targets int64, scores float64), score > 0.
 
-    - Dedup/Aggregate:
-      + gom theo (actor, target, day, event_type) → count
-      + tính score base bằng event_score_from_count(event_type, count)
-    - Time-decay:
-      + mỗi day có score_day * decay(day)
-    - Trả về list PairScore(actor, target, score_raw) (chưa normalize theo actor).
+    Các bước giống hệt bản theo row nhưng chạy trên mảng:
+    - score từng (actor, target, day, event_type) qua bảng tra event_scores_from_counts
+    - base_day = tổng theo event_type (np.bincount cộng tuần tự theo thứ tự fetch, như dict cũ)
+    - decay theo ngày của last_occurred_at (bảng tra half_life_decay trên các tuổi khác nhau)
+    - cộng base_day * decay theo (actor, target), thứ tự output = thứ tự xuất hiện đầu tiên
+
+    Khi user_pair_scores sẵn sàng cho đúng half_life_days + window_days này (pair_store_ready) thì đọc thẳng
+    từ store (1 row / cặp, đã decay; sắp theo (actor, target)) thay vì aggregate lại cả window.
+
+    actor_ids: chỉ đọc các actor này (score từng cặp giống hệt khi đọc cả window).
     """
+    if pair_store_ready(db, half_life_days=half_life_days, window_days=window_days):
+        return read_pair_score_arrays(db, window_days=window_days, actor_ids=actor_ids)
+
     cutoff = utcnow().date() - timedelta(days=window_days)
+    params: dict[str, object] = {"cutoff": cutoff}
+    actor_filter = ""
+    if actor_ids is not None:
+        params["actors"] = [int(a) for a in actor_ids]
+        actor_filter = _ACTOR_FILTER_SQL
 
-    # 1) Aggregate theo (actor, target, day, event_type)
-    q = (
-        select(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.target_user_id,
-            func.date(UserInteractionEvent.occurred_at).label("day"),
-            UserInteractionEvent.event_type,
-            func.count().label("cnt"),
-            func.max(UserInteractionEvent.occurred_at).label("last_occurred_at"),
-        )
-        .where(UserInteractionEvent.occurred_at >= cutoff)
-        .group_by(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.target_user_id,
-            func.date(UserInteractionEvent.occurred_at),
-            UserInteractionEvent.event_type,
-        )
-    )
+    raw_conn = db.connection().connection.driver_connection
+    with raw_conn.cursor() as cur:
+        cur.execute(_PAIR_DAY_COUNTS_SQL.format(actor_filter=actor_filter), params)
+        rows = cur.fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), np.empty(0, dtype=np.float64)
 
-    # (actor, target, day) -> {event_type -> count}
-    daily_counts: Dict[Tuple[int, int, date], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
-    last_occurred: Dict[Tuple[int, int, date], date] = {}
+    data = np.array(rows, dtype=np.int64)
+    actor, target, day_idx, code, cnt, last_day_idx = data.T
 
-    for actor_id, target_id, day_val, event_type, cnt, last_occurred_at in db.execute(q).all():
-        actor = int(actor_id)
-        target = int(target_id)
-        d: date = day_val
-        key = (actor, target, d)
-        daily_counts[key][str(event_type).strip().lower()] += int(cnt)
-        if last_occurred_at is not None:
-            last_occurred[key] = last_occurred_at.date()
+    # 1) score từng row, cộng theo (actor, target, day)
+    row_scores = event_scores_from_counts(code, cnt)
+    day_group, first_row, last_row = _first_seen_groups(actor, target, day_idx)
+    base_day = np.bincount(day_group, weights=row_scores, minlength=len(first_row))
 
-    now = utcnow()
+    # 2) decay theo ngày gần nhất của nhóm (row cuối cùng được fetch, như bản dict)
+    keep = base_day > 0
+    ref_idx = (utcnow().date() - cutoff).days
+    ages, age_inverse = np.unique(ref_idx - last_day_idx[last_row[keep]], return_inverse=True)
+    decay_table = np.array([half_life_decay(float(a), half_life_days=half_life_days) for a in ages])
+    contrib = base_day[keep] * decay_table[age_inverse]
 
-    # 2) Tính score cho từng (actor, target) bằng cách cộng score_day * decay
-    pair_scores: Dict[Tuple[int, int], float] = defaultdict(float)
+    # 3) cộng theo (actor, target)
+    g_actor = actor[first_row[keep]]
+    g_target = target[first_row[keep]]
+    pair_group, pair_first, _ = _first_seen_groups(g_actor, g_target)
+    scores = np.bincount(pair_group, weights=contrib, minlength=len(pair_first))
 
-    for (actor, target, d), counts_by_type in daily_counts.items():
-        # base score trong 1 ngày: sum theo event_type
-        base_day = 0.0
-        for et, c in counts_by_type.items():
-            base_day += event_score_from_count(et, c)
-        if base_day <= 0:
-            continue
+    positive = scores > 0
+    return g_actor[pair_first][positive], g_target[pair_first][positive], scores[positive]
 
-        # days_ago tính từ ngày gần nhất (nếu có), fallback = d
-        day_for_decay = last_occurred.get((actor, target, d), d)
-        d_ago = days_ago(day_for_decay, ref=now)
-        decay = half_life_decay(d_ago, half_life_days=half_life_days)
 
-        pair_scores[(actor, target)] += base_day * decay
+def aggregate_pair_scores(
+    db: Session,
+    *,
+    window_days: int = 30,
+    half_life_days: float = 30.0,
+    actor_ids: Optional[np.ndarray] = None,
+) -> PairScoreBatch:
+    """
+    Bước 4: Preprocess (dedup/aggregate + time-decay + outlier cap/normalize input cho CF).
 
-    return [
-        PairScore(actor_user_id=actor, target_user_id=target, score=score)
-        for (actor, target), score in pair_scores.items()
-        if score > 0
-    ]
+    - Dedup/Aggregate:
+      + gom theo (actor, target, day, event_type) → count
+      + tính score base bằng event_score_from_count(event_type, count)
+    - Time-decay:
+      + mỗi day có score_day * decay(day)
+    - Trả về PairScoreBatch(actor, target, score_raw) (chưa normalize theo actor).
+
+    Tính vectorized bằng NumPy (aggregate_pair_score_arrays), không lặp Python theo row;
+    đọc từ user_pair_scores nếu store sẵn sàng; actor_ids → chỉ các actor này.
+    """
+    actors, targets, scores = aggregate_pair_score_arrays(
+        db, window_days=window_days, half_life_days=half_life_days, actor_ids=actor_ids
+    )
+    return PairScoreBatch(actors, targets, scores)
 
 
 def cap_outliers_iqr(values: Iterable[float], *, factor: float = 1.5) -> tuple[float, float]:
@@ -105,56 +223,44 @@ def cap_outliers_iqr(values: Iterable[float], *, factor: float = 1.5) -> tuple[f
     - upper = Q3 + factor * IQR
 
     Trả về (lower, upper). Nếu số lượng điểm < 4 thì trả về (min, max).
+    Nhận iterable hoặc mảng NumPy (vd. data của CSR); phân vị nội suy tuyến tính qua np.percentile.
     """
-    data = sorted(float(v) for v in values if v is not None)
-    n = len(data)
+    if isinstance(values, np.ndarray):
+        data = values.astype(np.float64, copy=False).ravel()
+    else:
+        data = np.array([float(v) for v in values if v is not None], dtype=np.float64)
+    n = data.size
     if n == 0:
         return 0.0, 0.0
+    lo, hi = float(data.min()), float(data.max())
     if n < 4:
-        return data[0], data[-1]
-
-    def _percentile(sorted_vals: list[float], p: float) -> float:
-        k = (len(sorted_vals) - 1) * p
-        f = int(k)
-        c = min(f + 1, len(sorted_vals) - 1)
-        if f == c:
-            return sorted_vals[f]
-        d = k - f
-        return sorted_vals[f] * (1 - d) + sorted_vals[c] * d
-
-    q1 = _percentile(data, 0.25)
-    q3 = _percentile(data, 0.75)
+        return lo, hi
+
+    q1, q3 = np.percentile(data, [25.0, 75.0])
     iqr = q3 - q1
     if iqr <= 0:
-        return data[0], data[-1]
+        return lo, hi
     lower = q1 - factor * iqr
     upper = q3 + factor * iqr
     return float(lower), float(upper)
 
 
-def normalize_by_actor_l2(pairs: list[PairScore]) -> list[PairScore]:
+def normalize_by_actor_l2(pairs: PairScoreBatch | Iterable[PairScore]) -> PairScoreBatch:
     """
     Normalize score theo từng actor (row-normalize, L2):
     - Với mỗi actor, chia score của từng target cho norm L2 của vector score.
+    - Giữ nguyên thứ tự cặp; norm tính bằng float64 (np.bincount theo actor) rồi lưu lại float32.
     """
-    from math import sqrt
-
-    by_actor: Dict[int, Dict[int, float]] = defaultdict(dict)
-    for p in pairs:
-        by_actor[p.actor_user_id][p.target_user_id] = p.score
-
-    normalized: list[PairScore] = []
-    for actor, targets in by_actor.items():
-        norm2 = sqrt(sum(v * v for v in targets.values()))
-        if norm2 <= 0:
-            # nếu actor chỉ có 1–2 điểm nhỏ, giữ nguyên
-            for t, s in targets.items():
-                normalized.append(PairScore(actor_user_id=actor, target_user_id=t, score=s))
-            continue
-        inv = 1.0 / norm2
-        for t, s in targets.items():
-            normalized.append(PairScore(actor_user_id=actor, target_user_id=t, score=s * inv))
-    return normalized
+    batch = PairScoreBatch.from_pairs(pairs)
+    if len(batch) == 0:
+        return batch
+    actors_u, actor_idx = np.unique(batch.actors, return_inverse=True)
+    scores = batch.scores.astype(np.float64)
+    norm2 = np.sqrt(np.bincount(actor_idx, weights=scores * scores, minlength=len(actors_u)))
+    # nếu actor chỉ có 1–2 điểm nhỏ (norm = 0), giữ nguyên
+    inv = np.ones_like(norm2)
+    np.divide(1.0, norm2, out=inv, where=norm2 > 0)
+    return PairScoreBatch(batch.actors, batch.targets, scores * inv[actor_idx])
 
 
 def compute_sparsity(num_rows: int, num_cols: int, nnz: int) -> float:
@@ -1,13 +1,36 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import Optional
 
-from sqlalchemy import distinct, func, select
+import numpy as np
+from sqlalchemy import (
+    BigInteger,
+    Float,
+    Select,
+    all_,
+    and_,
+    any_,
+    bindparam,
+    distinct,
+    exists,
+    func,
+    literal,
+    select,
+    union,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
 
-from app.models.models import Friend, UserInteractionEvent
-from app.services.scoring import event_score_from_count
+from app.models.models import Friend, UserInteractionDaily
+from app.services.constants import decode_event_type
+from app.services.friend_graph import cached_friend_ids, query_friend_ids
+from app.services.interaction_graph import graph_shared_targets
+from app.services.minhash_lsh import query_shared_targets, serving_index
+from app.services.scoring import event_score_from_count, sql_days_ago, sql_event_score, sql_half_life_decay
 from app.services.time_utils import days_ago, half_life_decay, utcnow
 
 
@@ -18,6 +41,37 @@ class UserScoreRow:
     reason: str
 
 
+def _shared_targets_select(user_id: int, *, k: int, cutoff_day: date) -> Select:
+    """(other_user_id, shared_targets): top-k actor khác theo số target chung trong window (hoà → user_id tăng dần)."""
+    d = UserInteractionDaily
+    user_targets = select(d.target_user_id).where(d.actor_user_id == user_id, d.day >= cutoff_day)
+    shared = func.count(distinct(d.target_user_id))
+    return (
+        select(d.actor_user_id.label("other_user_id"), shared.label("shared_targets"))
+        .where(
+            d.day >= cutoff_day,
+            d.actor_user_id != user_id,
+            d.target_user_id.in_(user_targets),
+        )
+        .group_by(d.actor_user_id)
+        .order_by(shared.desc(), d.actor_user_id)
+        .limit(k)
+    )
+
+
+def _in_memory_shared_targets(user_id: int, *, k: int, window_days: int) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """
+    Neighbors theo số target chung không cần query: đồ thị tương tác trong bộ nhớ (chính xác), rồi index
+    MinHash/LSH build offline cho đúng window này (chỉ chấm lại trên candidate). None → đếm bằng SQL.
+    """
+    found = graph_shared_targets(user_id, k=k, window_days=window_days)
+    if found is None:
+        index = serving_index()
+        if index is not None and index.window_days == window_days:
+            found = query_shared_targets(index, user_id, k=k)
+    return found
+
+
 def get_similar_users_shared_targets(
     db: Session,
     *,
@@ -25,124 +79,235 @@ def get_similar_users_shared_targets(
     k: int,
     window_days: int,
 ) -> tuple[list[UserScoreRow], datetime]:
-    cutoff = utcnow() - timedelta(days=window_days)
-    print("cutoff", cutoff)
-    print("user_id", user_id, type(user_id))
-    user_targets_sq = (
-        select(distinct(UserInteractionEvent.target_user_id).label("target_user_id"))
-        .where(
-            UserInteractionEvent.actor_user_id == user_id,
-            UserInteractionEvent.occurred_at >= cutoff,
-        )
-        .subquery()
-    )
+    found = _in_memory_shared_targets(user_id, k=k, window_days=window_days)
+    if found is not None:
+        rows = zip(found[0].tolist(), found[1].tolist())
+    else:
+        cutoff = utcnow() - timedelta(days=window_days)
+        rows = db.execute(_shared_targets_select(user_id, k=k, cutoff_day=cutoff.date())).all()
+    neighbors = [UserScoreRow(user_id=int(uid), score=float(sc), reason="shared_targets") for uid, sc in rows]
+    return neighbors, utcnow()
+
+
+def recommend_users_neighbors_2hop_weighted(
+    db: Session,
+    *,
+    user_id: int,
+    k: int,
+    window_days: int,
+    neighbor_k: int,
+    popular_fallback: bool = False,
+) -> tuple[list[UserScoreRow], datetime]:
+    """
+    Đề xuất 2-hop trong 1 câu SQL (1 round trip), score + loại trừ + top-k phía server:
+
+    - CTE neighbors: truyền vào dạng mảng (`unnest`, lọc bằng `= ANY`) nếu đã có từ đồ thị / index MinHash,
+      ngược lại đếm target chung ngay trong câu.
+    - Loại target user đã tương tác trong window, bạn bè (friends 2 chiều) và chính user.
+    - Score (neighbor, target) = event score trên count cả window × decay từ lần tương tác gần nhất, tính trên
+      rollup ngày (sql_event_score / sql_half_life_decay, cùng công thức với event_score_from_count /
+      half_life_decay bên Python – xem recommend_users_neighbors_2hop_reference). Không đọc user_pair_scores: store
+      cộng score theo từng ngày (cap theo ngày, decay từ 00:00 UTC) – công thức của aggregate_pair_scores.
+    - popular_fallback=True: không có đề xuất 2-hop nào → cùng câu trả về popular users (reason
+      "popular_fallback", loại bạn bè + chính user); nhánh popular chỉ chạy khi cần.
+    """
+    now = utcnow()
+    cutoff_day = (now - timedelta(days=window_days)).date()
+    d = UserInteractionDaily
+
+    # Bạn bè: mảng từ friend_cache nếu có (hit), ngược lại đọc trong cùng câu (friends 2 chiều)
+    cached = cached_friend_ids(user_id)
+    if cached is not None:
+        friends = select(
+            func.unnest(bindparam("friend_ids", cached.tolist(), type_=ARRAY(BigInteger))).label("friend_id")
+        ).cte("friend_ids")
+    else:
+        friends = union_all(
+            select(Friend.friend_id.label("friend_id")).where(Friend.user_id == user_id),
+            select(Friend.user_id).where(Friend.friend_id == user_id),
+        ).cte("friend_ids")
+    excluded = union(
+        select(d.target_user_id).where(d.actor_user_id == user_id, d.day >= cutoff_day),
+        select(friends.c.friend_id),
+        select(literal(user_id, BigInteger)),
+    ).cte("excluded")
 
-    q = (
+    found = _in_memory_shared_targets(user_id, k=neighbor_k, window_days=window_days)
+    if found is not None:
+        nb_ids = bindparam("nb_ids", found[0].tolist(), type_=ARRAY(BigInteger))
+        nb = select(
+            func.unnest(nb_ids).label("other_user_id"),
+            func.unnest(bindparam("nb_weights", found[1].astype(float).tolist(), type_=ARRAY(Float))).label(
+                "shared_targets"
+            ),
+        ).cte("nb")
+
+        def in_neighbors(col: ColumnElement) -> ColumnElement:
+            return col == any_(nb_ids)
+
+    else:
+        nb = _shared_targets_select(user_id, k=neighbor_k, cutoff_day=cutoff_day).cte("nb")
+
+        def in_neighbors(col: ColumnElement) -> ColumnElement:
+            return col.in_(select(nb.c.other_user_id))
+
+    # Với mỗi (actor, target, event_type) của neighbors trong window: tổng count + thời điểm tương tác
+    # gần nhất (time-decay); score = neighbor_score * event_score * decay
+    per_type = (
         select(
-            UserInteractionEvent.actor_user_id.label("other_user_id"),
-            func.count(distinct(UserInteractionEvent.target_user_id)).label("shared_targets"),
+            d.actor_user_id,
+            d.target_user_id,
+            d.event_type,
+            func.sum(d.event_count).label("cnt"),
+            func.max(d.last_occurred_at).label("last_occurred_at"),
         )
         .where(
-            UserInteractionEvent.occurred_at >= cutoff,
-            UserInteractionEvent.actor_user_id != user_id,
-            UserInteractionEvent.target_user_id.in_(select(user_targets_sq.c.target_user_id)),
+            d.day >= cutoff_day,
+            in_neighbors(d.actor_user_id),
+            d.target_user_id.notin_(select(excluded.c.target_user_id)),
+        )
+        .group_by(d.actor_user_id, d.target_user_id, d.event_type)
+        .subquery()
+    )
+    contrib = (
+        nb.c.shared_targets
+        * sql_event_score(per_type.c.event_type, per_type.c.cnt)
+        * sql_half_life_decay(
+            sql_days_ago(per_type.c.last_occurred_at, ref=now), half_life_days=float(window_days)
         )
-        .group_by(UserInteractionEvent.actor_user_id)
-        .order_by(func.count(distinct(UserInteractionEvent.target_user_id)).desc())
+    )
+    target_col = per_type.c.target_user_id
+    source = select(target_col.label("user_id")).join(nb, nb.c.other_user_id == per_type.c.actor_user_id)
+
+    score = func.sum(contrib).label("score")
+    cf = (
+        source.add_columns(score, literal("neighbors_2hop_weighted").label("reason"))
+        .group_by(target_col)
+        .having(func.sum(contrib) > 0)
+        .order_by(score.desc(), target_col)
         .limit(k)
+        .cte("cf")
     )
+    recs = select(cf.c.user_id, cf.c.score, cf.c.reason)
+    if popular_fallback:
+        popular = _popular_select(
+            k=k,
+            cutoff_day=cutoff_day,
+            half_life_days=float(window_days),
+            now=now,
+            exclude=and_(
+                d.target_user_id != user_id,
+                d.target_user_id.notin_(select(friends.c.friend_id)),
+            ),
+        ).cte("popular")
+        recs = union_all(
+            recs,
+            select(popular.c.user_id, popular.c.score, popular.c.reason).where(~exists(select(cf.c.user_id))),
+        )
+    out = recs.subquery()
+    q = select(out.c.user_id, out.c.score, out.c.reason).order_by(out.c.score.desc(), out.c.user_id)
 
-    rows = db.execute(q).all()
-    print("rows", rows)
-    neighbors = [
-        UserScoreRow(user_id=int(r.other_user_id), score=float(r.shared_targets), reason="shared_targets")
-        for r in rows
-    ]
-    print("neighbors", neighbors)   
-    return neighbors, utcnow()
+    rows = [UserScoreRow(user_id=int(uid), score=float(sc), reason=str(reason)) for uid, sc, reason in db.execute(q).all()]
+    return rows, now
 
 
-def recommend_users_neighbors_2hop_weighted(
+def recommend_users_neighbors_2hop_reference(
     db: Session,
     *,
     user_id: int,
     k: int,
     window_days: int,
     neighbor_k: int,
+    popular_fallback: bool = False,
 ) -> tuple[list[UserScoreRow], datetime]:
-    cutoff = utcnow() - timedelta(days=window_days)
+    """
+    Bản tham chiếu của recommend_users_neighbors_2hop_weighted (chỉ dùng trong test đối chiếu): nhiều query
+    đơn giản, score + loại trừ + top-k bằng Python (event_score_from_count / half_life_decay).
+    """
+    now = utcnow()
+    cutoff_day = (now - timedelta(days=window_days)).date()
+    d = UserInteractionDaily
 
-    # Targets user already interacted with (exclude from recommendations)
-    seen_q = select(distinct(UserInteractionEvent.target_user_id)).where(
-        UserInteractionEvent.actor_user_id == user_id,
-        UserInteractionEvent.occurred_at >= cutoff,
-    )
-    seen_targets = {int(r[0]) for r in db.execute(seen_q).all()}
-    seen_targets.add(int(user_id))
-
-    neighbors, generated_at = get_similar_users_shared_targets(
-        db,
-        user_id=user_id,
-        k=neighbor_k,
-        window_days=window_days,
-    )
+    friend_ids = query_friend_ids(db, user_id)
+    seen_q = select(distinct(d.target_user_id)).where(d.actor_user_id == user_id, d.day >= cutoff_day)
+    excluded = {int(r[0]) for r in db.execute(seen_q).all()} | friend_ids | {int(user_id)}
+
+    neighbors, _ = get_similar_users_shared_targets(db, user_id=user_id, k=neighbor_k, window_days=window_days)
     neighbor_scores = {n.user_id: n.score for n in neighbors if n.score > 0}
-    neighbor_ids = list(neighbor_scores.keys())
-    if not neighbor_ids:
-        return [], generated_at
-
-    # Loại bỏ những người đã là bạn bè (kiểm tra cả 2 chiều)
-    from sqlalchemy import or_
-    friends_q = select(Friend.friend_id).where(Friend.user_id == user_id)
-    friends_reverse_q = select(Friend.user_id).where(Friend.friend_id == user_id)
-    
-    already_friends = {int(r[0]) for r in db.execute(friends_q).all()}
-    already_friends.update({int(r[0]) for r in db.execute(friends_reverse_q).all()})
-    
-    seen_targets.update(already_friends)
-
-    # Với mỗi (actor, target, event_type) của neighbors trong window:
-    # - lấy tổng count
-    # - lấy thời điểm tương tác gần nhất (max occurred_at) để tính time-decay
-    agg_q = (
-        select(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.target_user_id,
-            UserInteractionEvent.event_type,
-            func.count().label("cnt"),
-            func.max(UserInteractionEvent.occurred_at).label("last_occurred_at"),
-        )
-        .where(
-            UserInteractionEvent.occurred_at >= cutoff,
-            UserInteractionEvent.actor_user_id.in_(neighbor_ids),
+
+    scores: dict[int, float] = {}
+    if neighbor_scores:
+        agg_q = (
+            select(
+                d.actor_user_id,
+                d.target_user_id,
+                d.event_type,
+                func.sum(d.event_count),
+                func.max(d.last_occurred_at),
+            )
+            .where(d.day >= cutoff_day, d.actor_user_id.in_(list(neighbor_scores)))
+            .group_by(d.actor_user_id, d.target_user_id, d.event_type)
         )
-        .group_by(
-            UserInteractionEvent.actor_user_id,
-            UserInteractionEvent.target_user_id,
-            UserInteractionEvent.event_type,
+        for actor_id, target_id, event_type, cnt, last_occurred_at in db.execute(agg_q).all():
+            if int(target_id) in excluded:
+                continue
+            base = event_score_from_count(decode_event_type(event_type), int(cnt))
+            decay = half_life_decay(days_ago(last_occurred_at, ref=now), half_life_days=float(window_days))
+            scores[int(target_id)] = scores.get(int(target_id), 0.0) + neighbor_scores[int(actor_id)] * base * decay
+    reason = "neighbors_2hop_weighted"
+
+    if popular_fallback and not any(sc > 0 for sc in scores.values()):
+        pop_q = (
+            select(d.target_user_id, d.event_type, func.sum(d.event_count), func.max(d.last_occurred_at))
+            .where(d.day >= cutoff_day)
+            .group_by(d.target_user_id, d.event_type)
         )
-    )
+        scores = {}
+        for target_id, event_type, cnt, last_occurred_at in db.execute(pop_q).all():
+            if int(target_id) in friend_ids or int(target_id) == user_id:
+                continue
+            base = event_score_from_count(decode_event_type(event_type), int(cnt))
+            decay = half_life_decay(days_ago(last_occurred_at, ref=now), half_life_days=float(window_days))
+            scores[int(target_id)] = scores.get(int(target_id), 0.0) + base * decay
+        reason = "popular_fallback"
 
-    now = utcnow()
-    scores: dict[int, float] = {}
-    for actor_id, target_id, event_type, cnt, last_occurred_at in db.execute(agg_q).all():
-        target_id = int(target_id)
-        if target_id in seen_targets:
-            continue
-        et = str(event_type).strip().lower()
-        base = event_score_from_count(et, int(cnt))
-        if base <= 0:
-            continue
-        d = days_ago(last_occurred_at, ref=now)
-        decay = half_life_decay(d, half_life_days=float(window_days))
-        contrib = float(neighbor_scores.get(int(actor_id), 0.0)) * base * decay
-        if contrib <= 0:
-            continue
-        scores[target_id] = scores.get(target_id, 0.0) + contrib
-
-    top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
-    recs = [UserScoreRow(user_id=uid, score=sc, reason="neighbors_2hop_weighted") for uid, sc in top]
-    return recs, generated_at
+    top = sorted(((uid, sc) for uid, sc in scores.items() if sc > 0), key=lambda x: (-x[1], x[0]))[:k]
+    return [UserScoreRow(user_id=uid, score=sc, reason=reason) for uid, sc in top], now
+
+
+def _popular_select(
+    *,
+    k: int,
+    cutoff_day: date,
+    half_life_days: float,
+    now: datetime,
+    exclude: Optional[ColumnElement] = None,
+) -> Select:
+    """(user_id, score, reason="popular_fallback"): top-k target theo tổng event score × decay trong window."""
+    # Aggregate theo (target_user_id, event_type), kèm thời điểm gần nhất để time-decay
+    # (rollup ngày đã gồm cả event vượt cap không lưu raw); score + top-k tính trong SQL
+    d = UserInteractionDaily
+    per_type = select(
+        d.target_user_id,
+        d.event_type,
+        func.sum(d.event_count).label("cnt"),
+        func.max(d.last_occurred_at).label("last_occurred_at"),
+    ).where(d.day >= cutoff_day)
+    if exclude is not None:
+        per_type = per_type.where(exclude)
+    per_type = per_type.group_by(d.target_user_id, d.event_type).subquery()
+
+    contrib = sql_event_score(per_type.c.event_type, per_type.c.cnt) * sql_half_life_decay(
+        sql_days_ago(per_type.c.last_occurred_at, ref=now), half_life_days=half_life_days
+    )
+    score = func.sum(contrib).label("score")
+    return (
+        select(per_type.c.target_user_id.label("user_id"), score, literal("popular_fallback").label("reason"))
+        .group_by(per_type.c.target_user_id)
+        .having(func.sum(contrib) > 0)
+        .order_by(score.desc(), per_type.c.target_user_id)
+        .limit(k)
+    )
 
 
 def recommend_popular_users(
@@ -161,39 +326,22 @@ def recommend_popular_users(
     if half_life_days is None:
         half_life_days = float(window_days)
 
-    cutoff = utcnow() - timedelta(days=window_days)
-
-    # Aggregate theo (target_user_id, event_type), kèm thời điểm gần nhất để time-decay
-    q = (
-        select(
-            UserInteractionEvent.target_user_id,
-            UserInteractionEvent.event_type,
-            func.count().label("cnt"),
-            func.max(UserInteractionEvent.occurred_at).label("last_occurred_at"),
+    now = utcnow()
+    exclude = None
+    if exclude_user_ids:
+        exclude = UserInteractionDaily.target_user_id != all_(
+            bindparam("exclude_ids", sorted(exclude_user_ids), type_=ARRAY(BigInteger))
         )
-        .where(UserInteractionEvent.occurred_at >= cutoff)
-        .group_by(UserInteractionEvent.target_user_id, UserInteractionEvent.event_type)
+    q = _popular_select(
+        k=k,
+        cutoff_day=(now - timedelta(days=window_days)).date(),
+        half_life_days=half_life_days,
+        now=now,
+        exclude=exclude,
     )
 
-    now = utcnow()
-    scores: Dict[int, float] = {}
-
-    for target_id, event_type, cnt, last_occurred_at in db.execute(q).all():
-        target = int(target_id)
-        if target in exclude_user_ids:
-            continue
-
-        et = str(event_type).strip().lower()
-        base = event_score_from_count(et, int(cnt))
-        if base <= 0:
-            continue
-
-        d = days_ago(last_occurred_at, ref=now) if last_occurred_at is not None else 0.0
-        decay = half_life_decay(d, half_life_days=half_life_days)
-
-        scores[target] = scores.get(target, 0.0) + base * decay
-
-    top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
-    recs = [UserScoreRow(user_id=uid, score=sc, reason="popular_fallback") for uid, sc in top]
+    recs = [
+        UserScoreRow(user_id=int(uid), score=float(sc), reason=str(reason))
+        for uid, sc, reason in db.execute(q).all()
+    ]
     return recs, now
-
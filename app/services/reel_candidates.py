@@ -11,7 +11,9 @@ from typing import Optional, Set
 from sqlalchemy import distinct, func, select
 from sqlalchemy.orm import Session
 
-from app.models.models import Friend, Reel, UserInteractionEvent, UserReelEngagement
+from app.models.models import Reel, UserInteractionEvent, UserReelEngagement
+from app.services.friend_graph import get_friend_ids
+from app.services.interaction_graph import graph_shared_targets
 from app.services.time_utils import days_ago, half_life_decay, utcnow
 
 
@@ -38,11 +40,8 @@ def get_social_graph_reels(
     cutoff = utcnow() - timedelta(days=window_days)
     
     if following_user_ids is None:
-        f1 = select(Friend.friend_id).where(Friend.user_id == user_id)
-        f2 = select(Friend.user_id).where(Friend.friend_id == user_id)
-        
-        following_user_ids = {int(r[0]) for r in db.execute(f1).all()}
-        following_user_ids.update({int(r[0]) for r in db.execute(f2).all()})
+        # Bạn bè cả 2 chiều (qua friend_cache nếu bật)
+        following_user_ids = get_friend_ids(db, user_id)
     
     if not following_user_ids:
         return []
@@ -105,37 +104,41 @@ def get_cf_reels(
     """
     cutoff = utcnow() - timedelta(days=window_days)
     
-    # 1. Tìm similar users (neighbors)
-    user_targets_sq = (
-        select(distinct(UserInteractionEvent.target_user_id).label("target_user_id"))
-        .where(
-            UserInteractionEvent.actor_user_id == user_id,
-            UserInteractionEvent.occurred_at >= cutoff,
+    # 1. Tìm similar users (neighbors): đồ thị tương tác trong bộ nhớ nếu bật (cùng window), ngược lại query SQL
+    found = graph_shared_targets(user_id, k=neighbor_k, window_days=window_days)
+    if found is not None:
+        neighbor_scores = {uid: float(sc) for uid, sc in zip(found[0].tolist(), found[1].tolist())}
+    else:
+        user_targets_sq = (
+            select(distinct(UserInteractionEvent.target_user_id).label("target_user_id"))
+            .where(
+                UserInteractionEvent.actor_user_id == user_id,
+                UserInteractionEvent.occurred_at >= cutoff,
+            )
+            .subquery()
         )
-        .subquery()
-    )
     
-    neighbors_q = (
-        select(
-            UserInteractionEvent.actor_user_id.label("neighbor_id"),
-            func.count(distinct(UserInteractionEvent.target_user_id)).label("shared_targets"),
-        )
-        .where(
-            UserInteractionEvent.occurred_at >= cutoff,
-            UserInteractionEvent.actor_user_id != user_id,
-            UserInteractionEvent.target_user_id.in_(select(user_targets_sq.c.target_user_id)),
+        neighbors_q = (
+            select(
+                UserInteractionEvent.actor_user_id.label("neighbor_id"),
+                func.count(distinct(UserInteractionEvent.target_user_id)).label("shared_targets"),
+            )
+            .where(
+                UserInteractionEvent.occurred_at >= cutoff,
+                UserInteractionEvent.actor_user_id != user_id,
+                UserInteractionEvent.target_user_id.in_(select(user_targets_sq.c.target_user_id)),
+            )
+            .group_by(UserInteractionEvent.actor_user_id)
+            .order_by(func.count(distinct(UserInteractionEvent.target_user_id)).desc())
+            .limit(neighbor_k)
         )
-        .group_by(UserInteractionEvent.actor_user_id)
-        .order_by(func.count(distinct(UserInteractionEvent.target_user_id)).desc())
-        .limit(neighbor_k)
-    )
     
-    neighbors = db.execute(neighbors_q).all()
-    if not neighbors:
+        neighbors = db.execute(neighbors_q).all()
+        neighbor_scores = {int(r.neighbor_id): float(r.shared_targets) for r in neighbors}
+    if not neighbor_scores:
         return []
     
-    neighbor_ids = [int(r.neighbor_id) for r in neighbors]
-    neighbor_scores = {int(r.neighbor_id): float(r.shared_targets) for r in neighbors}
+    neighbor_ids = list(neighbor_scores)
     
     # 2. Lấy reels user đã tương tác (để exclude)
     # Join với Reel để đảm bảo đây là reels
@@ -2,9 +2,14 @@
 
 from __future__ import annotations
 
+from datetime import datetime
 from math import log1p
 
-from app.services.constants import EVENT_WEIGHTS, cap_for_event
+import numpy as np
+from sqlalchemy import Float, case, cast, func, literal
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.services.constants import EVENT_TYPE_CODES, EVENT_WEIGHTS, cap_for_event
 
 
 def event_score_from_count(event_type: str, count: int) -> float:
@@ -13,6 +18,9 @@ def event_score_from_count(event_type: str, count: int) -> float:
     - dùng weight theo loại event (message/comment/share/like/view)
     - log-scale: log(1 + count)
     - cap count tuỳ loại để tránh dominance (đặc biệt message/view)
+
+    View được sampling 1/N ở ingest (VIEW_SAMPLE_N) đã được tính N lần vào count của rollup lúc ghi
+    (DailyRollup, theo `sample_n` của từng row) → ở đây không nhân thêm.
     """
     et = event_type.strip().lower()
     w = EVENT_WEIGHTS.get(et)
@@ -20,3 +28,57 @@ def event_score_from_count(event_type: str, count: int) -> float:
         return 0.0
     c = min(int(count), cap_for_event(et))
     return float(w * log1p(c))
+
+
+def event_score_arrays() -> tuple[np.ndarray, np.ndarray]:
+    """
+    Bảng tra cho bản vectorized của event_score_from_count, index theo mã event type (EVENT_TYPE_CODES):
+    - table[code, c] = w * log1p(c), c = 0..cap lớn nhất (tính bằng math.log1p → khớp từng bit với bản scalar)
+    - cap[code]: cap_for_event
+    Mã không dùng (0, mã chưa có weight) → weight 0, cap 0.
+    """
+    n_codes = max(EVENT_TYPE_CODES.values()) + 1
+    cap = np.zeros(n_codes, dtype=np.int64)
+    weight = np.zeros(n_codes, dtype=np.float64)
+    for et, code in EVENT_TYPE_CODES.items():
+        weight[code] = EVENT_WEIGHTS[et]
+        cap[code] = cap_for_event(et)
+
+    log_table = np.array([log1p(c) for c in range(int(cap.max()) + 1)], dtype=np.float64)
+    table = weight[:, None] * log_table[None, :]
+    return table, cap
+
+
+def event_scores_from_counts(codes: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Bản vectorized của event_score_from_count cho mảng (mã event type, count) – cùng kết quả từng phần tử."""
+    table, cap = event_score_arrays()
+    codes = np.asarray(codes, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    known = (codes >= 0) & (codes < len(cap))
+    safe = np.where(known, codes, 0)
+    c = np.minimum(np.maximum(counts, 0), cap[safe])
+    return np.where(known, table[safe, c], 0.0)
+
+
+def sql_event_score(event_type: ColumnElement, count: ColumnElement) -> ColumnElement:
+    """
+    Biểu thức SQL tương đương event_score_from_count, sinh từ EVENT_WEIGHTS + cap_for_event:
+    CASE <mã event type> WHEN code THEN w * ln(1 + least(count, cap)) ... ELSE 0 END.
+    """
+    n = cast(count, Float)
+    whens = []
+    for et, code in EVENT_TYPE_CODES.items():
+        whens.append((event_type == code, EVENT_WEIGHTS[et] * func.ln(1 + func.least(n, float(cap_for_event(et))))))
+    return case(*whens, else_=literal(0.0))
+
+
+def sql_days_ago(when: ColumnElement, *, ref: datetime) -> ColumnElement:
+    """Số ngày (thực) từ timestamp `when` tới `ref`, như days_ago() với datetime."""
+    return cast(func.extract("epoch", literal(ref) - when), Float) / 86400.0
+
+
+def sql_half_life_decay(days: ColumnElement, *, half_life_days: float) -> ColumnElement:
+    """Biểu thức SQL tương đương half_life_decay: 2^(-days / half_life), = 1 khi days <= 0."""
+    if half_life_days <= 0:
+        return literal(1.0)
+    return case((days <= 0, 1.0), else_=func.power(2.0, -days / float(half_life_days)))
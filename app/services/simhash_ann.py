@@ -0,0 +1,457 @@
+"""
+ANN index SimHash (random projection) cho cosine neighbors trên ma trận M (actor x target) của matrix.py.
+
+- Mỗi hàng M được L2-normalize; chiếu lên `tables * bits` vector ngẫu nhiên thưa (phần tử {-1, 0, +1},
+  mật độ 1/2, sinh từ hash của target_id + seed → không cần lưu ma trận chiếu, target mới vẫn chiếu được).
+  Bit = dấu của hình chiếu; mỗi bảng gói `bits` bit thành 1 code uint64.
+- Bucket của từng bảng = mảng code đã sort + row tương ứng (searchsorted). Query dò bucket của chính code
+  và các code cách nó Hamming <= probe_radius ở mọi bảng, rồi re-rank candidate bằng cosine CHÍNH XÁC.
+- Knob recall / latency: tables (nhiều → recall cao), bits (nhiều → bucket nhỏ, ít candidate), probe_radius.
+- add_row thêm / thay 1 hàng không cần build lại (vào vùng pending, gộp lại bằng compact()).
+- Lưu / đọc bằng app.services.array_store (thư mục .npy, mmap).
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from app.services.array_store import read_array_dir, write_array_dir
+from app.services.matrix import ActorTargetIndex, NeighborBatch, normalize_rows_l2
+from app.services.minhash_lsh import RecallReport
+from app.services.time_utils import utcnow
+from app.utils.config import settings
+
+_U64 = np.uint64
+# Số cạnh (hàng, target) tối đa chiếu cùng lúc khi tính code
+_PROJECT_CHUNK_EDGES = 1_000_000
+
+_ARRAY_FIELDS = ("user_ids", "indptr", "targets", "values", "codes", "bucket_keys", "bucket_rows")
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    z = x + _U64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> _U64(30))) * _U64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> _U64(27))) * _U64(0x94D049BB133111EB)
+    return z ^ (z >> _U64(31))
+
+
+def _projection(target_ids: np.ndarray, n_bits: int, seed: int) -> np.ndarray:
+    """Ma trận chiếu (len(target_ids), n_bits) float32, phần tử {-1, 0, +1}: dấu / mask lấy từ bit của hash."""
+    rng = np.random.default_rng(seed)
+    words = (n_bits + 63) // 64
+    sign_keys = rng.integers(0, np.iinfo(np.uint64).max, size=words, dtype=np.uint64, endpoint=True)
+    mask_keys = rng.integers(0, np.iinfo(np.uint64).max, size=words, dtype=np.uint64, endpoint=True)
+    t = target_ids.astype(np.uint64)
+    shifts = np.arange(64, dtype=np.uint64)
+    out = np.empty((len(t), words * 64), dtype=np.float32)
+    for w in range(words):
+        sign = (_splitmix64(t ^ sign_keys[w])[:, None] >> shifts) & _U64(1)
+        mask = (_splitmix64(t ^ mask_keys[w])[:, None] >> shifts) & _U64(1)
+        out[:, w * 64 : (w + 1) * 64] = (1.0 - 2.0 * sign) * mask
+    return out[:, :n_bits]
+
+
+def simhash_codes(
+    indptr: np.ndarray,
+    targets: np.ndarray,
+    values: np.ndarray,
+    *,
+    tables: int,
+    bits: int,
+    seed: int,
+) -> np.ndarray:
+    """
+    Code SimHash (n, tables) uint64 của các hàng CSR (targets là target_id, không phải chỉ số cột).
+
+    Chiếu theo từng đoạn hàng (~_PROJECT_CHUNK_EDGES cạnh), chỉ sinh ma trận chiếu cho target có mặt trong đoạn.
+    """
+    if not 1 <= bits <= 64:
+        raise ValueError("bits phải trong [1, 64]")
+    n = len(indptr) - 1
+    codes = np.zeros((n, tables), dtype=np.uint64)
+    weights = _U64(1) << np.arange(bits, dtype=np.uint64)
+    row = 0
+    while row < n:
+        end = int(np.searchsorted(indptr, indptr[row] + _PROJECT_CHUNK_EDGES, side="right")) - 1
+        end = min(max(end, row + 1), n)
+        lo, hi = int(indptr[row]), int(indptr[end])
+        used, cols = np.unique(targets[lo:hi], return_inverse=True)
+        X = csr_matrix(
+            (values[lo:hi].astype(np.float32), cols, indptr[row : end + 1] - lo), shape=(end - row, len(used))
+        )
+        proj = np.asarray(X @ _projection(used, tables * bits, seed))
+        signs = (proj > 0).reshape(end - row, tables, bits).astype(np.uint64)
+        codes[row:end] = (signs * weights).sum(axis=2, dtype=np.uint64)
+        row = end
+    return codes
+
+
+def _flip_masks(bits: int, radius: int) -> np.ndarray:
+    """XOR mask của mọi code cách 0 tối đa `radius` bit (mask 0 đứng đầu)."""
+    masks = [0]
+    for r in range(1, max(0, radius) + 1):
+        for combo in itertools.combinations(range(bits), r):
+            masks.append(sum(1 << b for b in combo))
+    return np.array(masks, dtype=np.uint64)
+
+
+def _sort_buckets(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    n, tables = codes.shape
+    bucket_keys = np.empty((tables, n), dtype=np.uint64)
+    bucket_rows = np.empty((tables, n), dtype=np.int64)
+    for t in range(tables):
+        order = np.argsort(codes[:, t], kind="stable")
+        bucket_keys[t] = codes[order, t]
+        bucket_rows[t] = order
+    return bucket_keys, bucket_rows
+
+
+class SimHashANNIndex:
+    """
+    Index SimHash nhiều bảng trên các hàng đã L2-normalize.
+
+    Phần base (mảng, có thể là memmap): user_ids tăng dần, CSR (indptr, targets = target_id sort trong hàng,
+    values float32), codes (n, tables), bucket_keys / bucket_rows (tables, n). Hàng thêm bằng add_row nằm
+    ở pending (row id >= n_base, bucket là dict) cho tới compact(); hàng bị thay được đánh dấu chết.
+    """
+
+    def __init__(
+        self,
+        *,
+        user_ids: np.ndarray,
+        indptr: np.ndarray,
+        targets: np.ndarray,
+        values: np.ndarray,
+        codes: np.ndarray,
+        tables: int,
+        bits: int,
+        seed: int = 0,
+        built_at: Optional[str] = None,
+        bucket_keys: Optional[np.ndarray] = None,
+        bucket_rows: Optional[np.ndarray] = None,
+    ) -> None:
+        self.tables = int(tables)
+        self.bits = int(bits)
+        self.seed = int(seed)
+        self.built_at = built_at or utcnow().isoformat()
+        self._set_base(user_ids, indptr, targets, values, codes, bucket_keys, bucket_rows)
+
+    def _set_base(self, user_ids, indptr, targets, values, codes, bucket_keys=None, bucket_rows=None) -> None:
+        self.user_ids = user_ids
+        self.indptr = indptr
+        self.targets = targets
+        self.values = values
+        self.codes = codes
+        if bucket_keys is None or bucket_rows is None:
+            bucket_keys, bucket_rows = _sort_buckets(codes)
+        self.bucket_keys = bucket_keys
+        self.bucket_rows = bucket_rows
+        self._alive = np.ones(len(user_ids), dtype=bool)
+        self._p_users: List[int] = []
+        self._p_targets: List[np.ndarray] = []
+        self._p_values: List[np.ndarray] = []
+        self._p_codes: List[np.ndarray] = []
+        self._p_alive: List[bool] = []
+        self._p_row_of: Dict[int, int] = {}
+        self._p_buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.tables)]
+
+    @property
+    def n_base(self) -> int:
+        return len(self.user_ids)
+
+    def __len__(self) -> int:
+        return int(self._alive.sum()) + sum(self._p_alive)
+
+    def row_of(self, user_id: int) -> Optional[int]:
+        """Row còn sống của user_id (pending ưu tiên hơn base), None nếu không có."""
+        row = self._p_row_of.get(int(user_id))
+        if row is not None:
+            return row if self._p_alive[row - self.n_base] else None
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row < self.n_base and int(self.user_ids[row]) == int(user_id) and self._alive[row]:
+            return row
+        return None
+
+    def _row_data(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        if row < self.n_base:
+            lo, hi = self.indptr[row], self.indptr[row + 1]
+            return self.targets[lo:hi], self.values[lo:hi]
+        return self._p_targets[row - self.n_base], self._p_values[row - self.n_base]
+
+    def _row_codes(self, row: int) -> np.ndarray:
+        return self.codes[row] if row < self.n_base else self._p_codes[row - self.n_base]
+
+    def add_row(self, user_id: int, target_ids: Sequence[int], weights: Sequence[float]) -> Optional[int]:
+        """
+        Thêm / thay vector của user_id (target_id → weight, weight <= 0 bị bỏ); L2-normalize rồi tính code.
+
+        Không còn target nào → chỉ xoá hàng cũ, trả về None. Trả về row id mới.
+        """
+        t = np.asarray(target_ids, dtype=np.int64)
+        w = np.asarray(weights, dtype=np.float64)
+        keep = w > 0
+        t, w = t[keep], w[keep]
+        order = np.argsort(t, kind="stable")
+        t, w = t[order], w[order]
+
+        old = self.row_of(user_id)
+        if old is not None:
+            if old < self.n_base:
+                self._alive[old] = False
+            else:
+                self._p_alive[old - self.n_base] = False
+        if len(t) == 0:
+            return None
+
+        values = (w / np.sqrt(np.dot(w, w))).astype(np.float32)
+        codes = simhash_codes(
+            np.array([0, len(t)], dtype=np.int64), t, values, tables=self.tables, bits=self.bits, seed=self.seed
+        )[0]
+        row = self.n_base + len(self._p_users)
+        self._p_users.append(int(user_id))
+        self._p_targets.append(t)
+        self._p_values.append(values)
+        self._p_codes.append(codes)
+        self._p_alive.append(True)
+        self._p_row_of[int(user_id)] = row
+        for table, code in enumerate(codes.tolist()):
+            self._p_buckets[table].setdefault(code, []).append(row)
+        return row
+
+    def compact(self) -> None:
+        """Gộp pending vào base (bỏ hàng chết, sắp lại theo user_id) và dựng lại bucket."""
+        if not self._p_users and self._alive.all():
+            return
+        base_rows = np.flatnonzero(self._alive)
+        p_rows = [i for i, alive in enumerate(self._p_alive) if alive]
+        lengths = np.diff(self.indptr)[base_rows]
+        starts = self.indptr[base_rows]
+        pos = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+
+        user_ids = np.r_[self.user_ids[base_rows], np.array([self._p_users[i] for i in p_rows], dtype=np.int64)]
+        all_lengths = np.r_[lengths, np.array([len(self._p_targets[i]) for i in p_rows], dtype=np.int64)]
+        targets = np.concatenate([self.targets[pos]] + [self._p_targets[i] for i in p_rows])
+        values = np.concatenate([self.values[pos]] + [self._p_values[i] for i in p_rows])
+        codes = np.concatenate(
+            [self.codes[base_rows], np.array([self._p_codes[i] for i in p_rows], dtype=np.uint64).reshape(-1, self.tables)]
+        )
+
+        order = np.argsort(user_ids, kind="stable")
+        row_starts = np.r_[0, np.cumsum(all_lengths)[:-1]]
+        new_lengths = all_lengths[order]
+        pos = np.repeat(row_starts[order] - np.cumsum(new_lengths) + new_lengths, new_lengths) + np.arange(
+            int(new_lengths.sum())
+        )
+        indptr = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(new_lengths, out=indptr[1:])
+        self._set_base(user_ids[order], indptr, targets[pos], values[pos], codes[order])
+
+    def candidate_rows(self, codes: np.ndarray, *, probe_radius: Optional[int] = None) -> np.ndarray:
+        """
+        Row còn sống nằm trong bucket cách `codes` tối đa probe_radius bit ở ít nhất 1 bảng (đã unique).
+
+        probe_radius mặc định settings.CF_SIMHASH_PROBE_RADIUS; mỗi bảng dò sum C(bits, r) bucket, r <= radius.
+        """
+        if probe_radius is None:
+            probe_radius = settings.CF_SIMHASH_PROBE_RADIUS
+        flips = _flip_masks(self.bits, probe_radius)
+        parts = []
+        for table in range(self.tables):
+            probes = codes[table] ^ flips
+            lo = np.searchsorted(self.bucket_keys[table], probes, side="left")
+            hi = np.searchsorted(self.bucket_keys[table], probes, side="right")
+            for a, b in zip(lo.tolist(), hi.tolist()):
+                if b > a:
+                    parts.append(self.bucket_rows[table, a:b])
+            if self._p_users:
+                for probe in probes.tolist():
+                    rows = self._p_buckets[table].get(probe)
+                    if rows:
+                        parts.append(np.asarray(rows, dtype=np.int64))
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        cands = np.unique(np.concatenate(parts))
+        base = cands < self.n_base
+        alive = np.empty(len(cands), dtype=bool)
+        alive[base] = self._alive[cands[base]]
+        alive[~base] = np.asarray(self._p_alive, dtype=bool)[cands[~base] - self.n_base]
+        return cands[alive]
+
+    def _cosine(self, own_t: np.ndarray, own_v: np.ndarray, cands: np.ndarray) -> np.ndarray:
+        """Cosine chính xác giữa hàng (own_t, own_v) đã normalize và từng candidate."""
+        base = cands[cands < self.n_base]
+        starts = self.indptr[base]
+        lengths = self.indptr[base + 1] - starts
+        pos = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        owner = [np.repeat(np.arange(len(base)), lengths)]
+        gathered_t, gathered_v = [self.targets[pos]], [self.values[pos]]
+        for i, row in enumerate(cands[len(base) :].tolist(), start=len(base)):
+            t, v = self._row_data(row)
+            owner.append(np.full(len(t), i))
+            gathered_t.append(t)
+            gathered_v.append(v)
+        g_owner, g_t, g_v = np.concatenate(owner), np.concatenate(gathered_t), np.concatenate(gathered_v)
+
+        at = np.minimum(np.searchsorted(own_t, g_t), len(own_t) - 1)
+        hit = own_t[at] == g_t
+        return np.bincount(
+            g_owner[hit], weights=g_v[hit].astype(np.float64) * own_v[at[hit]], minlength=len(cands)
+        )
+
+    def _candidate_user_ids(self, cands: np.ndarray) -> np.ndarray:
+        base = cands < self.n_base
+        out = np.empty(len(cands), dtype=np.int64)
+        out[base] = self.user_ids[cands[base]]
+        out[~base] = np.asarray(self._p_users, dtype=np.int64)[cands[~base] - self.n_base]
+        return out
+
+    def _query_row(self, row: int, *, k: int, probe_radius: Optional[int]) -> Tuple[np.ndarray, np.ndarray, int]:
+        cands = self.candidate_rows(self._row_codes(row), probe_radius=probe_radius)
+        cands = cands[cands != row]
+        if len(cands) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), 0
+        own_t, own_v = self._row_data(row)
+        scores = self._cosine(own_t, own_v.astype(np.float64), cands)
+        ids = self._candidate_user_ids(cands)
+        keep = scores > 0
+        ids, scores = ids[keep], scores[keep]
+        order = np.lexsort((ids, -scores))[:k]
+        return ids[order], scores[order].astype(np.float32), len(cands)
+
+    def query(self, user_id: int, *, k: int, probe_radius: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top-k neighbors cosine của user_id → (neighbor_ids int64, cosine float32), score giảm dần
+        (hoà → user_id tăng dần), bỏ cosine <= 0. None nếu user_id không có trong index.
+        """
+        row = self.row_of(user_id)
+        if row is None:
+            return None
+        ids, scores, _ = self._query_row(row, k=k, probe_radius=probe_radius)
+        return ids, scores
+
+
+def build_simhash_index(
+    M: csr_matrix,
+    index: ActorTargetIndex,
+    *,
+    tables: Optional[int] = None,
+    bits: Optional[int] = None,
+    seed: int = 0,
+) -> SimHashANNIndex:
+    """
+    Index SimHash từ M / index của build_sparse_matrix (hàng được L2-normalize, cột đổi về target_id).
+
+    tables / bits mặc định settings.CF_SIMHASH_TABLES / CF_SIMHASH_BITS.
+    """
+    if tables is None:
+        tables = settings.CF_SIMHASH_TABLES
+    if bits is None:
+        bits = settings.CF_SIMHASH_BITS
+    X = normalize_rows_l2(csr_matrix(M, dtype=np.float32))
+    X.sort_indices()  # cột của build_sparse_matrix sắp theo target_id → targets trong hàng cũng sắp
+    col_to_target = np.asarray(index.col_to_target, dtype=np.int64)
+    user_ids = np.asarray(index.row_to_actor, dtype=np.int64)
+    order = np.argsort(user_ids, kind="stable")
+    if not (order == np.arange(len(order))).all():
+        X = X[order]
+        user_ids = user_ids[order]
+    indptr = X.indptr.astype(np.int64)
+    targets = col_to_target[X.indices]
+    values = X.data.astype(np.float32)
+    codes = simhash_codes(indptr, targets, values, tables=tables, bits=bits, seed=seed)
+    return SimHashANNIndex(
+        user_ids=user_ids, indptr=indptr, targets=targets, values=values, codes=codes, tables=tables, bits=bits, seed=seed
+    )
+
+
+def topk_user_neighbors_ann(ann: SimHashANNIndex, *, k: int = 100, probe_radius: Optional[int] = None) -> NeighborBatch:
+    """Top-k neighbors của mọi user trong index qua ANN (thay cho matrix.topk_user_neighbors khi n quá lớn)."""
+    ann.compact()
+    users, neighbors, scores = [], [], []
+    for row in range(ann.n_base):
+        ids, sc, _ = ann._query_row(row, k=k, probe_radius=probe_radius)
+        users.append(np.full(len(ids), ann.user_ids[row], dtype=np.int64))
+        neighbors.append(ids)
+        scores.append(sc)
+    if not users:
+        return NeighborBatch.empty()
+    return NeighborBatch(np.concatenate(users), np.concatenate(neighbors), np.concatenate(scores))
+
+
+def recall_report(
+    ann: SimHashANNIndex,
+    *,
+    k: int = 20,
+    sample_size: int = 200,
+    probe_radius: Optional[int] = None,
+    seed: int = 0,
+) -> RecallReport:
+    """
+    Recall@k của ANN so với top-k cosine chính xác (X[sample] @ X.T) trên sample_size user ngẫu nhiên.
+
+    Kết quả ANN được tính là đúng nếu cosine >= cosine hạng k của kết quả chính xác (trừ sai số float32).
+    """
+    ann.compact()
+    n = ann.n_base
+    if n == 0:
+        return RecallReport(k, 0, 1.0, 0.0, 0.0, 0.0, 0.0)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+
+    cols_u, cols = np.unique(ann.targets, return_inverse=True)
+    X = csr_matrix((ann.values, cols.astype(np.int64), ann.indptr), shape=(n, len(cols_u)))
+    t0 = time.perf_counter()
+    S = (X[sample] @ X.T).tocsr()
+    exact_s = time.perf_counter() - t0
+
+    recalls, n_cands = [], []
+    ann_s = 0.0
+    for i, row in enumerate(sample.tolist()):
+        lo, hi = S.indptr[i], S.indptr[i + 1]
+        cols_i, vals = S.indices[lo:hi], S.data[lo:hi]
+        other = (cols_i != row) & (vals > 0)
+        exact = np.sort(vals[other])[::-1][:k]
+
+        t0 = time.perf_counter()
+        _, got, n_c = ann._query_row(row, k=k, probe_radius=probe_radius)
+        ann_s += time.perf_counter() - t0
+
+        n_cands.append(n_c)
+        if len(exact) == 0:
+            recalls.append(1.0)
+            continue
+        kth = float(exact[-1]) - 1e-6
+        recalls.append(min(int((got >= kth).sum()), len(exact)) / len(exact))
+
+    m = len(sample)
+    mean_cands = float(np.mean(n_cands))
+    return RecallReport(
+        k=k,
+        sampled=m,
+        recall=float(np.mean(recalls)),
+        mean_candidates=mean_cands,
+        candidate_fraction=mean_cands / n,
+        lsh_ms_per_query=1000.0 * ann_s / m,
+        exact_ms_per_query=1000.0 * exact_s / m,
+    )
+
+
+def save_simhash_index(ann: SimHashANNIndex, path: str | os.PathLike) -> Path:
+    """Gộp pending (compact) rồi ghi thành thư mục `path` (.npy + meta.json, ghi đè nguyên tử)."""
+    ann.compact()
+    meta = {"tables": ann.tables, "bits": ann.bits, "seed": ann.seed, "built_at": ann.built_at}
+    return write_array_dir(path, {name: getattr(ann, name) for name in _ARRAY_FIELDS}, meta)
+
+
+def load_simhash_index(path: str | os.PathLike, *, mmap: bool = True) -> SimHashANNIndex:
+    arrays, meta = read_array_dir(path, _ARRAY_FIELDS, mmap=mmap)
+    return SimHashANNIndex(
+        tables=int(meta["tables"]), bits=int(meta["bits"]), seed=int(meta["seed"]), built_at=str(meta["built_at"]), **arrays
+    )
@@ -0,0 +1,126 @@
+"""Ingest-side filter cho view events: dedup theo session (TTL) + sampling 1/N."""
+
+from __future__ import annotations
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.services.constants import VIEW_EVENT_TYPES
+
+
+class TTLDedupCache:
+    """
+    Tập key đã thấy trong `ttl_seconds` gần nhất, bộ nhớ bị chặn ở `max_keys`.
+
+    - Key được lưu dưới dạng hash 64-bit (không giữ tuple gốc) để mỗi entry chỉ tốn ~100 bytes.
+    - TTL cố định nên thứ tự insert cũng là thứ tự hết hạn → dọn entry hết hạn từ đầu OrderedDict.
+    - Khi đầy, bỏ entry cũ nhất (LRU theo thời điểm thấy lần đầu).
+    """
+
+    def __init__(self, *, ttl_seconds: float, max_keys: int) -> None:
+        self._ttl = float(ttl_seconds)
+        self._max_keys = max(1, int(max_keys))
+        self._expires: OrderedDict[int, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def seen(self, key: tuple, *, now: Optional[float] = None) -> bool:
+        """True nếu key đã xuất hiện trong TTL; ngược lại ghi nhận key và trả False."""
+        now = time.monotonic() if now is None else now
+        h = hash(key)
+        with self._lock:
+            while self._expires:
+                oldest, expires_at = next(iter(self._expires.items()))
+                if expires_at > now:
+                    break
+                del self._expires[oldest]
+
+            if h in self._expires:
+                return True
+
+            self._expires[h] = now + self._ttl
+            if len(self._expires) > self._max_keys:
+                self._expires.popitem(last=False)
+            return False
+
+    def forget(self, key: tuple) -> None:
+        """Bỏ key đã ghi nhận (event ghi thất bại → lần client retry không bị coi là trùng)."""
+        with self._lock:
+            self._expires.pop(hash(key), None)
+
+
+class ViewEventFilter:
+    """
+    Quyết định có lưu 1 view event hay không (docs/CF_SYSTEM_STEPS.md bước 1: "dedup theo session hoặc sampling 1/N").
+
+    - Dedup: cùng (actor, target, content, session, event_type) trong `dedup_ttl_seconds` → bỏ.
+    - Sampling: giữ ~1/`sample_n` view (quyết định deterministic theo hash của event,
+      các worker cho cùng kết quả). View được giữ mang `row["sample_n"]` → DailyRollup tính nó
+      `sample_n` lần vào count của rollup (view từ backfill / dump hay lưu trước khi bật sampling không
+      qua filter → tính 1 lần).
+    - Event không phải view luôn được giữ.
+    """
+
+    def __init__(self, *, dedup_ttl_seconds: float = 0, max_keys: int = 200_000, sample_n: int = 1) -> None:
+        self._dedup = (
+            TTLDedupCache(ttl_seconds=dedup_ttl_seconds, max_keys=max_keys) if dedup_ttl_seconds > 0 else None
+        )
+        self._sample_n = max(1, int(sample_n))
+
+    @staticmethod
+    def _key(row: dict[str, Any]) -> tuple:
+        return (
+            row["actor_user_id"],
+            row["target_user_id"],
+            row.get("content_id"),
+            row.get("session_id"),
+            row["event_type"],
+        )
+
+    def should_drop(self, row: dict[str, Any]) -> bool:
+        """
+        `row` là dict đã normalize (xem ingest.normalize_event).
+
+        View được giữ sẽ ghi nhận dedup key ngay; nếu ghi event thất bại caller phải gọi `release(row)`.
+        Khi sampling bật, view được giữ được gán `row["sample_n"]` (trọng số trong rollup).
+        """
+        if row["event_type"] not in VIEW_EVENT_TYPES:
+            return False
+
+        key = self._key(row)
+        if self._dedup is not None and self._dedup.seen(key):
+            return True
+
+        if self._sample_n > 1:
+            digest = zlib.crc32(repr((key, row["occurred_at"].timestamp())).encode())
+            if digest % self._sample_n != 0:
+                return True
+            row["sample_n"] = self._sample_n
+        return False
+
+    def release(self, row: dict[str, Any]) -> None:
+        """Hoàn lại dedup key của 1 view đã được giữ nhưng ghi thất bại (429 / 503 / rollback)."""
+        if self._dedup is not None and row["event_type"] in VIEW_EVENT_TYPES:
+            self._dedup.forget(self._key(row))
+
+
+_view_filter: Optional[ViewEventFilter] = None
+
+
+def get_view_filter() -> ViewEventFilter:
+    """Filter dùng chung cho process, cấu hình từ settings (VIEW_DEDUP_TTL_S, VIEW_DEDUP_MAX_KEYS, VIEW_SAMPLE_N)."""
+    global _view_filter
+    if _view_filter is None:
+        from app.utils.config import settings
+
+        _view_filter = ViewEventFilter(
+            dedup_ttl_seconds=settings.VIEW_DEDUP_TTL_S,
+            max_keys=settings.VIEW_DEDUP_MAX_KEYS,
+            sample_n=settings.VIEW_SAMPLE_N,
+        )
+    return _view_filter
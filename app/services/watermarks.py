@@ -0,0 +1,27 @@
+"""Bảng `cf_watermarks`: mốc (thời điểm + tham số) của các cấu trúc CF được duy trì dần."""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.models import CfWatermark
+from app.services.time_utils import utcnow
+
+
+def get_watermark(db: Session, name: str) -> Optional[CfWatermark]:
+    return db.execute(select(CfWatermark).where(CfWatermark.name == name)).scalar_one_or_none()
+
+
+def set_watermark(db: Session, name: str, value: datetime, params: Optional[dict[str, Any]] = None) -> None:
+    """Ghi / ghi đè mốc `name`. Không commit (đi cùng transaction với dữ liệu mà mốc mô tả)."""
+    stmt = pg_insert(CfWatermark).values(name=name, value=value, params=params or {}, updated_at=utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_=dict(value=stmt.excluded.value, params=stmt.excluded.params, updated_at=stmt.excluded.updated_at),
+    )
+    db.execute(stmt)
@@ -2,12 +2,63 @@
 
 from __future__ import annotations
 
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
 from app.utils.database import Base, engine
 
 
+def sync_event_types(db: Session) -> None:
+    """Upsert bảng lookup `event_types` theo EVENT_TYPE_CODES / EVENT_WEIGHTS (mã không bao giờ đổi)."""
+    from app.models.models import EventType
+    from app.services.constants import EVENT_TYPE_CODES, EVENT_WEIGHTS
+
+    stmt = pg_insert(EventType).values(
+        [{"code": code, "name": et, "weight": EVENT_WEIGHTS[et]} for et, code in EVENT_TYPE_CODES.items()]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["code"],
+        set_=dict(name=stmt.excluded.name, weight=stmt.excluded.weight),
+    )
+    db.execute(stmt)
+    db.commit()
+
+
 def init_db() -> None:
     """Create all tables defined in models."""
     # Import models so they are registered on Base.metadata
     from app import models  # noqa: F401
+    from app.services.partitions import ensure_future_partitions, is_partitioned
+    from app.utils.config import settings
 
     Base.metadata.create_all(bind=engine)
+
+    # user_interaction_events là partitioned table: cần sẵn partition cho kỳ hiện tại + vài kỳ tới
+    with Session(engine) as db:
+        sync_event_types(db)
+        event_type_sql_type = db.execute(
+            text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'user_interaction_events' AND column_name = 'event_type'"
+            )
+        ).scalar()
+        if event_type_sql_type != "smallint":
+            print("⚠️ [init_db] user_interaction_events.event_type chưa là mã smallint – chạy sql/006_compact_event_encoding.sql")
+        has_daily_updated_at = db.execute(
+            text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'user_interaction_daily' AND column_name = 'updated_at'"
+            )
+        ).scalar()
+        if not has_daily_updated_at:
+            print("⚠️ [init_db] user_interaction_daily chưa có cột updated_at – chạy sql/009_user_interaction_daily_updated_at.sql")
+
+        if is_partitioned(db):
+            ensure_future_partitions(
+                db,
+                ahead=settings.EVENTS_PARTITIONS_AHEAD,
+                interval=settings.EVENTS_PARTITION_INTERVAL,
+            )
+        else:
+            print("⚠️ [init_db] user_interaction_events chưa được partition – chạy sql/003_partition_user_interaction_events.sql")
@@ -2,12 +2,21 @@
 
 from __future__ import annotations
 
+from typing import Any
+
 from fastapi import FastAPI
 
 import asyncio
 from app.api import interactions, recommendations
 from app.utils.init_db import init_db
+from app.utils.config import settings
+from app.services.cap_counter import warm_cap_counter
+from app.services.cf_artifact import cf_artifacts
 from app.services.feature_aggregation import refresh_all_features
+from app.services.friend_graph import friend_cache
+from app.services.interaction_graph import interaction_graph
+from app.services.ingest_buffer import start_ingest_writer, stop_ingest_writer
+from app.services.ingest_spool import start_ingest_spool, stop_ingest_spool
 from app.utils.database import SessionLocal
 
 
@@ -68,12 +77,47 @@ async def self_ping_keep_alive() -> None:
 async def _startup() -> None:
     """Initialize database on startup."""
     init_db()
+    # Cap-aware ingest: nạp counters (hôm qua + hôm nay) từ DB
+    if settings.INGEST_CAP_ENABLED:
+        db = SessionLocal()
+        try:
+            loaded = await asyncio.to_thread(warm_cap_counter, db)
+            print(f"🧮 [Cap Counter] Đã nạp {loaded} keys từ DB")
+        finally:
+            db.close()
+    # Buffered ingest: khởi động background writer (group commit)
+    if settings.INGEST_MODE == "buffered":
+        start_ingest_writer()
+    # Spool ingest: mở segment mới + drainer (replay cả segment còn sót từ lần chạy trước)
+    if settings.INGEST_MODE == "spool":
+        start_ingest_spool()
+        print(f"📼 [Spool] Ghi event vào {settings.INGEST_SPOOL_DIR}, drainer đã chạy")
+    # Artifact CF: map version đang publish (nếu có) trước request đầu tiên; sau đó thread nền hot reload
+    # theo manifest (verify checksum ngoài đường request)
+    await asyncio.to_thread(cf_artifacts.refresh, force=True)
+    cf_artifacts.start()
+    # Đồ thị tương tác trong bộ nhớ: build lần đầu + đọc delta ở thread nền (chưa xong → vẫn query SQL)
+    if settings.CF_GRAPH_ENABLED:
+        interaction_graph.start()
+    # Cache bạn bè: nạp bảng friends + LISTEN friends_changed ở thread nền (chưa xong → vẫn query DB)
+    if settings.FRIEND_CACHE_ENABLED:
+        friend_cache.start()
     # Task refresh features
     asyncio.create_task(refresh_features_background_job())
     # Task keep-alive (chỉ nên bật trên Render)
     asyncio.create_task(self_ping_keep_alive())
 
 
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    """Flush buffer ingest / drain spool trước khi process thoát."""
+    await asyncio.to_thread(stop_ingest_writer)
+    await asyncio.to_thread(stop_ingest_spool)
+    await asyncio.to_thread(interaction_graph.stop, 5.0)
+    await asyncio.to_thread(friend_cache.stop, 5.0)
+    await asyncio.to_thread(cf_artifacts.stop, 5.0)
+
+
 # Include routers
 app.include_router(interactions.router)
 app.include_router(recommendations.router)
@@ -81,5 +125,17 @@ app.include_router(recommendations.router)
 
 @app.get("/health")
 def health() -> dict[str, str]:
-    """Health check endpoint."""
-    return {"status": "ok"}
+    """Health check endpoint (kèm version artifact CF đang phục vụ của worker này)."""
+    return {"status": "ok", "cf_artifact_version": cf_artifacts.active_version or "none"}
+
+
+@app.get("/health/graph")
+def health_graph() -> dict[str, Any]:
+    """Đồ thị tương tác trong bộ nhớ của worker này: kích thước, bộ nhớ, thời gian build / delta gần nhất."""
+    return interaction_graph.stats()
+
+
+@app.get("/health/friends")
+def health_friends() -> dict[str, Any]:
+    """Cache bạn bè của worker này: kích thước, bộ nhớ, hit rate, số lần invalidate / nạp lại."""
+    return friend_cache.stats()
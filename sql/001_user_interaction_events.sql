@@ -1,9 +1,14 @@
 -- PostgreSQL init for Lumi CF: user-to-user interaction events
 -- Assumes you already have a `users` table with primary key `id` (BIGINT recommended).
 -- If your users PK type/name differs, adjust the REFERENCES lines.
+--
+-- The table is range-partitioned by month on occurred_at so time-window queries only scan
+-- the partitions they need. Partitions are created ahead / expired by
+-- `app/jobs/maintain_partitions.py` (also run on app startup).
+-- Existing non-partitioned installs: see 003_partition_user_interaction_events.sql.
 
 CREATE TABLE IF NOT EXISTS user_interaction_events (
-  id              BIGSERIAL PRIMARY KEY,
+  id              BIGSERIAL,
 
   actor_user_id   BIGINT NOT NULL REFERENCES users(id),
   target_user_id  BIGINT NOT NULL REFERENCES users(id),
@@ -19,8 +24,20 @@ CREATE TABLE IF NOT EXISTS user_interaction_events (
 
   meta            JSONB NOT NULL DEFAULT '{}'::jsonb,
 
+  -- partition key must be part of the primary key
+  PRIMARY KEY (id, occurred_at),
   CONSTRAINT chk_no_self_interaction CHECK (actor_user_id <> target_user_id)
-);
+) PARTITION BY RANGE (occurred_at);
+
+-- Catch-all for events outside every range (clock skew, very old backfills)
+CREATE TABLE IF NOT EXISTS user_interaction_events_default
+  PARTITION OF user_interaction_events DEFAULT;
+
+-- Monthly partitions (UTC bounds), example for the current quarter:
+-- CREATE TABLE IF NOT EXISTS user_interaction_events_p202610
+--   PARTITION OF user_interaction_events FOR VALUES FROM ('2026-10-01 00:00:00+00') TO ('2026-11-01 00:00:00+00');
+
+-- Indexes below are created on the parent and propagated to every partition.
 
 -- Common query patterns:
 -- 1) Pull recent events by actor (training/export)
@@ -39,7 +56,6 @@ CREATE INDEX IF NOT EXISTS idx_uie_pair_time
 CREATE INDEX IF NOT EXISTS idx_uie_type_time
   ON user_interaction_events (event_type, occurred_at DESC);
 
--- Optional: if you expect huge `view` volume, you can add BRIN index by time for range scans:
--- CREATE INDEX IF NOT EXISTS brin_uie_occurred_at
---   ON user_interaction_events USING BRIN (occurred_at);
+-- Retention: partitions older than the longest window (365 days) are dropped
+-- (or detached for archiving) by app/jobs/maintain_partitions.py.
 
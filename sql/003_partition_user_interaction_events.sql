@@ -0,0 +1,86 @@
+-- Migrate an existing (non-partitioned) user_interaction_events table to monthly range partitions.
+-- Run once in a maintenance window: the copy holds locks on the old table while it runs.
+-- The old table is kept as user_interaction_events_legacy; drop it after verifying the row counts.
+-- REFERENCES users(id) from 001 are not recreated here (the ORM model has none); add them back
+-- on the new parent table if your install relies on them.
+
+BEGIN;
+
+ALTER TABLE user_interaction_events RENAME TO user_interaction_events_legacy;
+ALTER TABLE user_interaction_events_legacy RENAME CONSTRAINT user_interaction_events_pkey TO user_interaction_events_legacy_pkey;
+ALTER INDEX IF EXISTS idx_uie_actor_time RENAME TO idx_uie_legacy_actor_time;
+ALTER INDEX IF EXISTS idx_uie_target_time RENAME TO idx_uie_legacy_target_time;
+ALTER INDEX IF EXISTS idx_uie_pair_time RENAME TO idx_uie_legacy_pair_time;
+ALTER INDEX IF EXISTS idx_uie_type_time RENAME TO idx_uie_legacy_type_time;
+
+CREATE TABLE user_interaction_events (
+  id              BIGINT NOT NULL DEFAULT nextval('user_interaction_events_id_seq'),
+
+  actor_user_id   BIGINT NOT NULL,
+  target_user_id  BIGINT NOT NULL,
+
+  event_type      TEXT NOT NULL,
+  event_value     DOUBLE PRECISION,
+
+  content_id      BIGINT,
+  session_id      TEXT,
+
+  occurred_at     TIMESTAMPTZ NOT NULL,
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+  meta            JSONB NOT NULL DEFAULT '{}'::jsonb,
+
+  PRIMARY KEY (id, occurred_at),
+  CONSTRAINT chk_no_self_interaction CHECK (actor_user_id <> target_user_id)
+) PARTITION BY RANGE (occurred_at);
+
+-- The id sequence (created by BIGSERIAL/SERIAL on the old table) now belongs to the new table
+ALTER SEQUENCE user_interaction_events_id_seq AS BIGINT;
+ALTER SEQUENCE user_interaction_events_id_seq OWNED BY user_interaction_events.id;
+ALTER TABLE user_interaction_events_legacy ALTER COLUMN id DROP DEFAULT;
+
+CREATE TABLE user_interaction_events_default PARTITION OF user_interaction_events DEFAULT;
+
+-- One partition per month from the oldest event up to 3 months ahead
+DO $$
+DECLARE
+  m DATE;
+  last_month DATE := date_trunc('month', now() AT TIME ZONE 'UTC')::date + INTERVAL '3 months';
+BEGIN
+  SELECT date_trunc('month', min(occurred_at) AT TIME ZONE 'UTC')::date INTO m FROM user_interaction_events_legacy;
+  m := COALESCE(m, date_trunc('month', now() AT TIME ZONE 'UTC')::date);
+  WHILE m <= last_month LOOP
+    EXECUTE format(
+      'CREATE TABLE IF NOT EXISTS %I PARTITION OF user_interaction_events FOR VALUES FROM (%L) TO (%L)',
+      'user_interaction_events_p' || to_char(m, 'YYYYMM'),
+      m::text || ' 00:00:00+00',
+      (m + INTERVAL '1 month')::date::text || ' 00:00:00+00'
+    );
+    m := (m + INTERVAL '1 month')::date;
+  END LOOP;
+END $$;
+
+INSERT INTO user_interaction_events (
+  id, actor_user_id, target_user_id, event_type, event_value,
+  content_id, session_id, occurred_at, created_at, meta
+)
+SELECT
+  id, actor_user_id, target_user_id, event_type, event_value,
+  content_id, session_id, occurred_at, created_at, meta::jsonb
+FROM user_interaction_events_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_uie_actor_time
+  ON user_interaction_events (actor_user_id, occurred_at DESC);
+CREATE INDEX IF NOT EXISTS idx_uie_target_time
+  ON user_interaction_events (target_user_id, occurred_at DESC);
+CREATE INDEX IF NOT EXISTS idx_uie_pair_time
+  ON user_interaction_events (actor_user_id, target_user_id, occurred_at DESC);
+CREATE INDEX IF NOT EXISTS idx_uie_type_time
+  ON user_interaction_events (event_type, occurred_at DESC);
+
+ANALYZE user_interaction_events;
+
+COMMIT;
+
+-- After verification:
+-- DROP TABLE user_interaction_events_legacy;
@@ -0,0 +1,56 @@
+-- Daily rollup of user_interaction_events, maintained at ingest time (every write path upserts
+-- count + max(occurred_at) in the same transaction as the raw rows).
+-- Readers (pair scores, engagement, 2-hop/popular recommendations) scan this table instead of
+-- GROUP BY over raw events. content_id = 0 when the event has no content.
+-- event_count also includes events collapsed by cap-aware ingest (no raw row).
+
+CREATE TABLE IF NOT EXISTS user_interaction_daily (
+  actor_user_id     BIGINT NOT NULL,
+  target_user_id    BIGINT NOT NULL,
+  content_id        BIGINT NOT NULL DEFAULT 0,
+  event_type        TEXT NOT NULL,
+  day               DATE NOT NULL,               -- UTC day of occurred_at
+
+  event_count       INTEGER NOT NULL DEFAULT 0,
+  last_occurred_at  TIMESTAMPTZ NOT NULL,
+
+  PRIMARY KEY (actor_user_id, target_user_id, content_id, event_type, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_uid_day
+  ON user_interaction_daily (day);
+
+CREATE INDEX IF NOT EXISTS idx_uid_actor_day
+  ON user_interaction_daily (actor_user_id, day);
+
+CREATE INDEX IF NOT EXISTS idx_uid_target_day
+  ON user_interaction_daily (target_user_id, day);
+
+CREATE INDEX IF NOT EXISTS idx_uid_content_day
+  ON user_interaction_daily (content_id, day);
+
+-- Initial fill from existing raw events (same as `python app/jobs/rebuild_daily_agg.py --days 365`)
+INSERT INTO user_interaction_daily
+  (actor_user_id, target_user_id, content_id, event_type, day, event_count, last_occurred_at)
+SELECT actor_user_id, target_user_id, COALESCE(content_id, 0), event_type,
+       (occurred_at AT TIME ZONE 'UTC')::date, count(*), max(occurred_at)
+FROM user_interaction_events
+WHERE occurred_at >= now() - INTERVAL '365 days'
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (actor_user_id, target_user_id, content_id, event_type, day) DO UPDATE SET
+  event_count = GREATEST(user_interaction_daily.event_count, EXCLUDED.event_count),
+  last_occurred_at = GREATEST(user_interaction_daily.last_occurred_at, EXCLUDED.last_occurred_at);
+
+-- Counts of capped events previously kept in user_interaction_overflow (if that table exists)
+DO $$
+BEGIN
+  IF to_regclass('user_interaction_overflow') IS NOT NULL THEN
+    UPDATE user_interaction_daily d
+    SET event_count = d.event_count + o.overflow_count,
+        last_occurred_at = GREATEST(d.last_occurred_at, o.last_occurred_at)
+    FROM user_interaction_overflow o
+    WHERE d.actor_user_id = o.actor_user_id AND d.target_user_id = o.target_user_id
+      AND d.content_id = o.content_id AND d.event_type = o.event_type AND d.day = o.day;
+    DROP TABLE user_interaction_overflow;
+  END IF;
+END $$;
@@ -0,0 +1,13 @@
+-- Drain offsets for the local ingest spool (INGEST_MODE=spool, see app/services/ingest_spool.py).
+-- The drainer COPYs a range of segment lines and advances byte_offset in the same transaction,
+-- so a crash at any point replays from the last committed offset without duplicating events.
+-- Rows are removed once the segment file has been fully drained and deleted.
+
+CREATE TABLE IF NOT EXISTS ingest_spool_offsets (
+  spool_id     TEXT NOT NULL,                 -- INGEST_SPOOL_ID (default: hostname)
+  segment      TEXT NOT NULL,                 -- segment file name
+  byte_offset  BIGINT NOT NULL DEFAULT 0,
+  updated_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+  PRIMARY KEY (spool_id, segment)
+);
@@ -0,0 +1,93 @@
+-- Compact event encoding:
+--   * event_type TEXT → SMALLINT code (lookup table event_types, codes from EVENT_TYPE_CODES in
+--     app/services/constants.py – append-only, never renumbered) on the raw events and the daily rollup
+--   * session_id / meta move out of user_interaction_events into user_interaction_event_meta
+--     (only events that carry one of them get a row)
+-- Narrower rows → more rows per page, smaller type index, cheaper GROUP BY event_type.
+-- Safe to re-run: every step checks the current column type / presence first.
+-- Both ALTERs rewrite their table; run in a maintenance window (after 003/004).
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS event_types (
+  code    SMALLINT PRIMARY KEY,
+  name    TEXT NOT NULL UNIQUE,
+  weight  DOUBLE PRECISION NOT NULL
+);
+
+INSERT INTO event_types (code, name, weight) VALUES
+  (1, 'message', 2.0),
+  (2, 'comment_post', 2.0),
+  (3, 'comment_reel', 2.0),
+  (4, 'share_post', 1.5),
+  (5, 'like_post', 1.0),
+  (6, 'like_reel', 1.0),
+  (7, 'view_profile', 1.0),
+  (8, 'view_post', 0.1),
+  (9, 'view_reel', 0.1)
+ON CONFLICT (code) DO UPDATE SET name = EXCLUDED.name, weight = EXCLUDED.weight;
+
+CREATE TABLE IF NOT EXISTS user_interaction_event_meta (
+  event_id     BIGINT NOT NULL,
+  occurred_at  TIMESTAMPTZ NOT NULL,
+  session_id   TEXT,
+  meta         JSONB NOT NULL DEFAULT '{}'::jsonb,
+
+  PRIMARY KEY (event_id, occurred_at)
+);
+
+CREATE INDEX IF NOT EXISTS idx_uiem_occurred_at
+  ON user_interaction_event_meta (occurred_at);
+
+-- 1) session_id / meta → side table, then drop them (before the type change so its rewrite reclaims the space)
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'user_interaction_events' AND column_name = 'meta'
+  ) THEN
+    INSERT INTO user_interaction_event_meta (event_id, occurred_at, session_id, meta)
+    SELECT id, occurred_at, session_id, meta::jsonb
+    FROM user_interaction_events
+    WHERE session_id IS NOT NULL OR meta::jsonb <> '{}'::jsonb
+    ON CONFLICT DO NOTHING;
+
+    ALTER TABLE user_interaction_events DROP COLUMN session_id, DROP COLUMN meta;
+  END IF;
+END $$;
+
+-- 2) event_type TEXT → SMALLINT on raw events and the daily rollup
+DO $$
+DECLARE
+  t TEXT;
+  unmapped TEXT;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['user_interaction_events', 'user_interaction_daily'] LOOP
+    IF (
+      SELECT data_type FROM information_schema.columns
+      WHERE table_name = t AND column_name = 'event_type'
+    ) = 'text' THEN
+      -- EXECUTE does not set FOUND: read the first unmapped value into a variable instead
+      EXECUTE format(
+        'SELECT event_type FROM %I WHERE lower(trim(event_type)) NOT IN (SELECT name FROM event_types) LIMIT 1', t
+      ) INTO unmapped;
+      IF unmapped IS NOT NULL THEN
+        RAISE EXCEPTION '% has event_type values without a code in event_types (e.g. %); map or delete them first',
+          t, unmapped;
+      END IF;
+      EXECUTE format(
+        'ALTER TABLE %I ALTER COLUMN event_type TYPE SMALLINT USING '
+        '(CASE lower(trim(event_type)) '
+        'WHEN ''message'' THEN 1 WHEN ''comment_post'' THEN 2 WHEN ''comment_reel'' THEN 3 '
+        'WHEN ''share_post'' THEN 4 WHEN ''like_post'' THEN 5 WHEN ''like_reel'' THEN 6 '
+        'WHEN ''view_profile'' THEN 7 WHEN ''view_post'' THEN 8 WHEN ''view_reel'' THEN 9 END)::smallint',
+        t
+      );
+    END IF;
+  END LOOP;
+END $$;
+
+ANALYZE user_interaction_events;
+ANALYZE user_interaction_daily;
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- Materialized (actor, target) scores, updated incrementally at ingest (PAIR_SCORES_ENABLED,
+-- see app/services/pair_scores.py). Half-life decay is multiplicative, so a pair is stored as
+-- (score, as_of) and read at time t as score * 2^(-(t - as_of) / PAIR_SCORES_HALF_LIFE_DAYS).
+-- Fill / refresh with: python app/jobs/rebuild_pair_scores.py (writes the cf_watermarks row
+-- that readers check before switching from the rollup scan to this table).
+
+CREATE TABLE IF NOT EXISTS user_pair_scores (
+  actor_user_id        BIGINT NOT NULL,
+  target_user_id       BIGINT NOT NULL,
+  score                DOUBLE PRECISION NOT NULL DEFAULT 0,
+  as_of                TIMESTAMPTZ NOT NULL,
+  last_interaction_at  TIMESTAMPTZ NOT NULL,
+  updated_at           TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+  PRIMARY KEY (actor_user_id, target_user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ups_last_interaction
+  ON user_pair_scores (last_interaction_at);
+
+CREATE TABLE IF NOT EXISTS cf_watermarks (
+  name        TEXT PRIMARY KEY,
+  value       TIMESTAMPTZ NOT NULL,
+  params      JSON NOT NULL DEFAULT '{}',
+  updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
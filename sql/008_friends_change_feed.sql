@@ -0,0 +1,34 @@
+-- Change feed for the in-process friend cache (FRIEND_CACHE_ENABLED, see app/services/friend_graph.py).
+-- Every insert / update / delete on friends sends NOTIFY friends_changed with payload
+-- "I,<user_id>,<friend_id>" or "D,<user_id>,<friend_id>"; TRUNCATE sends "T". API workers LISTEN and
+-- invalidate the two users involved (TRUNCATE → full reload). Without this trigger the cache is only
+-- refreshed every FRIEND_CACHE_TTL_S seconds.
+
+-- Reverse lookups (friend_id = u) when reading friends in both directions
+CREATE INDEX IF NOT EXISTS idx_friends_friend_id ON friends (friend_id);
+
+CREATE OR REPLACE FUNCTION notify_friends_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    PERFORM pg_notify('friends_changed', 'T');
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM pg_notify('friends_changed', 'D,' || OLD.user_id || ',' || OLD.friend_id);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM pg_notify('friends_changed', 'I,' || NEW.user_id || ',' || NEW.friend_id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_friends_changed ON friends;
+CREATE TRIGGER trg_friends_changed
+  AFTER INSERT OR UPDATE OR DELETE ON friends
+  FOR EACH ROW EXECUTE FUNCTION notify_friends_changed();
+
+DROP TRIGGER IF EXISTS trg_friends_truncated ON friends;
+CREATE TRIGGER trg_friends_truncated
+  AFTER TRUNCATE ON friends
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_friends_changed();
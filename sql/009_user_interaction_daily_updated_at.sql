@@ -0,0 +1,10 @@
+-- Ingest time of the last change to each rollup row (set by every write path that upserts the
+-- rollup). Incremental CF training (app/jobs/train_cf.py --incremental) picks dirty actors by
+-- this column, so backfilled events and late spool drains with an old occurred_at are still seen.
+-- Existing rows get the migration time: the first incremental run afterwards recomputes everyone.
+
+ALTER TABLE user_interaction_daily
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS idx_uid_updated_at
+  ON user_interaction_daily (updated_at);
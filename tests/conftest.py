@@ -0,0 +1,35 @@
+"""
+Fixtures chung. Test cần Postgres (biểu thức SQL, user_pair_scores) chạy trên DB của app/utils/database.py
+trong 1 transaction bị rollback sau mỗi test; không kết nối được → skip.
+"""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add project root to path (chạy pytest từ bất kỳ đâu)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+@pytest.fixture
+def db():
+    """Session trên 1 transaction ngoài: db.commit() chỉ commit savepoint, cuối test rollback toàn bộ."""
+    from sqlalchemy.orm import Session
+
+    from app.utils.database import engine
+
+    try:
+        conn = engine.connect()
+    except Exception as e:  # pragma: no cover - môi trường không có DB
+        pytest.skip(f"Postgres không truy cập được: {e}")
+    outer = conn.begin()
+    session = Session(bind=conn, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        outer.rollback()
+        conn.close()
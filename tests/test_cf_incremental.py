@@ -0,0 +1,93 @@
+"""Cập nhật dần artifact CF (chỉ aggregate lại actor dirty, vá vào M đã lưu) phải khớp train toàn bộ."""
+
+from __future__ import annotations
+
+import dataclasses
+import random
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+from app.services.cf_artifact import dirty_actor_ids, refresh_cf_artifact, train_cf_artifact
+from app.services.constants import EVENT_TYPE_CODES
+from app.services.daily_agg import DailyRollup, upsert_daily_rows
+from app.services.ingest import normalize_event
+from app.services.time_utils import half_life_decay, utcnow
+
+# User riêng cho test (transaction bị rollback, không đụng dữ liệu thật)
+ACTORS = range(990_300_001, 990_300_021)
+TARGETS = range(990_300_101, 990_300_131)
+OTHER_TARGETS = range(990_300_201, 990_300_211)  # chỉ actor không dirty tương tác → hàng của họ không bị tính lại
+WINDOW_DAYS = 30
+PARAMS = dict(window_days=WINDOW_DAYS, neighbor_k=10, rec_k=20, topk_per_actor=50)
+
+
+def _events(rng: random.Random, actors, *, min_age: int, max_age: int, targets=TARGETS) -> list[dict]:
+    return [
+        normalize_event(
+            actor_user_id=actor,
+            target_user_id=rng.choice(targets),
+            event_type=rng.choice(sorted(EVENT_TYPE_CODES)),
+            timestamp=utcnow() - timedelta(days=rng.randint(min_age, max_age), seconds=rng.randint(0, 86_399)),
+        )
+        for actor in actors
+        for _ in range(rng.randint(1, 8))
+    ]
+
+
+def _assert_same(got, want):
+    assert np.array_equal(got.user_ids, want.user_ids)
+    for name in ("nb", "rec"):
+        indptr, ids, scores = (np.asarray(getattr(got, f"{name}_{f}")) for f in ("indptr", "ids", "scores"))
+        w_indptr, w_ids, w_scores = (np.asarray(getattr(want, f"{name}_{f}")) for f in ("indptr", "ids", "scores"))
+        assert np.array_equal(indptr, w_indptr), name
+        assert np.array_equal(ids, w_ids), name
+        np.testing.assert_allclose(scores, w_scores, rtol=1e-5)
+
+
+@pytest.fixture
+def graph(db):
+    ids = [*ACTORS, *TARGETS, *OTHER_TARGETS]
+    db.execute(text("DELETE FROM user_interaction_daily WHERE actor_user_id = ANY(:ids)"), {"ids": ids})
+    rng = random.Random(5)
+    events = _events(rng, ACTORS[:10], min_age=0, max_age=25)
+    events += _events(rng, ACTORS[10:15], min_age=0, max_age=25, targets=OTHER_TARGETS)
+    upsert_daily_rows(db, DailyRollup().extend(events).rows())
+    # Cả test chạy trong 1 transaction (now() không đổi) → lùi updated_at để các row này không còn "mới"
+    db.execute(
+        text("UPDATE user_interaction_daily SET updated_at = now() - interval '1 hour' WHERE actor_user_id = ANY(:ids)"),
+        {"ids": ids},
+    )
+    return db
+
+
+def test_refresh_matches_full_train(graph):
+    base = train_cf_artifact(graph, **PARAMS)
+    assert base.has_matrix
+    # Base như thể train hôm qua: M dời về mốc decay cũ, refresh phải dời lại tới hôm nay
+    yesterday = utcnow().date() - timedelta(days=1)
+    shift = half_life_decay(1.0, half_life_days=base.half_life_days)
+    base = dataclasses.replace(
+        base, ref_day=yesterday.isoformat(), m_scores=(base.m_scores.astype(np.float64) / shift).astype(np.float32)
+    )
+    since = graph.execute(text("SELECT now()")).scalar_one()
+
+    rng = random.Random(6)
+    events = _events(rng, ACTORS[15:], min_age=0, max_age=3)  # actor mới
+    events += _events(rng, ACTORS[:3], min_age=0, max_age=0)
+    backfill = _events(rng, ACTORS[3:5], min_age=20, max_age=22)  # ghi bù: occurred_at cũ
+    upsert_daily_rows(graph, DailyRollup().extend(events + backfill).rows())
+
+    dirty = set(dirty_actor_ids(graph, since=since, window_days=WINDOW_DAYS, overlap_s=0).tolist())
+    assert dirty == {*ACTORS[:5], *ACTORS[15:]}
+
+    got, recomputed = refresh_cf_artifact(graph, base, since=since, topk_per_actor=PARAMS["topk_per_actor"])
+    want = train_cf_artifact(graph, **PARAMS)
+
+    assert 0 < recomputed < len(want)
+    _assert_same(got, want)
+    assert np.array_equal(got.m_indptr, want.m_indptr)
+    assert np.array_equal(got.m_targets, want.m_targets)
+    np.testing.assert_allclose(got.m_scores, want.m_scores, rtol=1e-5)
@@ -0,0 +1,111 @@
+"""user_pair_scores cập nhật dần lúc ingest (và khi dời window) phải khớp rebuild_pair_scores tính 1 lần từ rollup."""
+
+from __future__ import annotations
+
+import random
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app.services.constants import EVENT_TYPE_CODES
+from app.services.daily_agg import DailyRollup, upsert_daily_rows
+from app.services.ingest import normalize_event
+from app.services.pair_scores import day_start, pair_store_ready, rebuild_pair_scores, slide_pair_window
+from app.services.time_utils import utcnow
+from app.utils.config import settings
+
+# Actor / target riêng cho test (transaction bị rollback, không đụng dữ liệu thật)
+ACTORS = range(990_000_001, 990_000_005)
+TARGETS = range(990_000_101, 990_000_106)
+
+_SCORES_AT_SQL = text(
+    """
+    SELECT actor_user_id, target_user_id,
+           score * power(2.0, -extract(epoch FROM CAST(:ref AS timestamptz) - as_of)::float8 / 86400.0 / :hl)
+    FROM user_pair_scores
+    WHERE actor_user_id BETWEEN :lo AND :hi
+    """
+)
+
+
+def _events(seed: int, n: int) -> list[dict]:
+    """n event ngẫu nhiên trong 20 ngày gần nhất, đủ mọi loại (count vượt cap ở vài cặp)."""
+    rng = random.Random(seed)
+    now = utcnow()
+    types = sorted(EVENT_TYPE_CODES)
+    return [
+        normalize_event(
+            actor_user_id=rng.choice(ACTORS),
+            target_user_id=rng.choice(TARGETS),
+            event_type=rng.choice(types),
+            timestamp=now - timedelta(days=rng.randint(0, 19), seconds=rng.randint(0, 86_399)),
+        )
+        for _ in range(n)
+    ]
+
+
+def _scores(db) -> dict[tuple[int, int], float]:
+    rows = db.execute(
+        _SCORES_AT_SQL,
+        {
+            "ref": day_start(utcnow().date()),
+            "hl": settings.PAIR_SCORES_HALF_LIFE_DAYS,
+            "lo": ACTORS[0],
+            "hi": ACTORS[-1],
+        },
+    ).all()
+    return {(int(a), int(t)): float(s) for a, t, s in rows}
+
+
+@pytest.fixture
+def store(db, monkeypatch):
+    monkeypatch.setattr(settings, "PAIR_SCORES_ENABLED", True)
+    bounds = {"lo": ACTORS[0], "hi": ACTORS[-1]}
+    db.execute(text("DELETE FROM user_interaction_daily WHERE actor_user_id BETWEEN :lo AND :hi"), bounds)
+    db.execute(text("DELETE FROM user_pair_scores WHERE actor_user_id BETWEEN :lo AND :hi"), bounds)
+    return db
+
+
+def test_incremental_pair_scores_match_rebuild(store):
+    db = store
+    # Nhiều batch, ngày không theo thứ tự (event ghi bù), cùng cặp xuất hiện ở nhiều batch
+    events = _events(seed=7, n=600)
+    random.Random(1).shuffle(events)
+    for start in range(0, len(events), 37):
+        upsert_daily_rows(db, DailyRollup().extend(events[start : start + 37]).rows())
+    incremental = _scores(db)
+    assert incremental
+
+    rebuild_pair_scores(db, window_days=30)
+    rebuilt = _scores(db)
+
+    assert incremental.keys() == rebuilt.keys()
+    for pair, score in rebuilt.items():
+        assert incremental[pair] == pytest.approx(score, rel=1e-9)
+
+
+def test_slid_window_matches_rebuild(store):
+    db = store
+    today = utcnow().date()
+    upsert_daily_rows(db, DailyRollup().extend(_events(seed=3, n=600)).rows())
+    rebuild_pair_scores(db, window_days=20)
+    assert pair_store_ready(db, half_life_days=settings.PAIR_SCORES_HALF_LIFE_DAYS, window_days=20)
+
+    # 5 ngày sau: [hôm nay - 20, hôm nay - 15) rơi khỏi window 20 ngày
+    assert slide_pair_window(db, today=today + timedelta(days=5)) == 5
+    assert not pair_store_ready(db, half_life_days=settings.PAIR_SCORES_HALF_LIFE_DAYS, window_days=20)
+    # Event ghi bù cho ngày đã rơi khỏi window không được cộng vào store
+    late = [e for e in _events(seed=4, n=200) if e["occurred_at"].date() < today - timedelta(days=15)]
+    assert late
+    before = _scores(db)
+    upsert_daily_rows(db, DailyRollup().extend(late).rows())
+    assert _scores(db) == before
+    slid = _scores(db)
+
+    # Store lúc này = các ngày >= hôm nay - 15 = rebuild với window 15 ngày
+    rebuild_pair_scores(db, window_days=15)
+    rebuilt = _scores(db)
+    assert rebuilt
+    for pair, score in slid.items():
+        assert score == pytest.approx(rebuilt.get(pair, 0.0), rel=1e-9, abs=1e-9)
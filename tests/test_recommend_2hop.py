@@ -0,0 +1,103 @@
+"""Đề xuất 2-hop trong 1 câu SQL (kèm nhánh popular_fallback) phải khớp bản tham chiếu Python."""
+
+from __future__ import annotations
+
+import random
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app.services.constants import EVENT_TYPE_CODES
+from app.services.daily_agg import DailyRollup, upsert_daily_rows
+from app.services.ingest import normalize_event
+from app.services.recommend_db import (
+    recommend_users_neighbors_2hop_reference,
+    recommend_users_neighbors_2hop_weighted,
+)
+from app.services.time_utils import utcnow
+
+# User riêng cho test (transaction bị rollback, không đụng dữ liệu thật)
+USER = 990_200_001
+LONELY_USER = 990_200_002
+NEIGHBORS = range(990_200_011, 990_200_019)
+TARGETS = range(990_200_101, 990_200_131)
+FRIENDS = (990_200_101, 990_200_102)
+WINDOW_DAYS = 30
+
+
+def _event(rng: random.Random, actor: int, target: int) -> dict:
+    return normalize_event(
+        actor_user_id=actor,
+        target_user_id=target,
+        event_type=rng.choice(sorted(EVENT_TYPE_CODES)),
+        timestamp=utcnow() - timedelta(days=rng.randint(0, WINDOW_DAYS - 2), seconds=rng.randint(0, 86_399)),
+    )
+
+
+@pytest.fixture
+def graph(db):
+    """USER tương tác 6 target đầu; mỗi neighbor chia sẻ vài target đó và tương tác thêm target khác."""
+    ids = [USER, LONELY_USER, *NEIGHBORS, *TARGETS]
+    db.execute(text("DELETE FROM user_interaction_daily WHERE actor_user_id = ANY(:ids)"), {"ids": ids})
+    db.execute(text("DELETE FROM friends WHERE user_id = ANY(:ids) OR friend_id = ANY(:ids)"), {"ids": ids})
+    db.execute(text("DELETE FROM users WHERE id = ANY(:ids)"), {"ids": ids})
+    db.execute(
+        text(
+            "INSERT INTO users (id, username, email, password_hash, role, created_at, name) "
+            "SELECT i, 'test_' || i, 'test_' || i || '@example.com', '-', 'user', now(), 'test' FROM unnest(:ids) AS i"
+        ),
+        {"ids": ids},
+    )
+    # Bạn bè lưu 1 chiều: 1 quan hệ mỗi chiều
+    db.execute(
+        text("INSERT INTO friends (user_id, friend_id, created_at) VALUES (:u, :a, now()), (:b, :u, now())"),
+        {"u": USER, "a": FRIENDS[0], "b": FRIENDS[1]},
+    )
+
+    rng = random.Random(11)
+    seen = TARGETS[:6]
+    events = [_event(rng, USER, t) for t in seen for _ in range(rng.randint(1, 3))]
+    for nb in NEIGHBORS:
+        shared = rng.sample(seen, rng.randint(1, len(seen)))
+        others = rng.sample(TARGETS[6:], 5) + list(FRIENDS)
+        for t in shared + others:
+            events.extend(_event(rng, nb, t) for _ in range(rng.randint(1, 12)))
+    upsert_daily_rows(db, DailyRollup().extend(events).rows())
+    return db
+
+
+def _assert_same(got, want):
+    assert [(r.user_id, r.reason) for r in got] == [(r.user_id, r.reason) for r in want]
+    for g, w in zip(got, want):
+        assert g.score == pytest.approx(w.score, rel=1e-6)
+
+
+@pytest.mark.parametrize("k,neighbor_k", [(50, 50), (5, 3)])
+def test_2hop_matches_reference(graph, k, neighbor_k):
+    kwargs = dict(user_id=USER, k=k, window_days=WINDOW_DAYS, neighbor_k=neighbor_k, popular_fallback=True)
+    got, _ = recommend_users_neighbors_2hop_weighted(graph, **kwargs)
+    want, _ = recommend_users_neighbors_2hop_reference(graph, **kwargs)
+
+    assert got and all(r.reason == "neighbors_2hop_weighted" for r in got)
+    excluded = set(TARGETS[:6]) | set(FRIENDS) | {USER}
+    assert not excluded & {r.user_id for r in got}
+    _assert_same(got, want)
+
+
+def test_popular_fallback_matches_reference(graph):
+    # LONELY_USER không có tương tác → không neighbor nào → nhánh popular (loại bạn bè + chính user)
+    graph.execute(
+        text("INSERT INTO friends (user_id, friend_id, created_at) VALUES (:u, :f, now())"),
+        {"u": LONELY_USER, "f": TARGETS[6]},
+    )
+    kwargs = dict(user_id=LONELY_USER, k=20, window_days=WINDOW_DAYS, neighbor_k=10, popular_fallback=True)
+    got, _ = recommend_users_neighbors_2hop_weighted(graph, **kwargs)
+    want, _ = recommend_users_neighbors_2hop_reference(graph, **kwargs)
+
+    assert got and all(r.reason == "popular_fallback" for r in got)
+    assert TARGETS[6] not in {r.user_id for r in got}
+    _assert_same(got, want)
+
+    no_fallback, _ = recommend_users_neighbors_2hop_weighted(graph, **{**kwargs, "popular_fallback": False})
+    assert no_fallback == []
@@ -0,0 +1,67 @@
+"""Biểu thức SQL của scoring (dùng trong recommend 2-hop / popular) phải khớp bản Python tham chiếu."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+from sqlalchemy import Float, Integer, SmallInteger, literal, select
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.services.constants import EVENT_TYPE_CODES, cap_for_event
+from app.services.scoring import (
+    event_score_from_count,
+    event_scores_from_counts,
+    sql_days_ago,
+    sql_event_score,
+    sql_half_life_decay,
+)
+from app.services.time_utils import days_ago, half_life_decay
+
+REF = datetime(2026, 10, 17, 12, 30, tzinfo=timezone.utc)
+
+
+def _counts(event_type: str) -> list[int]:
+    """Count quanh cap + 0 và giá trị lớn."""
+    cap = cap_for_event(event_type)
+    return sorted({0, 1, 2, 3, max(cap // 3, 1), cap - 1, cap, cap + 1, 10 * cap})
+
+
+def _eval(db, expr: ColumnElement) -> float:
+    return float(db.execute(select(expr)).scalar_one())
+
+
+@pytest.mark.parametrize("event_type", sorted(EVENT_TYPE_CODES))
+def test_event_scores_from_counts_matches_scalar(event_type):
+    counts = _counts(event_type)
+    code = EVENT_TYPE_CODES[event_type]
+    got = event_scores_from_counts(np.full(len(counts), code), np.array(counts))
+    expected = [event_score_from_count(event_type, c) for c in counts]
+    assert got.tolist() == expected
+
+
+@pytest.mark.parametrize("event_type", sorted(EVENT_TYPE_CODES))
+def test_sql_event_score_matches_python(db, event_type):
+    code = EVENT_TYPE_CODES[event_type]
+    for count in _counts(event_type):
+        expr = sql_event_score(literal(code, SmallInteger), literal(count, Integer))
+        assert _eval(db, expr) == pytest.approx(event_score_from_count(event_type, count), rel=1e-12, abs=1e-12)
+
+
+def test_sql_event_score_unknown_code_is_zero(db):
+    assert _eval(db, sql_event_score(literal(0, SmallInteger), literal(5, Integer))) == 0.0
+
+
+@pytest.mark.parametrize("half_life_days", [0.0, 7.0, 30.0])
+@pytest.mark.parametrize("days", [-1.0, 0.0, 0.25, 1.0, 7.0, 30.0, 95.5])
+def test_sql_half_life_decay_matches_python(db, days, half_life_days):
+    expr = sql_half_life_decay(literal(days, Float), half_life_days=half_life_days)
+    assert _eval(db, expr) == pytest.approx(half_life_decay(days, half_life_days=half_life_days), rel=1e-12)
+
+
+@pytest.mark.parametrize("age", [timedelta(0), timedelta(hours=5), timedelta(days=3, minutes=7), timedelta(days=-1)])
+def test_sql_days_ago_matches_python(db, age):
+    when = REF - age
+    expr = sql_days_ago(literal(when), ref=REF)
+    assert _eval(db, expr) == pytest.approx(days_ago(when, ref=REF), rel=1e-12, abs=1e-12)
@@ -0,0 +1,42 @@
+"""View giữ lại sau sampling 1/N được tính N lần vào rollup; view không qua sampling tính 1 lần."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+from app.services.daily_agg import DailyRollup
+from app.services.ingest import normalize_event
+from app.services.time_utils import utcnow
+from app.services.view_filter import ViewEventFilter
+
+
+def _rows(event_type: str, n: int) -> list[dict]:
+    now = utcnow()
+    return [
+        normalize_event(actor_user_id=1, target_user_id=2, event_type=event_type, timestamp=now - timedelta(seconds=i))
+        for i in range(n)
+    ]
+
+
+def _count(rows: list[dict]) -> int:
+    return sum(r["event_count"] for r in DailyRollup().extend(rows).rows())
+
+
+def test_sampled_views_are_weighted_in_rollup():
+    view_filter = ViewEventFilter(sample_n=4)
+    kept = [r for r in _rows("view_post", 400) if not view_filter.should_drop(r)]
+    assert 0 < len(kept) < 400
+    assert all(r["sample_n"] == 4 for r in kept)
+    assert _count(kept) == 4 * len(kept)
+
+
+def test_unsampled_rows_count_once():
+    # Không qua filter (backfill / dump) hoặc sampling tắt → mỗi row tính 1
+    assert _count(_rows("view_reel", 50)) == 50
+    rows = _rows("view_post", 50)
+    assert not any(ViewEventFilter(sample_n=1).should_drop(r) for r in rows)
+    assert _count(rows) == 50
+    # Event không phải view không bao giờ bị sampling / nhân trọng số
+    likes = _rows("like_post", 30)
+    assert not any(ViewEventFilter(sample_n=4).should_drop(r) for r in likes)
+    assert _count(likes) == 30